@@ -11,7 +11,13 @@ Experimental procedure:
 2. The nhf is then maintained at the desired value by the PID controller
 
 This file can be greatly improved by re-factoring it and using an OOP approach.
-Dirty implementation but it works and it is what was needed.
+Dirty implementation but it works and it is what was needed. The test itself
+is run by run_test, so that a campaign of tests can share the connection to
+the logger and the calibrations (see campaigns/run_campaign.py).
+
+The state of the test is journaled while it runs. If the process dies, running
+the script again offers to resume the unfinished test where the journal was
+recorded, if it was interrupted shortly before (see run_journal.py).
 
 Use command: 'prompt $g' to shorten command prompt
 """
@@ -34,471 +40,1255 @@ sys.path.insert(1, r"C:\\Users\\FireLab\\Desktop\\Simon\\FeedbackControl_Tempera
 from loadcell import MettlerToledoDevice
 from datalogger import DataLogger
 from PID import PID_IHF as PID
-from lamps_extract_calibrationcoeff import extract_calibrationcoeff
+from lamps_extract_calibrationcoeff import extract_calibrationcoeff, extract_lamp_models
 from hrr_extract_calibrationcoeff import hrr_extract_calibrationcoeff
+from timestamp_alignment import TimestampAligner, load_channel_delays
+from status_display import ConsoleStatus
+from telemetry import TelemetryServer, DEFAULT_PORT
+from state_estimator import ConductionKalmanFilter
+from inverse_heat_conduction import SequentialFunctionSpecification
+from dead_time_compensation import SmithPredictor
+from relay_autotune import RelayAutoTuner, load_cached_gains, save_cached_gains
+from run_metadata import read_run_metadata, update_run_metadata
+from gain_scheduling import build_gain_schedule
+from system_identification import interpolate_model
+from feedforward import NHFFeedforward
+from cascade_control import IHFObserver, InnerHeatFluxLoop
+from setpoints import SetpointRateLimiter, SetpointSchedule, load_setpoint_profile, ramp_profile
+from run_journal import RunJournal, read_journal, find_unfinished_test, confirm_resume, reopen_recorder
+from loop_watchdog import LoopWatchdog
+from channel_health import ChannelHealth, load_channel_limits
+from downsampling_pyramid import build_pyramid_for_test
 
 #####
-# CONNECT TO LOAD CELL AND DATA LOGGER AND INSTANTIATE CLASSES
+# CONNECT TO THE DATA LOGGER AND LOAD THE CALIBRATIONS
 #####
 
-# create instance of the data logger and check connection
-print("\nConnection to data logger")
-rm, logger = DataLogger().new_instrument()
+# cascade control of the lamps: "off", "gauge" (inner IHF loop on the heat
+# flux gauge @110, which has to face the lamps) or "observer" (inner IHF loop
+# on the lamp model corrected by the filtered NHF, see cascade_control.py)
+cascade_control = "off"
+
+# controlled variable: "NHF" or "surface_temperature"
+control_variable = "NHF"
+
+# setpoint profile of setpoint_profiles.json, None for a constant setpoint
+# entered at the prompt. Profiles of the controlled variable start at the
+# activation of the PID. IHF profiles replace the ramp and the PID
+setpoint_profile = None
+
+
+def connect_instruments(session=None):
+	"""
+	Configures the data logger for the air tests
+
+	Parameters:
+	----------
+	session: DataLogger
+		connection already open (e.g. by a campaign). If None, the logger is
+		connected
+
+	Returns:
+	-------
+	rm, logger: DataLogger, VisaTransport
+		session and instrument (see DataLogger.new_instrument)
+	"""
+	# create instance of the data logger and check connection
+	print("\nConnection to data logger")
+	if session is None:
+		session = DataLogger()
+	return session.new_instrument(
+		"air_10Hz_cascade" if cascade_control == "gauge" else "air_10Hz", reading_time=True)
+
+
+def load_calibrations():
+	"""
+	Regression coefficients from the latest calibration files of the lamps
+	and of the gas analysers
+	"""
+	coeff_hftovolts, coeff_voltstohf = extract_calibrationcoeff()
+	return {"coeff_hftovolts": coeff_hftovolts,
+		"coeff_voltstohf": coeff_voltstohf,
+		"coeff_hrr": hrr_extract_calibrationcoeff()}
 
 
 #####
-# REQUEST FROM THE USER THE DESIRED NHF (CONSTANT) AND THE NAME OF THE EXPERIMENT
+# REQUEST FROM THE USER THE DESIRED NHF OR SURFACE TEMPERATURE (CONSTANT) AND THE NAME OF THE EXPERIMENT
 #####
-while True:
-	try:
-		nhf_desired = float(input("\nInput nhf to be kept contant"
-			" throughout the test (kW/m2):\n"))
-		number_of_test = input("Input number of test in format XXX:\n" )
-		material = input("Input material:\n").lower()
-
-		name_of_file = f"air_{number_of_test}_{material}_{nhf_desired}kWm-2.csv"
-
-		# confirm the values entered by user
-		confirmation = input(f"\nDesired mlr = {nhf_desired} g/m2s. \nName of file: {name_of_file}.\nProceed?\n")
-		if not confirmation.lower() in ["yes", "y"]:
-			continue
-		else:
-			break
-
-	except Exception as e:
-		print("Invalid file name or nhf")
-		print(e)
-
-		# turn off the lamps and close the instrument
-		logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
-		logger.close()
-		rm.close()
-		sys.exit()
-
-name_of_folder = name_of_file.split(".csv")[0]
-full_name_of_file = os.path.join(name_of_folder, name_of_file)
-# create folder with the name of the file
-if not os.path.exists(name_of_folder):
-	os.mkdir(name_of_folder)
-# do not overwrite the file
-else:
-	print("File already exists")
-	sys.exit()
-
-
-
-####
-# INITIALIZE USEFUL PARAMETERS AND START TEST
-####
-
-print("Starting test")
-
-# experiment parameters
-time_pretesting_period = 5  # s
-time_logging_period = 0.1    # s
-surface_area = 0.09*0.09     # m2
-irradiation_rate = 0.25      # kWm-2s-1
-conductivity = 0.19          # W/mK
-h_total = 28
-
-# FPA lamps
-max_lamp_voltage = 4.5
-min_lamp_voltage = 0.25
-
-# extract regression coefficients from the latest calibration file
-coeff_hftovolts, coeff_voltstohf = extract_calibrationcoeff()
-coeff_hrr = hrr_extract_calibrationcoeff()
-
-# create arrays large enough to accomodate one hour of data at the 
-# pre-set maximum logging frequency - ugly but it works
-t_array = np.zeros(int(3600/time_logging_period))
-
-IHF_volts = np.zeros_like(t_array)
-o2_volts = np.zeros_like(t_array)
-DPT_volts = np.zeros_like(t_array)
-co_volts = np.zeros_like(t_array)
-co2_volts = np.zeros_like(t_array)
-APT_volts = np.zeros_like(t_array)
-o2_inlet_volts = np.zeros_like(t_array)
-rh_volts = np.zeros_like(t_array)
-
-TS = np.zeros_like(t_array)
-T4 = np.zeros_like(t_array)
-T8 = np.zeros_like(t_array)
-T12 = np.zeros_like(t_array)
-T16 = np.zeros_like(t_array)
-nhf = np.zeros_like(t_array)
-nhf_surfacelosses = np.zeros_like(t_array)
-nhf_mean = np.zeros_like(t_array)
-IHF = np.zeros_like(t_array)
-
-o2_percentage = np.zeros_like(t_array)
-o2_inlet_percentage = np.zeros_like(t_array)
-co_ppm = np.zeros_like(t_array)
-co2_ppm = np.zeros_like(t_array)
-Duct_TC_K = np.zeros_like(t_array)
-Ambient_TC_K = np.zeros_like(t_array)
-
-
-# PID
-PID_state = "not_active"
-PID_kp = 0.04
-PID_ki = 0.008
-PID_kd = 0.04
-PID_integral_term_array = np.zeros_like(t_array)
-PID_proportional_term_array = np.zeros_like(t_array)
-PID_derivative_term_array = np.zeros_like(t_array)
-surface_temperature_activation = 573
-
-# open csv file to write data
-with open(full_name_of_file, "w", newline = "") as handle:
-	writer = csv.writer(handle)
-	writer.writerows([['time_seconds',
-		"TSurface_K",
-		"T4_K",
-		"T8_K",
-		"T12_K",
-		"T16_K",
-		"NHF_kwm-2",
-		"NHF_surfacelosses_kwm-2",
-		"NHF_mean_kWm-2",
-		"IHF_volts", 
-		"IHF_kwm-2", 
-		"Observations", 
-		"PID_state", 
-		"O2_%", 
-		"O2_inlet_%",
-		"DPT_volts",
-		"CO_ppm", 
-		"CO2_ppm", 
-		"APT_volts", 
-		"Duct_TC_K",
-		"Ambient_TC_K", 
-		"RH_volts"]])
-
-	# record the number of readings
-	time_step = 0
-
-	# ------
-	# record temperatures for a period of 60 seconds before starting
-	# ------
-	print(f"\nGathering data for {time_pretesting_period} seconds before testing")
-	time.sleep(2)
-
-	time_start_logging = time.time()
-	previous_log = time.time()
-	while time.time() - time_start_logging < time_pretesting_period:
-
-		# enforce a maximum logging frequency given by 1/time_logging_period
-		if time.time() - previous_log < time_logging_period:
-			continue
-		else:
-
-			t_array[time_step] = time.time() - time_start_logging			
-			response_sample_temperatures = DataLogger.query_data_for_sampletemperatures(
-				logger)		
-			T4[time_step] = float(response_sample_temperatures.split(",")[0]) + 273
-			T8[time_step] = float(response_sample_temperatures.split(",")[1]) + 273
-			T12[time_step] = float(response_sample_temperatures.split(",")[2]) + 273
-			T16[time_step] = float(response_sample_temperatures.split(",")[3]) + 273
-
-			# calculate nhf using quadratic fit
-			coefficients = np.polyfit([0.004, 0.008, 0.012, 0.016],
-				[T4[time_step], T8[time_step], T12[time_step], T16[time_step]], 2)
-			polynomial = np.poly1d(coefficients)
-			initial_temperature = np.array([T4[time_step], T8[time_step],
-				T12[time_step], T16[time_step]]).mean()
-			surface_temperature = polynomial(0)
-			surface_losses = (h_total * (surface_temperature - initial_temperature))/1000
-			nhf[time_step] = - (conductivity * coefficients[1]) / 1000
-			nhf_surfacelosses[time_step] = IHF[time_step - 1] - surface_losses
-			nhf_mean[time_step] = (nhf[time_step] + nhf_surfacelosses[time_step])/2
-
-			# read HRR associated data from the logger
-			response_volts, response_temperatures = DataLogger.query_data_for_HRR(
-				logger)
-			o2_volts[time_step] = response_volts[0]
-			DPT_volts[time_step] = response_volts[1]
-			co_volts[time_step] = response_volts[2]
-			co2_volts[time_step] = response_volts[3]
-			APT_volts[time_step] = response_volts[4]
-			o2_inlet_volts[time_step] = response_volts[5]
-			rh_volts[time_step] = response_volts[6]
-			Duct_TC_K[time_step] = float(response_temperatures.split(",")[0])
-			Ambient_TC_K[time_step] = float(response_temperatures.split(",")[1])
-
-			# convert to engineering units
-			o2_percentage[time_step] = np.polyval(
-				list(coeff_hrr[0]), o2_volts[time_step])
-			o2_inlet_percentage[time_step] = np.polyval(
-				list(coeff_hrr[1]), o2_inlet_volts[time_step])
-			co_ppm[time_step] = np.polyval(
-				list(coeff_hrr[2]), co_volts[time_step])
-			co2_ppm[time_step] = np.polyval(
-				list(coeff_hrr[3]), co2_volts[time_step])
-
-			# write data to the csv file
-			if time_step == 0:
-				message = "start_logging"
-			else:
-				message = ""
-			writer.writerows([[t_array[time_step],
-				TS[time_step],
-				T4[time_step],
-				T8[time_step],
-				T12[time_step],
-				T16[time_step],
-				nhf[time_step],
-				nhf_surfacelosses[time_step],
-				nhf_mean[time_step],
-				IHF_volts[time_step],
-				IHF[time_step],
-				message,
-				PID_state,
-				o2_percentage[time_step],
-				o2_inlet_percentage[time_step],
-				DPT_volts[time_step],
-				co_ppm[time_step],
-				co2_ppm[time_step],
-				APT_volts[time_step],
-				Duct_TC_K[time_step],
-				Ambient_TC_K[time_step],
-				rh_volts[time_step]]])
-
-			previous_log = time.time()
-			time_step_lastpretest = time_step
-			time_step += 1
-
-		# end if ESC is pressed
-		if msvcrt.kbhit():
-			if ord(msvcrt.getch()) == 27:
-				break
-
-	# ------
-	# define additional parameters for start of test
-	# ------
-
-	bool_start_test = True
-	bool_PID_active = False
-	time_start_test = time.time()
-	previous_log = time_start_test
-	print("\nStarting lamps")
 
+def test_file_name(test):
+	"""
+	Name of the csv file of a test (see run_test)
+	"""
+	if test.get("setpoint_profile") is not None:
+		setpoint_description = test["setpoint_profile"]
+	elif test.get("control_variable", "NHF") == "surface_temperature":
+		setpoint_description = f"{test['setpoint']}K"
+	else:
+		setpoint_description = f"{test['setpoint']}kWm-2"
+	return f"air_{test['number_of_test']}_{test['material']}_{setpoint_description}.csv"
+
+
+def request_test(control_variable="NHF", setpoint_profile=None):
+	"""
+	Asks for the setpoint (unless there is a setpoint profile), the number of
+	the test and the material
+
+	Returns:
+	-------
+	test: dict
+		definition of the test (see run_test), None if the values are invalid
+	"""
 	while True:
 		try:
-
-			# enforce a maximum logging frequency given by 1/time_logging_period
-			if time.time() - previous_log < time_logging_period:
+			setpoint = np.nan
+			if setpoint_profile is None and control_variable == "surface_temperature":
+				setpoint = float(input("\nInput surface temperature to be kept contant"
+					" throughout the test (K):\n"))
+			elif setpoint_profile is None:
+				setpoint = float(input("\nInput nhf to be kept contant"
+					" throughout the test (kW/m2):\n"))
+			number_of_test = input("Input number of test in format XXX:\n" )
+			material = input("Input material:\n").lower()
+
+			test = {"atmosphere": "air",
+				"number_of_test": number_of_test,
+				"material": material,
+				"control_variable": control_variable,
+				"setpoint": setpoint,
+				"setpoint_profile": setpoint_profile}
+			name_of_file = test_file_name(test)
+
+			# confirm the values entered by user
+			confirmation = input(f"\nDesired {control_variable} = {setpoint_profile or setpoint}. \nName of file: {name_of_file}.\nProceed?\n")
+			if not confirmation.lower() in ["yes", "y"]:
 				continue
 			else:
+				return test
 
-				t_array[time_step] = time.time() - time_start_logging			
-				response_sample_temperatures = DataLogger.query_data_for_sampletemperatures(
-					logger)		
-				T4[time_step] = float(response_sample_temperatures.split(",")[0]) + 273
-				T8[time_step] = float(response_sample_temperatures.split(",")[1]) + 273
-				T12[time_step] = float(response_sample_temperatures.split(",")[2]) + 273
-				T16[time_step] = float(response_sample_temperatures.split(",")[3]) + 273
-
-				# calculate nhf using quadratic fit
-				coefficients = np.polyfit([0.004, 0.008, 0.012, 0.016],
-					[T4[time_step], T8[time_step], T12[time_step], T16[time_step]], 2)
-				polynomial = np.poly1d(coefficients)
-				initial_temperature = np.array([T4[time_step], T8[time_step],
-					T12[time_step], T16[time_step]]).mean()
-				surface_temperature = polynomial(0)
-				TS[time_step] = surface_temperature
-				surface_losses = (h_total * (surface_temperature - initial_temperature))/1000
-				nhf[time_step] = - (conductivity * coefficients[1]) / 1000
-				nhf_surfacelosses[time_step] = IHF[time_step] - surface_losses
-				
-				nhf_mean[time_step] = (nhf[time_step] + nhf_surfacelosses[time_step])/2
-				input_nhf = nhf_mean[time_step]
-
-				# read HRR associated data from the logger
-				response_volts, response_temperatures = DataLogger.query_data_for_HRR(
-					logger)
-				o2_volts[time_step] = response_volts[0]
-				DPT_volts[time_step] = response_volts[1]
-				co_volts[time_step] = response_volts[2]
-				co2_volts[time_step] = response_volts[3]
-				APT_volts[time_step] = response_volts[4]
-				o2_inlet_volts[time_step] = response_volts[5]
-				rh_volts[time_step] = response_volts[6]
-				Duct_TC_K[time_step] = float(response_temperatures.split(",")[0])
-				Ambient_TC_K[time_step] = float(response_temperatures.split(",")[1])
-
-				# convert to engineering units
-				o2_percentage[time_step] = np.polyval(
-					list(coeff_hrr[0]), o2_volts[time_step])
-				o2_inlet_percentage[time_step] = np.polyval(
-					list(coeff_hrr[1]), o2_inlet_volts[time_step])
-				co_ppm[time_step] = np.polyval(
-					list(coeff_hrr[2]), co_volts[time_step])
-				co2_ppm[time_step] = np.polyval(
-					list(coeff_hrr[3]), co2_volts[time_step])
-
-				# start with a ramped IHF, and once mlr reaches surface temperature, activate PID
-				if PID_state == "not_active":
-					IHF[time_step+1] = (t_array[time_step] - 
-						t_array[time_step_lastpretest]) * irradiation_rate
-					# IHF[time_step+1] = 20
-					IHF_volts[time_step+1] = np.polyval(
-						coeff_hftovolts,IHF[time_step+1])
-					voltage_output = IHF_volts[time_step+1]
-
-					if voltage_output > max_lamp_voltage:
-						voltage_output = max_lamp_voltage
-						IHF_volts[time_step+1] = max_lamp_voltage
-						IHF[time_step+1] = np.polyval(
-							coeff_voltstohf, IHF_volts[time_step+1])
-
-					if (surface_temperature > surface_temperature_activation ) and (
-						time.time() - time_start_test > 100):
-						PID_state = "active"
-						print("\n-----")
-						print("PID ACTIVE")
-						print("-----\n")
-
-						# set pid parameters
-						previous_pid_time = time.time()
-						last_error = nhf_desired - nhf_mean[time_step]
-						last_input = nhf_surfacelosses[time_step]
-						pid_integral_term = voltage_output
-						pid_proportional_term = 0
-						pid_derivative_term = 0
-
-
-				# call PID
-				elif PID_state == "active":
-					voltage_output, previous_pid_time, last_error, pid_proportional_term, \
-					pid_integral_term, pid_derivative_term = \
-											PID(
-											input_nhf, nhf_desired, previous_pid_time, 
-											last_error, last_input, pid_integral_term,
-											PID_kp, PID_ki, PID_kd,
-											max_lamp_voltage, min_lamp_voltage)
-					IHF_volts[time_step+1] = voltage_output
-					IHF[time_step+1] = np.polyval(
-						coeff_voltstohf, IHF_volts[time_step+1])
-					last_input = nhf_surfacelosses[time_step]
-
-					PID_proportional_term_array[time_step] = pid_proportional_term
-					PID_integral_term_array[time_step] = pid_integral_term
-					PID_derivative_term_array[time_step] = pid_derivative_term
-
-				# write IHF to the lamps
-				logger.write(':SOURce:VOLTage %G,(%s)' % (voltage_output, '@304'))
-
-				# write data to the csv file
-				if bool_start_test:
-					message = "start_test"
-					bool_start_test = False
-				else:
-					message = ""
-				writer.writerows([[t_array[time_step],
-					TS[time_step],
-					T4[time_step],
-					T8[time_step],
-					T12[time_step],
-					T16[time_step],
-					nhf[time_step],
-					nhf_surfacelosses[time_step],
-					nhf_mean[time_step],
-					IHF_volts[time_step],
-					IHF[time_step],
-					message,
-					PID_state,
-					o2_percentage[time_step],
-					o2_inlet_percentage[time_step],
-					DPT_volts[time_step],
-					co_ppm[time_step],
-					co2_ppm[time_step],
-					APT_volts[time_step],
-					Duct_TC_K[time_step],
-					Ambient_TC_K[time_step],
-					rh_volts[time_step]]])
-
-				# save data as a a dict in a pickle to be read and plotted by another algorithm
-				data_for_pickle = {"time":t_array,
-									"IHF": IHF,
-									"IHF_volts": IHF,
-									"TS": TS,
-									"T4": T4,
-									"T8": T8,
-									"T12": T12,
-									"T16": T16,
-									"nhf_fit": nhf,
-									"nhf_surface": nhf_surfacelosses,
-									"nhf_mean": nhf_mean,
-									"time_step": time_step,
-									"PID_proportional":PID_proportional_term_array,
-									"PID_integral": PID_integral_term_array,
-									"PID_derivative": PID_derivative_term_array,
-									"O2_volts": o2_volts,
-									"O2_percentage": o2_percentage, 
-									"O2_inlet_volts": o2_inlet_volts,
-									"o2_inlet_percentage": o2_inlet_percentage,
-									"DPT_volts": DPT_volts,
-									"CO_volts": co_volts,
-									"CO_ppm": co_ppm,
-									"CO2_volts": co2_volts, 
-									"CO2_ppm": co2_ppm, 
-									"APT_volts": APT_volts, 
-									"Duct_TC_K": Duct_TC_K,
-									"Ambient_TC_K": Ambient_TC_K, 
-									"RH_volts": rh_volts,
-									}
-				with open(f"{full_name_of_file.split('.csv')[0]}.pkl", "wb") as handle:
-					pickle.dump(data_for_pickle, handle)
-
-				# print the result of this iteration to the terminal window
-				print(f"\nPID state: {PID_state}")
-				print(f"time:{np.round(time.time() - time_start_test,2)}")
-				print(f"IHF:{np.round(IHF[time_step+1],2)}")
-				print(f"NHF fit: {np.round(nhf[time_step], 2)}")
-				print(
-					f"NHF surface:{np.round(nhf_surfacelosses[time_step], 2)}")
-				print(f"surface_temperature: {surface_temperature}")
-				print(f"Tsurface: {np.round(TS[time_step], 2)}")
-				print(f"T4:{np.round(T4[time_step], 2)}")
-				print(f"T8:{np.round(T8[time_step], 2)}")
-				print(f"T12:{np.round(T12[time_step], 2)}")
-				print(f"T16:{np.round(T16[time_step], 2)}")
-
-				previous_log = time.time()
-				time_step += 1
- 
-			# end if ESC is pressed
-			if msvcrt.kbhit():
-				if ord(msvcrt.getch()) == 27:
-					writer.writerows([["", "", "", "", "", "", "end_test"]])
-					break
-
-		## ---- handle an exception during testing and continue logging the data
 		except Exception as e:
-			print(f"\nInstantaneous error at {np.round(time.time() - time_start_logging, 2)} seconds")
-			exc_type, exc_obj, exc_tb = sys.exc_info()
-			fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-			print(exc_type, fname, exc_tb.tb_lineno)
-
-			# end if ESC is pressed
-			if msvcrt.kbhit():
-				if ord(msvcrt.getch()) == 27:
-					writer.writerows([["", "", "", "", "","", "end_test"]])
-					break
-
-
-#####
-# CLOSE CONNECTION TO THE LOGGER, TURN OFF LAMPS AND FINISH THE EXPERIMENT
-#####
+			print("Invalid file name or nhf")
+			print(e)
+			return None
+
+
+def run_test(logger, test, calibrations, resume=False):
+	"""
+	Runs one test, from the pretest period until ESC is pressed (or until its
+	duration), and turns the lamps off
+
+	Parameters:
+	----------
+	logger: VisaTransport or SocketTransport
+		data logger configured by connect_instruments
+
+	test: dict
+		"number_of_test", "material", "control_variable" ("NHF" or
+		"surface_temperature"), "setpoint" (kW/m2 or K, ignored with a
+		profile), "setpoint_profile" (None for a constant setpoint) and
+		optionally "duration" (s from the start of the lamps), "telemetry_port"
+		and "max_resume_gap" (s, see run_journal.confirm_resume)
+
+	calibrations: dict
+		see load_calibrations
+
+	resume: bool
+		continues the unfinished test of the same name from its journal
+
+	Returns:
+	-------
+	full_name_of_file: str
+		csv file of the test (None if the test already exists)
+	"""
+	control_variable = test.get("control_variable", "NHF")
+	setpoint_profile = test.get("setpoint_profile")
+	material = test["material"]
+	test_duration = test.get("duration")
+	name_of_file = test_file_name(test)
+
+	nhf_desired, Ts_desired = np.nan, np.nan
+	if setpoint_profile is not None:
+		profile = load_setpoint_profile(setpoint_profile)
+		if profile["variable"] not in [control_variable, "IHF"]:
+			raise ValueError(f"The profile {setpoint_profile} is not of {control_variable} or IHF")
+	elif control_variable == "surface_temperature":
+		Ts_desired = test["setpoint"]
+	else:
+		nhf_desired = test["setpoint"]
+
+	name_of_folder = name_of_file.split(".csv")[0]
+	full_name_of_file = os.path.join(name_of_folder, name_of_file)
+	# create folder with the name of the file
+	if not os.path.exists(name_of_folder):
+		os.mkdir(name_of_folder)
+	# do not overwrite the file
+	elif not resume:
+		print("File already exists")
+		return None
+	else:
+		_, journal_state, _ = read_journal(full_name_of_file)
+
+
+	####
+	# INITIALIZE USEFUL PARAMETERS AND START TEST
+	####
+
+	print("Starting test")
+
+	# experiment parameters
+	time_pretesting_period = 5  # s
+	time_logging_period = 0.1    # s
+	surface_area = 0.09*0.09     # m2
+	irradiation_rate = 0.25      # kWm-2s-1, ramp before the PID
+	conductivity = 0.19          # W/mK
+	diffusivity = 1.1e-7         # m2/s
+	h_total = 28
+	status_rate = 2              # Hz
+	telemetry_port = test.get("telemetry_port", DEFAULT_PORT)
+	journal_rate = 2             # Hz, records of the state for a resume
+	watchdog_deadline = 1.0      # s, the lamps are turned off if a tick takes longer
+	# input of the PID: "quadratic" (mean of the quadratic fit and surface losses)
+	# or "kalman" (filtered NHF, see state_estimator.py)
+	# or "sfs" (inverse heat conduction, see inverse_heat_conduction.py)
+	nhf_estimator = "quadratic"
+	sfs_future_time = 15         # s
+
+	# dead time compensation of the PID input with a first order plus dead time
+	# model of the nhf per lamp volt (gain in kWm-2/V, times in s)
+	smith_predictor = False
+	smith_model = {"gain": 10, "time_constant": 30, "dead_time": 5}
+
+	# relay auto-tuning of the PID after the pretest period: "off" (configured
+	# gains), "cached" (gains cached for the material, tuned if there are none)
+	# or "on" (always tuned)
+	autotune = "off"
+	autotune_relay_amplitude = 0.5   # V
+	autotune_hysteresis = 0.2        # kWm-2
+	autotune_cycles = 3
+	autotune_max_duration = 600      # s
+
+	# gain scheduling of the PID across the range of the lamps: "off", "voltage"
+	# or "IHF" (operating point used to look up the gains)
+	gain_scheduling = "off"
+	schedule_reference_voltage = 3.0 # V, where the configured gains were tuned
+
+	# feedforward of the lamp voltage from the inverse calibration and the surface
+	# losses at the current surface temperature, the PID only trims the residual.
+	# The trim has no derivative term (its input contains the IHF just sent and
+	# it chatters between the lamp limits), see feedforward.py for when the
+	# feedforward should not be enabled
+	feedforward = False
+	feedforward_kd = 0
+	h_convective = 10            # W/m2K
+	emissivity = 0.9
+
+	# inner loop of the cascade control (kp in V per kWm-2, ki in V per kWm-2s)
+	inner_loop_period = 0.02     # s
+	inner_loop_kp = 0.02
+	inner_loop_ki = 0.1
+	hf_gauge_factor = 0.0001017  # V/kW/m2
+
+	# FPA lamps
+	max_lamp_voltage = 4.5
+	min_lamp_voltage = 0.25
+
+	# regression coefficients of the calibrations (loaded once per session)
+	coeff_hftovolts = calibrations["coeff_hftovolts"]
+	coeff_voltstohf = calibrations["coeff_voltstohf"]
+	coeff_hrr = calibrations["coeff_hrr"]
+
+	# setpoints looked up at every tick (time from the start of the lamps for the
+	# IHF, from the activation of the PID for the controlled variable)
+	ramp_schedule = SetpointSchedule(ramp_profile(irradiation_rate), time_logging_period)
+	setpoint_schedule = None
+	if setpoint_profile is not None:
+		setpoint_schedule = SetpointSchedule(profile, time_logging_period)
+		if setpoint_schedule.variable == "IHF":
+			ramp_schedule = setpoint_schedule
+		elif control_variable == "surface_temperature":
+			Ts_desired = setpoint_schedule.setpoint(0)
+		else:
+			nhf_desired = setpoint_schedule.setpoint(0)
+	bool_programmed_IHF = (setpoint_schedule is not None) and (
+		setpoint_schedule.variable == "IHF")
+	previous_segment = None
+	profile_event = ""
+
+	# create arrays large enough to accomodate one hour of data at the 
+	# pre-set maximum logging frequency - ugly but it works
+	t_array = np.zeros(int(3600/time_logging_period))
+
+	IHF_volts = np.zeros_like(t_array)
+	o2_volts = np.zeros_like(t_array)
+	DPT_volts = np.zeros_like(t_array)
+	co_volts = np.zeros_like(t_array)
+	co2_volts = np.zeros_like(t_array)
+	APT_volts = np.zeros_like(t_array)
+	o2_inlet_volts = np.zeros_like(t_array)
+	rh_volts = np.zeros_like(t_array)
+
+	TS = np.zeros_like(t_array)
+	T4 = np.zeros_like(t_array)
+	T8 = np.zeros_like(t_array)
+	T12 = np.zeros_like(t_array)
+	T16 = np.zeros_like(t_array)
+	nhf = np.zeros_like(t_array)
+	nhf_surfacelosses = np.zeros_like(t_array)
+	nhf_mean = np.zeros_like(t_array)
+	IHF = np.zeros_like(t_array)
+	TS_kf = np.zeros_like(t_array)
+	nhf_kf = np.zeros_like(t_array)
+	nhf_kf_std = np.zeros_like(t_array)
+	TS_sfs = np.zeros_like(t_array)
+	nhf_sfs = np.zeros_like(t_array)
+	IHF_measured = np.zeros_like(t_array)
+
+	o2_percentage = np.zeros_like(t_array)
+	o2_inlet_percentage = np.zeros_like(t_array)
+	co_ppm = np.zeros_like(t_array)
+	co2_ppm = np.zeros_like(t_array)
+	Duct_TC_K = np.zeros_like(t_array)
+	Ambient_TC_K = np.zeros_like(t_array)
+
+	# each device is stamped with its own acquisition time and the gas analysers
+	# with their transport delay, so that all channels can be aligned while the
+	# test runs (for the live viewers) and after the test
+	acquired_channels = {
+		"sample_temperatures": ["T4_K", "T8_K", "T12_K", "T16_K"],
+		"hrr_volts": ["O2_volts", "DPT_volts", "CO_volts", "CO2_volts",
+			"APT_volts", "O2_inlet_volts", "RH_volts"],
+		"hrr_temperatures": ["Duct_TC_K", "Ambient_TC_K"]}
+	aligner = TimestampAligner(acquired_channels, load_channel_delays(),
+		capacity=len(t_array))
+
+	# streaming statistics of every channel to catch a faulty sensor during the test
+	health = ChannelHealth({**acquired_channels,
+		"heat_flux_gauge": ["IHF_measured_kWm-2"]}, load_channel_limits())
+
+	# the filter fuses the four thermocouples with the IHF sent to the lamps
+	estimator = ConductionKalmanFilter(time_logging_period, conductivity, diffusivity,
+		h_total = h_total)
+	smith = SmithPredictor(smith_model["gain"], smith_model["time_constant"],
+		smith_model["dead_time"], time_logging_period)
+
+	# the output of the PID is the IHF setpoint of the inner loop in cascade mode
+	inner_loop = InnerHeatFluxLoop(coeff_hftovolts, inner_loop_kp, inner_loop_ki,
+		max_lamp_voltage, min_lamp_voltage)
+
+	# the inverse solver gives the nhf of sfs_future_time seconds ago, each row
+	# logs the latest estimate (reprocess the test for the aligned values)
+	inverse_solver = SequentialFunctionSpecification(time_logging_period, conductivity,
+		diffusivity, future_time = sfs_future_time)
+
+
+	# PID
+	PID_state = "not_active"
+	PID_kp = 0.04
+	PID_ki = 0.008
+	PID_kd = 0.04
+	PID_integral_term_array = np.zeros_like(t_array)
+	PID_proportional_term_array = np.zeros_like(t_array)
+	PID_derivative_term_array = np.zeros_like(t_array)
+	surface_temperature_activation = 573
+
+	# surface temperature control (V/K). The PID is active from the start of the
+	# lamps and its setpoint rises from the initial surface temperature at most
+	# at Ts_max_rate, and waits while the lamps are saturated
+	PID_kp_temperature = 0.01
+	PID_ki_temperature = 0.0005
+	PID_kd_temperature = 0
+	Ts_max_rate = 0.5            # K/s
+	Ts_limiter = SetpointRateLimiter(Ts_max_rate)
+	Ts_setpoint_array = np.zeros_like(t_array)
+
+	# gains cached by the auto-tuning of previous tests with the same material
+	gains_source = "configured"
+	cached_gains = load_cached_gains("air", material)
+	if control_variable == "surface_temperature":
+		# the relay auto-tuning and the feedforward are set up for the NHF
+		PID_kp, PID_ki, PID_kd = PID_kp_temperature, PID_ki_temperature, PID_kd_temperature
+		autotune = "off"
+		feedforward = False
+	elif autotune == "cached" and cached_gains is not None:
+		PID_kp = cached_gains["kp"]
+		PID_ki = cached_gains["ki"]
+		PID_kd = cached_gains["kd"]
+		gains_source = "cached"
+		schedule_reference_voltage = cached_gains.get("bias_voltage",
+			schedule_reference_voltage)
+	if feedforward:
+		PID_kd = feedforward_kd
+	bool_autotune = ((autotune == "on") or (autotune == "cached" and cached_gains is None)
+		) and not bool_programmed_IHF
+
+	# identified response of the lamps, used by the gain scheduling and the observer
+	lamp_models = None
+	if gain_scheduling != "off" or cascade_control == "observer":
+		try:
+			lamp_models = extract_lamp_models()
+			print(f"Lamp models read from {lamp_models['file']}")
+		except (OSError, ValueError) as e:
+			print(f"\nWARNING: lamp models not read ({e})"
+				"\nThe calibration slope and the default lamp response are used\n")
+
+	# response of the lamps around the reference voltage for the IHF observer
+	observer_model = {"time_constant": 0.5, "dead_time": 0.2}
+	if lamp_models is not None:
+		observer_model = interpolate_model(lamp_models["operating_points"],
+			schedule_reference_voltage)
+	observer = IHFObserver(coeff_voltstohf, observer_model["time_constant"],
+		observer_model["dead_time"])
+
+	# record the parameters of the test
+	update_run_metadata(full_name_of_file, {"test": name_of_file,
+		"material": material,
+		"control_variable": control_variable,
+		"setpoint": nhf_desired if control_variable == "NHF" else Ts_desired,
+		"setpoint_profile": None if setpoint_profile is None else profile,
+		"time_logging_period": time_logging_period,
+		"PID_gains": {"kp": PID_kp, "ki": PID_ki, "kd": PID_kd},
+		"gains_source": gains_source,
+		"feedforward": feedforward,
+		"cascade_control": cascade_control,
+		"lamp_models": None if lamp_models is None else lamp_models["file"]})
+
+	# open csv file to write data (a resumed test continues after the rows
+	# recorded until its last journal record)
+	if resume:
+		recorded = reopen_recorder(full_name_of_file, journal_state["csv_offset"])
+	with open(full_name_of_file, "a" if resume else "w", newline = "") as handle:
+		writer = csv.writer(handle)
+		csv_header = ['time_seconds',
+			"TSurface_K",
+			"T4_K",
+			"T8_K",
+			"T12_K",
+			"T16_K",
+			"NHF_kwm-2",
+			"NHF_surfacelosses_kwm-2",
+			"NHF_mean_kWm-2",
+			"IHF_volts", 
+			"IHF_kwm-2", 
+			"Observations", 
+			"PID_state", 
+			"O2_%", 
+			"O2_inlet_%",
+			"DPT_volts",
+			"CO_ppm", 
+			"CO2_ppm", 
+			"APT_volts", 
+			"Duct_TC_K",
+			"Ambient_TC_K", 
+			"RH_volts",
+			"PID_proportional",
+			"PID_integral",
+			"PID_derivative",
+			"TSurface_KF_K",
+			"NHF_KF_kWm-2",
+			"NHF_KF_std_kWm-2",
+			"TSurface_SFS_K",
+			"NHF_SFS_kWm-2",
+			"IHF_measured_kWm-2",
+			"TSurface_setpoint_K"]
+		if not resume:
+			writer.writerows([csv_header])
+
+		# released in the finally below, even if the test fails
+		telemetry = journal = watchdog = status = None
+		bool_completed = False
+		try:
+			# every numeric column of each row is also published to the live viewers,
+			# followed by the health of the acquired channels and by the acquired
+			# channels aligned at the latest complete time (the gases lag the
+			# thermocouples by their transport delay)
+			telemetry_index = [c for c, column in enumerate(csv_header)
+				if column not in ["Observations", "PID_state"]]
+			telemetry = TelemetryServer([csv_header[c] for c in telemetry_index]
+				+ health.telemetry_names() + ["aligned_time_seconds"]
+				+ [f"aligned_{name}" for name in aligner.channel_names],
+				{"test": name_of_file, "folder": os.path.abspath(name_of_folder)},
+				port = telemetry_port)
+			journal = RunJournal(full_name_of_file, None if resume else test, journal_rate)
+
+			# the watchdog process connects to the logger during the pretest and
+			# watches the loop from its first tick
+			watchdog = LoopWatchdog(logger.address, watchdog_deadline).start()
+			stall_count = 0
+
+			# record the number of readings
+			time_step = 0
+
+			# ------
+			# record temperatures for a period of 60 seconds before starting
+			# ------
+			if resume:
+				time_pretesting_period = 0
+			else:
+				print(f"\nGathering data for {time_pretesting_period} seconds before testing")
+				time.sleep(2)
 
-# turn off the lamps and close the instrument
-logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
-logger.close()
-rm.close()
+			time_start_logging = time.time()
+			previous_log = time.time()
+			while time.time() - time_start_logging < time_pretesting_period:
 
-# finish the experiment
-print("\n\nExperiment finished")
-print(f"Total duration = {np.round((time.time() - time_start_logging)/60,1)} minutes")
+				# enforce a maximum logging frequency given by 1/time_logging_period
+				if time.time() - previous_log < time_logging_period:
+					continue
+				else:
 
+					t_array[time_step] = time.time() - time_start_logging			
+					t_request = time.time()
+					T4[time_step], T8[time_step], T12[time_step], T16[time_step] = \
+						DataLogger.query_data_for_sampletemperatures(logger)
+					aligner.record("sample_temperatures",
+						[T4[time_step], T8[time_step], T12[time_step], T16[time_step]],
+						t_request, time.time(),
+						DataLogger.last_reading_times.get("sample_temperatures"))
+					health.record("sample_temperatures",
+						[T4[time_step], T8[time_step], T12[time_step], T16[time_step]], t_array[time_step])
+
+					# calculate nhf using quadratic fit
+					coefficients = np.polyfit([0.004, 0.008, 0.012, 0.016],
+						[T4[time_step], T8[time_step], T12[time_step], T16[time_step]], 2)
+					polynomial = np.poly1d(coefficients)
+					initial_temperature = np.array([T4[time_step], T8[time_step],
+						T12[time_step], T16[time_step]]).mean()
+					surface_temperature = polynomial(0)
+					surface_losses = (h_total * (surface_temperature - initial_temperature))/1000
+					nhf[time_step] = - (conductivity * coefficients[1]) / 1000
+					nhf_surfacelosses[time_step] = IHF[time_step - 1] - surface_losses
+					nhf_mean[time_step] = (nhf[time_step] + nhf_surfacelosses[time_step])/2
+
+					# filtered surface temperature and nhf
+					TS_kf[time_step], nhf_kf[time_step], _, nhf_kf_std[time_step] = estimator.update(
+						[T4[time_step], T8[time_step], T12[time_step], T16[time_step]],
+						IHF[time_step - 1])
+					nhf_sfs[time_step], TS_sfs[time_step] = inverse_solver.update(
+						[T4[time_step], T8[time_step], T12[time_step], T16[time_step]])
+
+					# read HRR associated data from the logger
+					t_request = time.time()
+					response_volts, response_temperatures = DataLogger.query_data_for_HRR(
+						logger)
+					t_reply = time.time()
+					aligner.record("hrr_volts", response_volts, t_request, t_reply,
+						DataLogger.last_reading_times.get("hrr_volts"))
+					aligner.record("hrr_temperatures", response_temperatures, t_request, t_reply,
+						DataLogger.last_reading_times.get("hrr_temperatures"))
+					health.record("hrr_volts", response_volts, t_array[time_step])
+					health.record("hrr_temperatures", response_temperatures, t_array[time_step])
+					o2_volts[time_step] = response_volts[0]
+					DPT_volts[time_step] = response_volts[1]
+					co_volts[time_step] = response_volts[2]
+					co2_volts[time_step] = response_volts[3]
+					APT_volts[time_step] = response_volts[4]
+					o2_inlet_volts[time_step] = response_volts[5]
+					rh_volts[time_step] = response_volts[6]
+					Duct_TC_K[time_step], Ambient_TC_K[time_step] = response_temperatures
+
+					# convert to engineering units
+					o2_percentage[time_step] = np.polyval(
+						list(coeff_hrr[0]), o2_volts[time_step])
+					o2_inlet_percentage[time_step] = np.polyval(
+						list(coeff_hrr[1]), o2_inlet_volts[time_step])
+					co_ppm[time_step] = np.polyval(
+						list(coeff_hrr[2]), co_volts[time_step])
+					co2_ppm[time_step] = np.polyval(
+						list(coeff_hrr[3]), co2_volts[time_step])
+
+					# write data to the csv file
+					if time_step == 0:
+						message = "start_logging"
+					else:
+						message = ""
+					row = [t_array[time_step],
+						TS[time_step],
+						T4[time_step],
+						T8[time_step],
+						T12[time_step],
+						T16[time_step],
+						nhf[time_step],
+						nhf_surfacelosses[time_step],
+						nhf_mean[time_step],
+						IHF_volts[time_step],
+						IHF[time_step],
+						message,
+						PID_state,
+						o2_percentage[time_step],
+						o2_inlet_percentage[time_step],
+						DPT_volts[time_step],
+						co_ppm[time_step],
+						co2_ppm[time_step],
+						APT_volts[time_step],
+						Duct_TC_K[time_step],
+						Ambient_TC_K[time_step],
+						rh_volts[time_step],
+						PID_proportional_term_array[time_step],
+						PID_integral_term_array[time_step],
+						PID_derivative_term_array[time_step],
+						TS_kf[time_step],
+						nhf_kf[time_step],
+						nhf_kf_std[time_step],
+						TS_sfs[time_step],
+						nhf_sfs[time_step],
+						IHF_measured[time_step],
+						Ts_setpoint_array[time_step]]
+					writer.writerows([row])
+					aligned_time, aligned_values = aligner.sample_latest()
+					telemetry.publish(row[0], np.concatenate([[row[c] for c in telemetry_index],
+						health.telemetry_values(), [aligned_time - time_start_logging], aligned_values]))
+					# make the new row visible to the live plotter
+					handle.flush()
+
+					previous_log = time.time()
+					time_step_lastpretest = time_step
+					time_step += 1
+
+				# end if ESC is pressed
+				if msvcrt.kbhit():
+					if ord(msvcrt.getch()) == 27:
+						break
+
+			# ------
+			# define additional parameters for start of test
+			# ------
+
+			bool_start_test = True
+			start_message = "start_test"
+			bool_PID_active = False
+			time_start_test = time.time()
+			previous_log = time_start_test
+			previous_tick_start = time_start_test
+			previous_inner_tick = time_start_test
+			voltage_output = 0
+			ihf_measured = 0
+			print("\nStarting lamps")
+
+			# ------
+			# continue an unfinished test from the state of its last journal record
+			# ------
+			if resume:
+				now = time.time()
+				gap = now - journal_state["time"]
+
+				# arrays of the rows recorded until the journal record
+				recorded_arrays = {"time_seconds": t_array, "TSurface_K": TS, "T4_K": T4,
+					"T8_K": T8, "T12_K": T12, "T16_K": T16, "NHF_kwm-2": nhf,
+					"NHF_surfacelosses_kwm-2": nhf_surfacelosses, "NHF_mean_kWm-2": nhf_mean,
+					"IHF_volts": IHF_volts, "IHF_kwm-2": IHF, "O2_%": o2_percentage,
+					"O2_inlet_%": o2_inlet_percentage, "DPT_volts": DPT_volts, "CO_ppm": co_ppm,
+					"CO2_ppm": co2_ppm, "APT_volts": APT_volts, "Duct_TC_K": Duct_TC_K,
+					"Ambient_TC_K": Ambient_TC_K, "RH_volts": rh_volts,
+					"PID_proportional": PID_proportional_term_array,
+					"PID_integral": PID_integral_term_array,
+					"PID_derivative": PID_derivative_term_array, "TSurface_KF_K": TS_kf,
+					"NHF_KF_kWm-2": nhf_kf, "NHF_KF_std_kWm-2": nhf_kf_std,
+					"TSurface_SFS_K": TS_sfs, "NHF_SFS_kWm-2": nhf_sfs,
+					"IHF_measured_kWm-2": IHF_measured, "TSurface_setpoint_K": Ts_setpoint_array}
+				time_step = min(journal_state["time_step"], len(recorded["time_seconds"]))
+				for column, array in recorded_arrays.items():
+					array[:time_step] = recorded[column][:time_step]
+				IHF_volts[time_step] = journal_state["IHF_volts_next"]
+				IHF[time_step] = journal_state["IHF_next"]
+
+				# the raw volts of the gas analysers are only in the pickle
+				try:
+					with open(f"{full_name_of_file.split('.csv')[0]}.pkl", "rb") as pickle_handle:
+						previous_data = pickle.load(pickle_handle)
+					for key, array in [("O2_volts", o2_volts), ("O2_inlet_volts", o2_inlet_volts),
+						("CO_volts", co_volts), ("CO2_volts", co2_volts)]:
+						array[:time_step] = previous_data[key][:time_step]
+				except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+					print("The raw volts of the gas analysers before the restart are lost")
+
+				# times of the test in the time.time() scale of the journal
+				time_start_logging = journal_state["time_start_logging"]
+				time_start_test = journal_state["time_start_test"]
+				time_step_lastpretest = journal_state["time_step_lastpretest"]
+				initial_temperature = journal_state["T_ambient"]
+
+				# controller
+				PID_state = journal_state["PID_state"]
+				PID_kp, PID_ki, PID_kd = journal_state["PID_gains"]
+				gains_source = journal_state["gains_source"]
+				schedule_reference_voltage = journal_state["schedule_reference_voltage"]
+				nhf_desired = journal_state["nhf_desired"]
+				Ts_desired = journal_state["Ts_desired"]
+				previous_segment = journal_state["previous_segment"]
+				voltage_output = journal_state["voltage_output"]
+				observer.correction = journal_state["observer_correction"]
+				if journal_state["kalman_state"] is not None:
+					estimator.initialise([T4[time_step-1], T8[time_step-1], T12[time_step-1],
+						T16[time_step-1]], journal_state["kalman_state"]["T_ambient"])
+					estimator.x = np.array(journal_state["kalman_state"]["x"])
+					estimator.P = np.diag(journal_state["kalman_state"]["P_diagonal"])
+
+				# the relay auto-tuning is started again, the PID continues with its
+				# integral and last input (its time restarts so the gap is not integrated)
+				bool_autotune = PID_state == "autotune"
+				if bool_autotune:
+					time_start_test = now
+				elif PID_state == "active":
+					time_PID_activation = journal_state["time_PID_activation"]
+					previous_pid_time = now
+					last_error = journal_state["last_error"]
+					last_input = journal_state["last_input"]
+					pid_integral_term = journal_state["pid_integral_term"]
+					pid_proportional_term = 0
+					pid_derivative_term = 0
+					ihf_setpoint = journal_state["ihf_setpoint"]
+					inner_loop.reset(now, ihf_measured)
+					inner_loop.integral_term = journal_state["inner_loop_integral"]
+					Ts_limiter.reset(journal_state["Ts_setpoint"], now)
+					if gain_scheduling != "off":
+						schedule = build_gain_schedule(PID_kp, PID_ki, PID_kd,
+							schedule_reference_voltage, coeff_voltstohf, lamp_models,
+							min_lamp_voltage, max_lamp_voltage, gain_scheduling)
+
+				# the lamps are set again and the gap is marked in the next row
+				logger.write(':SOURce:VOLTage %G,(%s)' % (voltage_output, '@304'))
+				start_message = f"resume_after_{gap:.1f}s"
+				journal.mark_resume(gap, now)
+				update_run_metadata(full_name_of_file, {
+					"PID_gains": {"kp": PID_kp, "ki": PID_ki, "kd": PID_kd},
+					"gains_source": gains_source,
+					"resumes": read_run_metadata(full_name_of_file).get("resumes", []) + [
+						{"time": now - time_start_logging, "gap": gap}]})
+				print(f"Test resumed after {gap:.1f} seconds without logging")
+
+			# the sample is at the ambient temperature at the end of the pretest
+			feedforward_model = NHFFeedforward(coeff_hftovolts, initial_temperature,
+				h_convective, emissivity, max_lamp_voltage = max_lamp_voltage,
+				min_lamp_voltage = min_lamp_voltage)
+
+			# the relay oscillates around the setpoint before the ramp
+			if bool_autotune:
+				PID_state = "autotune"
+				tuner = RelayAutoTuner(nhf_desired, np.polyval(coeff_hftovolts, nhf_desired),
+					autotune_relay_amplitude, autotune_hysteresis, autotune_cycles,
+					autotune_max_duration, max_lamp_voltage = max_lamp_voltage,
+					min_lamp_voltage = min_lamp_voltage)
+				print("Auto-tuning the PID")
+
+			# the status is redrawn by its own thread so the loop never waits for the console
+			status = ConsoleStatus(status_rate).start()
+
+			while True:
+				try:
+
+					# enforce a maximum logging frequency given by 1/time_logging_period
+					if time.time() - previous_log < time_logging_period:
+
+						# the inner loop of the cascade runs between the ticks of the outer loop
+						if (cascade_control != "off") and (
+							time.time() - previous_inner_tick >= inner_loop_period):
+							previous_inner_tick = time.time()
+							if cascade_control == "gauge":
+								ihf_measured = DataLogger.query_heat_flux_gauge(
+									logger) / hf_gauge_factor
+								health.record("heat_flux_gauge", [ihf_measured],
+									previous_inner_tick - time_start_logging)
+							else:
+								ihf_measured = observer.update(previous_inner_tick, voltage_output)
+
+							if PID_state == "active":
+								voltage_output = inner_loop.update(ihf_setpoint, ihf_measured,
+									previous_inner_tick)
+								logger.write(':SOURce:VOLTage %G,(%s)' % (voltage_output, '@304'))
+						continue
+					else:
+
+						tick_start = time.time()
+						watchdog.beat()
+
+						# the lamps were turned off by the watchdog during a stall of the
+						# loop, the PID restarts its time so that the stall is not integrated
+						bool_stall = watchdog.stall_count != stall_count
+						if bool_stall:
+							stall_count = watchdog.stall_count
+							status.log("\n-----\nLOOP STALLED, the lamps were turned off\n-----\n")
+							if PID_state == "active":
+								previous_pid_time = tick_start
+
+						t_array[time_step] = time.time() - time_start_logging			
+						t_request = time.time()
+						T4[time_step], T8[time_step], T12[time_step], T16[time_step] = \
+							DataLogger.query_data_for_sampletemperatures(logger)
+						aligner.record("sample_temperatures",
+							[T4[time_step], T8[time_step], T12[time_step], T16[time_step]],
+							t_request, time.time(),
+							DataLogger.last_reading_times.get("sample_temperatures"))
+						health.record("sample_temperatures",
+							[T4[time_step], T8[time_step], T12[time_step], T16[time_step]], t_array[time_step])
+
+						# calculate nhf using quadratic fit
+						coefficients = np.polyfit([0.004, 0.008, 0.012, 0.016],
+							[T4[time_step], T8[time_step], T12[time_step], T16[time_step]], 2)
+						polynomial = np.poly1d(coefficients)
+						initial_temperature = np.array([T4[time_step], T8[time_step],
+							T12[time_step], T16[time_step]]).mean()
+						surface_temperature = polynomial(0)
+						TS[time_step] = surface_temperature
+						surface_losses = (h_total * (surface_temperature - initial_temperature))/1000
+						nhf[time_step] = - (conductivity * coefficients[1]) / 1000
+						nhf_surfacelosses[time_step] = IHF[time_step] - surface_losses
+				
+						nhf_mean[time_step] = (nhf[time_step] + nhf_surfacelosses[time_step])/2
+						input_nhf = nhf_mean[time_step]
+
+						# filtered surface temperature and nhf
+						TS_kf[time_step], nhf_kf[time_step], _, nhf_kf_std[time_step] = estimator.update(
+							[T4[time_step], T8[time_step], T12[time_step], T16[time_step]],
+							IHF[time_step])
+						nhf_sfs[time_step], TS_sfs[time_step] = inverse_solver.update(
+							[T4[time_step], T8[time_step], T12[time_step], T16[time_step]])
+						if nhf_estimator == "kalman":
+							input_nhf = nhf_kf[time_step]
+							surface_temperature = TS_kf[time_step]
+						elif nhf_estimator == "sfs":
+							input_nhf = nhf_sfs[time_step]
+							surface_temperature = TS_sfs[time_step]
+						if smith_predictor:
+							input_nhf = smith.update(input_nhf, IHF_volts[time_step])
+
+						# read HRR associated data from the logger
+						t_request = time.time()
+						response_volts, response_temperatures = DataLogger.query_data_for_HRR(
+							logger)
+						t_reply = time.time()
+						aligner.record("hrr_volts", response_volts, t_request, t_reply,
+							DataLogger.last_reading_times.get("hrr_volts"))
+						aligner.record("hrr_temperatures", response_temperatures, t_request, t_reply,
+							DataLogger.last_reading_times.get("hrr_temperatures"))
+						health.record("hrr_volts", response_volts, t_array[time_step])
+						health.record("hrr_temperatures", response_temperatures, t_array[time_step])
+						o2_volts[time_step] = response_volts[0]
+						DPT_volts[time_step] = response_volts[1]
+						co_volts[time_step] = response_volts[2]
+						co2_volts[time_step] = response_volts[3]
+						APT_volts[time_step] = response_volts[4]
+						o2_inlet_volts[time_step] = response_volts[5]
+						rh_volts[time_step] = response_volts[6]
+						Duct_TC_K[time_step], Ambient_TC_K[time_step] = response_temperatures
+
+						# convert to engineering units
+						o2_percentage[time_step] = np.polyval(
+							list(coeff_hrr[0]), o2_volts[time_step])
+						o2_inlet_percentage[time_step] = np.polyval(
+							list(coeff_hrr[1]), o2_inlet_volts[time_step])
+						co_ppm[time_step] = np.polyval(
+							list(coeff_hrr[2]), co_volts[time_step])
+						co2_ppm[time_step] = np.polyval(
+							list(coeff_hrr[3]), co2_volts[time_step])
+
+						# relay auto-tuning before the ramp
+						profile_event = ""
+						if PID_state == "autotune":
+							voltage_output = tuner.update(time.time() - time_start_test, input_nhf)
+							IHF_volts[time_step+1] = voltage_output
+							IHF[time_step+1] = np.polyval(
+								coeff_voltstohf, IHF_volts[time_step+1])
+
+							if tuner.done:
+								autotune_result = tuner.result()
+								if autotune_result is None:
+									status.log("\n-----\nAUTO-TUNE FAILED, configured gains are used\n-----\n")
+								else:
+									PID_kp = autotune_result["kp"]
+									PID_ki = autotune_result["ki"]
+									PID_kd = feedforward_kd if feedforward else autotune_result["kd"]
+									gains_source = "autotune"
+									schedule_reference_voltage = autotune_result["bias_voltage"]
+									save_cached_gains("air", material, autotune_result)
+									status.log(f"\n-----\nAUTO-TUNE FINISHED: kp = {PID_kp:.4f}, "
+										f"ki = {PID_ki:.4f}, kd = {PID_kd:.4f}\n-----\n")
+								update_run_metadata(full_name_of_file, {"autotune": autotune_result,
+									"PID_gains": {"kp": PID_kp, "ki": PID_ki, "kd": PID_kd},
+									"gains_source": gains_source})
+
+								# the ramp starts once the tuning is finished
+								PID_state = "not_active"
+								time_step_lastpretest = time_step
+								time_start_test = time.time()
+
+						# start with a ramped IHF, and once mlr reaches surface temperature, activate PID
+						elif PID_state == "not_active":
+							time_ramp = t_array[time_step] - t_array[time_step_lastpretest]
+							IHF[time_step+1] = ramp_schedule.setpoint(time_ramp)
+							if bool_programmed_IHF:
+								previous_segment, profile_event = ramp_schedule.event(
+									previous_segment, time_ramp)
+							# IHF[time_step+1] = 20
+							IHF_volts[time_step+1] = np.polyval(
+								coeff_hftovolts,IHF[time_step+1])
+							voltage_output = IHF_volts[time_step+1]
+
+							if voltage_output > max_lamp_voltage:
+								voltage_output = max_lamp_voltage
+								IHF_volts[time_step+1] = max_lamp_voltage
+								IHF[time_step+1] = np.polyval(
+									coeff_voltstohf, IHF_volts[time_step+1])
+
+							# the surface temperature is controlled from the start of the lamps
+							# and the lamps follow programmed IHF until the end
+							if bool_programmed_IHF:
+								bool_activate_PID = False
+							elif control_variable == "surface_temperature":
+								bool_activate_PID = True
+								Ts_limiter.reset(surface_temperature, time.time())
+								pid_input, pid_setpoint = surface_temperature, surface_temperature
+							else:
+								bool_activate_PID = (surface_temperature > surface_temperature_activation
+									) and (time.time() - time_start_test > 100)
+								pid_input, pid_setpoint = input_nhf, nhf_desired
+
+							if bool_activate_PID:
+								PID_state = "active"
+								status.log("\n-----\nPID ACTIVE\n-----\n")
+
+								# set pid parameters
+								time_PID_activation = time.time()
+								previous_pid_time = time.time()
+								last_error = pid_setpoint - pid_input
+								last_input = pid_input
+								pid_integral_term = 0 if feedforward else voltage_output
+								pid_proportional_term = 0
+								pid_derivative_term = 0
+
+								# the inner loop starts from the IHF of the ramp
+								ihf_setpoint = IHF[time_step+1]
+								inner_loop.reset(time.time(), ihf_measured)
+
+								# gains of every operating point from the final gains
+								if gain_scheduling != "off":
+									schedule = build_gain_schedule(PID_kp, PID_ki, PID_kd,
+										schedule_reference_voltage, coeff_voltstohf, lamp_models,
+										min_lamp_voltage, max_lamp_voltage, gain_scheduling)
+									update_run_metadata(full_name_of_file,
+										{"gain_schedule": schedule.as_dict()})
+
+
+						# call PID
+						elif PID_state == "active":
+
+							# programmed setpoint
+							if setpoint_schedule is not None:
+								time_profile = time.time() - time_PID_activation
+								previous_segment, profile_event = setpoint_schedule.event(
+									previous_segment, time_profile)
+								if control_variable == "surface_temperature":
+									Ts_desired = setpoint_schedule.setpoint(time_profile)
+								else:
+									nhf_desired = setpoint_schedule.setpoint(time_profile)
+
+							# gains at the current operating point
+							pid_kp, pid_ki, pid_kd = PID_kp, PID_ki, PID_kd
+							if gain_scheduling == "voltage":
+								pid_kp, pid_ki, pid_kd = schedule.gains(IHF_volts[time_step])
+							elif gain_scheduling == "IHF":
+								pid_kp, pid_ki, pid_kd = schedule.gains(IHF[time_step])
+
+							# the PID trims the feedforward voltage within the lamp limits
+							feedforward_voltage = 0
+							max_trim, min_trim = max_lamp_voltage, min_lamp_voltage
+							if feedforward:
+								feedforward_voltage = feedforward_model.voltage(nhf_desired,
+									surface_temperature)
+								max_trim, min_trim = feedforward_model.trim_limits(
+									feedforward_voltage)
+
+							# rate limited surface temperature setpoint
+							if control_variable == "surface_temperature":
+								pid_input = surface_temperature
+								pid_setpoint = Ts_limiter.update(Ts_desired, time.time(),
+									hold = voltage_output >= max_lamp_voltage)
+								Ts_setpoint_array[time_step] = pid_setpoint
+							else:
+								pid_input, pid_setpoint = input_nhf, nhf_desired
+
+							pid_output, previous_pid_time, last_error, pid_proportional_term, \
+							pid_integral_term, pid_derivative_term = \
+													PID(
+													pid_input, pid_setpoint, previous_pid_time, 
+													last_error, last_input, pid_integral_term,
+													pid_kp, pid_ki, pid_kd,
+													max_trim, min_trim)
+							voltage_output = feedforward_voltage + pid_output
+							IHF_volts[time_step+1] = voltage_output
+							IHF[time_step+1] = np.polyval(
+								coeff_voltstohf, IHF_volts[time_step+1])
+							last_input = pid_input
+
+							# the IHF of the PID output in the calibration is the setpoint
+							# of the inner loop, which sets the lamp voltage
+							if cascade_control != "off":
+								ihf_setpoint = IHF[time_step+1]
+								if cascade_control == "observer":
+									observer.correct(feedforward_model.ihf(nhf_kf[time_step],
+										TS_kf[time_step]), time_logging_period)
+								voltage_output = inner_loop.update(ihf_setpoint, ihf_measured,
+									time.time())
+								IHF_volts[time_step+1] = voltage_output
+
+							PID_proportional_term_array[time_step] = pid_proportional_term
+							PID_integral_term_array[time_step] = pid_integral_term
+							PID_derivative_term_array[time_step] = pid_derivative_term
+
+						# write IHF to the lamps
+						logger.write(':SOURce:VOLTage %G,(%s)' % (voltage_output, '@304'))
+						IHF_measured[time_step] = ihf_measured
+
+						# write data to the csv file
+						if bool_start_test:
+							message = start_message
+							bool_start_test = False
+						else:
+							message = ""
+
+						# segments of the setpoint profile
+						if profile_event:
+							message = f"{message} {profile_event}".strip()
+							status.log(f"\n-----\n{profile_event}\n-----\n")
+						if bool_stall:
+							message = f"{message} watchdog_stall".strip()
+						row = [t_array[time_step],
+							TS[time_step],
+							T4[time_step],
+							T8[time_step],
+							T12[time_step],
+							T16[time_step],
+							nhf[time_step],
+							nhf_surfacelosses[time_step],
+							nhf_mean[time_step],
+							IHF_volts[time_step],
+							IHF[time_step],
+							message,
+							PID_state,
+							o2_percentage[time_step],
+							o2_inlet_percentage[time_step],
+							DPT_volts[time_step],
+							co_ppm[time_step],
+							co2_ppm[time_step],
+							APT_volts[time_step],
+							Duct_TC_K[time_step],
+							Ambient_TC_K[time_step],
+							rh_volts[time_step],
+							PID_proportional_term_array[time_step],
+							PID_integral_term_array[time_step],
+							PID_derivative_term_array[time_step],
+							TS_kf[time_step],
+							nhf_kf[time_step],
+							nhf_kf_std[time_step],
+							TS_sfs[time_step],
+							nhf_sfs[time_step],
+							IHF_measured[time_step],
+							Ts_setpoint_array[time_step]]
+						writer.writerows([row])
+						aligned_time, aligned_values = aligner.sample_latest()
+						telemetry.publish(row[0], np.concatenate([[row[c] for c in telemetry_index],
+							health.telemetry_values(), [aligned_time - time_start_logging], aligned_values]))
+						# make the new row visible to the live plotter
+						handle.flush()
+
+						# save data as a a dict in a pickle to be read and plotted by another algorithm
+						data_for_pickle = {"time":t_array,
+											"IHF": IHF,
+											"IHF_volts": IHF,
+											"TS": TS,
+											"T4": T4,
+											"T8": T8,
+											"T12": T12,
+											"T16": T16,
+											"nhf_fit": nhf,
+											"nhf_surface": nhf_surfacelosses,
+											"nhf_mean": nhf_mean,
+											"time_step": time_step,
+											"PID_proportional":PID_proportional_term_array,
+											"PID_integral": PID_integral_term_array,
+											"PID_derivative": PID_derivative_term_array,
+											"O2_volts": o2_volts,
+											"O2_percentage": o2_percentage, 
+											"O2_inlet_volts": o2_inlet_volts,
+											"o2_inlet_percentage": o2_inlet_percentage,
+											"DPT_volts": DPT_volts,
+											"CO_volts": co_volts,
+											"CO_ppm": co_ppm,
+											"CO2_volts": co2_volts, 
+											"CO2_ppm": co2_ppm, 
+											"APT_volts": APT_volts, 
+											"Duct_TC_K": Duct_TC_K,
+											"Ambient_TC_K": Ambient_TC_K, 
+											"RH_volts": rh_volts,
+											}
+						with open(f"{full_name_of_file.split('.csv')[0]}.pkl", "wb") as pickle_handle:
+							pickle.dump(data_for_pickle, pickle_handle)
+
+						# state to resume the test from (the row of this tick is on the disk)
+						if journal.due(time.time()):
+							active = PID_state == "active"
+							journal.record({"time_step": time_step + 1,
+								"csv_offset": handle.tell(),
+								"IHF_volts_next": IHF_volts[time_step+1],
+								"IHF_next": IHF[time_step+1],
+								"time_start_logging": time_start_logging,
+								"time_start_test": time_start_test,
+								"time_step_lastpretest": time_step_lastpretest,
+								"T_ambient": feedforward_model.T_ambient,
+								"PID_state": PID_state,
+								"PID_gains": [PID_kp, PID_ki, PID_kd],
+								"gains_source": gains_source,
+								"schedule_reference_voltage": schedule_reference_voltage,
+								"nhf_desired": nhf_desired,
+								"Ts_desired": Ts_desired,
+								"previous_segment": previous_segment,
+								"voltage_output": voltage_output,
+								"observer_correction": observer.correction,
+								"kalman_state": None if estimator.x is None else {"x": estimator.x,
+									"P_diagonal": np.diag(estimator.P),
+									"T_ambient": estimator.T_ambient},
+								"time_PID_activation": time_PID_activation if active else None,
+								"last_error": last_error if active else None,
+								"last_input": last_input if active else None,
+								"pid_integral_term": pid_integral_term if active else None,
+								"ihf_setpoint": ihf_setpoint if active else None,
+								"inner_loop_integral": inner_loop.integral_term if active else None,
+								"Ts_setpoint": Ts_limiter.setpoint if active else None}, time.time())
+
+						# hand the latest values over to the status thread
+						status.update({"PID state": PID_state,
+							"time [s]": time.time() - time_start_test,
+							"NHF setpoint": nhf_desired,
+							"Tsurface setpoint": Ts_setpoint_array[time_step],
+							"PID input": input_nhf,
+							"NHF mean": nhf_mean[time_step],
+							"NHF fit": nhf[time_step],
+							"NHF surface": nhf_surfacelosses[time_step],
+							"NHF filtered": nhf_kf[time_step],
+							"NHF filtered std": nhf_kf_std[time_step],
+							"NHF inverse": nhf_sfs[time_step],
+							"IHF": IHF[time_step+1],
+							"IHF measured": ihf_measured,
+							"lamp voltage": voltage_output,
+							"PID proportional": PID_proportional_term_array[time_step],
+							"PID integral": PID_integral_term_array[time_step],
+							"PID derivative": PID_derivative_term_array[time_step],
+							"Tsurface": TS[time_step],
+							"Tsurface filtered": TS_kf[time_step],
+							"T4": T4[time_step],
+							"T8": T8[time_step],
+							"T12": T12[time_step],
+							"T16": T16[time_step],
+							"loop period [ms]": 1000*(tick_start - previous_tick_start),
+							"tick duration [ms]": 1000*(time.time() - tick_start),
+							"watchdog stalls": stall_count,
+							"channel alarms": health.alarms()})
+						previous_tick_start = tick_start
+
+						previous_log = time.time()
+						time_step += 1
+
+					# end after the duration of the test (unattended tests)
+					if (test_duration is not None) and (time.time() - time_start_test > test_duration):
+						writer.writerows([["", "", "", "", "", "", "end_test"]])
+						break
+ 
+					# end if ESC is pressed
+					if msvcrt.kbhit():
+						if ord(msvcrt.getch()) == 27:
+							writer.writerows([["", "", "", "", "", "", "end_test"]])
+							break
+
+				## ---- handle an exception during testing and continue logging the data
+				except Exception as e:
+					exc_type, exc_obj, exc_tb = sys.exc_info()
+					fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+					status.log(f"\nInstantaneous error at {np.round(time.time() - time_start_logging, 2)} seconds"
+						f"\n{exc_type} {fname} {exc_tb.tb_lineno}")
+
+					# end if ESC is pressed
+					if msvcrt.kbhit():
+						if ord(msvcrt.getch()) == 27:
+							writer.writerows([["", "", "", "", "","", "end_test"]])
+							break
+
+			bool_completed = True
+
+		finally:
+			# the lamps are turned off and the status thread, the telemetry port, the
+			# watchdog process and the journal are released even if the test failed
+			# (a failed test is marked as aborted and is not resumed)
+			try:
+				logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+			except Exception as e:
+				print(f"\nThe lamps could not be turned off: {e}")
+			if status is not None:
+				status.stop()
+			if telemetry is not None:
+				telemetry.close()
+			stalls = [] if watchdog is None else watchdog.stop()
+			if journal is not None:
+				if bool_completed:
+					journal.finish()
+				else:
+					journal.abort()
+
+
+	#####
+	# FINISH THE EXPERIMENT (the lamps are off)
+	#####
+
+	# start of the logging (to place the test in its campaign) and stalls of the loop
+	channel_health = health.summary()
+	update_run_metadata(full_name_of_file, {"time_start_logging": time_start_logging,
+		"watchdog_deadline": watchdog_deadline,
+		"stalls": [{"time": stall["start"] - time_start_logging,
+			"duration": stall["duration"]} for stall in stalls],
+		"channel_health": channel_health})
+	if stalls:
+		print(f"\nThe loop stalled {len(stalls)} times, longest "
+			f"{max(stall['duration'] for stall in stalls):.1f} s")
+	for name, statistics in channel_health.items():
+		if statistics["out_of_range"] or statistics["stuck_readings"]:
+			print(f"{name}: {statistics['out_of_range']} readings out of range, "
+				f"{statistics['stuck_readings']} stuck readings")
+
+	# resample all the channels onto a common time base, correcting the delays
+	time_base, aligned_values = aligner.align(period=time_logging_period)
+	with open(f"{full_name_of_file.split('.csv')[0]}_aligned.csv", "w", newline = "") as handle:
+		writer = csv.writer(handle)
+		writer.writerow(["time_seconds"] + aligner.channel_names)
+		writer.writerows(np.column_stack([time_base - time_start_logging, aligned_values]))
+
+	# min/max levels of the recorded channels to view the test (and its campaign)
+	# at any zoom, see downsampling_pyramid.py
+	build_pyramid_for_test(full_name_of_file)
+
+	# finish the experiment
+	print("\n\nExperiment finished")
+	print(f"Total duration = {np.round((time.time() - time_start_logging)/60,1)} minutes")
+
+	return full_name_of_file
+
+
+if __name__ == "__main__":
+
+	# an unfinished test is only resumed if the operator confirms it and it was
+	# interrupted shortly before this restart, otherwise it is marked as aborted
+	# and a new test is requested
+	time_restart = time.time()
+	full_name_of_file, test = find_unfinished_test()
+	if full_name_of_file is not None and not confirm_resume(full_name_of_file, time_restart):
+		full_name_of_file, test = None, None
+	rm, logger = connect_instruments()
+	if test is None:
+		test = request_test(control_variable, setpoint_profile)
+	else:
+		print(f"\nResuming {full_name_of_file}")
+
+	if test is not None:
+		run_test(logger, test, load_calibrations(), resume = full_name_of_file is not None)
+
+	# turn off the lamps and close the instrument
+	logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+	logger.close()
+	rm.close()
@@ -0,0 +1,154 @@
+"""
+Campaign of FPA tests
+Runs a queue of tests one after the other with a single connection to the
+data logger (and to the load cell for the N2 tests) and the calibrations
+loaded once. Between tests the runner only waits for the operator to change
+the sample.
+
+Each test of the campaign file is the definition used by run_test of
+air_experiments/main_constant_nhf.py or nitrogen_experiments/main_constant_nhf.py,
+with its "atmosphere" ("air" or "N2"). A test ends after its "duration" in
+seconds or when ESC is pressed.
+
+If the campaign is started again after a crash, the finished tests are skipped
+and the unfinished one is resumed from its journal if the operator confirms it
+and it was interrupted shortly before the restart (see run_journal.py).
+
+Use:
+python run_campaign.py example_campaign.json
+"""
+
+import os
+import sys
+import json
+import time
+import importlib.util
+
+REPOSITORY_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.join(REPOSITORY_FOLDER, "classes_and_functions"))
+from datalogger import DataLogger
+from run_journal import is_unfinished, confirm_resume
+
+EXPERIMENT_SCRIPTS = {"air": os.path.join(REPOSITORY_FOLDER, "air_experiments",
+		"main_constant_nhf.py"),
+	"N2": os.path.join(REPOSITORY_FOLDER, "nitrogen_experiments", "main_constant_nhf.py")}
+
+
+def load_experiment(atmosphere):
+	"""
+	Imports the test script of an atmosphere (both scripts have the same name)
+	"""
+	spec = importlib.util.spec_from_file_location(f"{atmosphere}_experiment",
+		EXPERIMENT_SCRIPTS[atmosphere])
+	experiment = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(experiment)
+	return experiment
+
+
+def load_campaign(path):
+	"""
+	Reads and checks the list of tests of a campaign
+
+	Returns:
+	-------
+	tests: list
+		definition of each test (dict)
+	"""
+	with open(path, "r") as handle:
+		tests = json.load(handle)
+
+	for number, test in enumerate(tests):
+		if test.get("atmosphere") not in EXPERIMENT_SCRIPTS:
+			raise ValueError(f"Test {number + 1}: atmosphere must be one of {list(EXPERIMENT_SCRIPTS)}")
+		for key in ["number_of_test", "material"]:
+			if key not in test:
+				raise ValueError(f"Test {number + 1}: {key} is missing")
+		if "setpoint" not in test and "setpoint_profile" not in test:
+			raise ValueError(f"Test {number + 1}: either setpoint or setpoint_profile is needed")
+		test.setdefault("setpoint", float("nan"))
+		test.setdefault("setpoint_profile", None)
+
+	return tests
+
+
+def run_campaign(tests):
+	"""
+	Runs the tests in order
+
+	Returns:
+	-------
+	results: list
+		csv file of each test (None if it was skipped or failed)
+	"""
+	# an unfinished test is resumed according to its gap to this restart
+	time_restart = time.time()
+	session = DataLogger()
+	experiments = {}
+	calibrations = {}
+	load_cell = None
+	configured_atmosphere = None
+	results = []
+
+	# the lamps are turned off and the instrument is closed even if the
+	# campaign is interrupted
+	try:
+		for number, test in enumerate(tests):
+			atmosphere = test["atmosphere"]
+
+			# scripts and calibrations are loaded the first time they are needed
+			if atmosphere not in experiments:
+				experiments[atmosphere] = load_experiment(atmosphere)
+				calibrations[atmosphere] = experiments[atmosphere].load_calibrations()
+			experiment = experiments[atmosphere]
+
+			# the logger is only configured again when the atmosphere changes
+			if atmosphere != configured_atmosphere:
+				if atmosphere == "N2":
+					load_cell, _, logger = experiment.connect_instruments(session, load_cell)
+				else:
+					_, logger = experiment.connect_instruments(session)
+				configured_atmosphere = atmosphere
+
+			# the sample of an unfinished test is still in place
+			name_of_file = experiment.test_file_name(test)
+			full_name_of_file = os.path.join(name_of_file.split(".csv")[0], name_of_file)
+			resume = is_unfinished(full_name_of_file) and confirm_resume(full_name_of_file,
+				time_restart)
+			if os.path.exists(full_name_of_file) and not resume:
+				print(f"\nTest {number + 1} of {len(tests)}: {name_of_file} already exists (finished or aborted)")
+				results.append(full_name_of_file)
+				continue
+			if not resume:
+				input(f"\nTest {number + 1} of {len(tests)}: {name_of_file}"
+					"\nLoad the sample and press Enter to start\n")
+
+			try:
+				if atmosphere == "N2":
+					full_name_of_file = experiment.run_test(load_cell, logger, test,
+						calibrations[atmosphere], resume)
+				else:
+					full_name_of_file = experiment.run_test(logger, test, calibrations[atmosphere],
+						resume)
+			except Exception as e:
+				logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+				print(f"\nTest {number + 1} failed: {e}")
+				full_name_of_file = None
+			results.append(full_name_of_file)
+
+	finally:
+		if configured_atmosphere is not None:
+			logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+		session.close()
+
+	return results
+
+
+if __name__ == "__main__":
+
+	tests = load_campaign(sys.argv[1])
+	results = run_campaign(tests)
+
+	print("\n\nCampaign finished")
+	for test, full_name_of_file in zip(tests, results):
+		print(f"{test['atmosphere']} {test['number_of_test']}: "
+			f"{full_name_of_file or 'not completed'}")
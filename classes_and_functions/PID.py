@@ -10,7 +10,7 @@ import time
 import numpy as np
 
 def PID_IHF(current_input, setpoint, previous_time, last_error, last_input, integral_term, kp, ki, kd, max_lamp_voltage,
-	min_lamp_voltage):
+	min_lamp_voltage, now=None):
     """
     Uses a PID algorithm to calculate the IHF based a target mlr and the current mlr calculated
 
@@ -50,6 +50,10 @@ def PID_IHF(current_input, setpoint, previous_time, last_error, last_input, inte
 	min_lamp_voltage: float
 		minimum voltage that can send to the FPA lamps
 
+	now: float
+		time of this iteration in seconds. time.time() if None (used to run
+		the controller faster than real time in simulations and replays)
+
 
 	Returns:
 	-------
@@ -75,7 +79,8 @@ def PID_IHF(current_input, setpoint, previous_time, last_error, last_input, inte
     """
 
     # how long since we last calculated
-    now = time.time()
+    if now is None:
+        now = time.time()
     time_change = now - previous_time
 
     # compute all the working error variables
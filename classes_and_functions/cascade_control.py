@@ -0,0 +1,169 @@
+"""
+Cascade control of the lamps with an inner heat flux loop
+
+Without the cascade the PID output (lamp voltage) is converted to heat flux
+through the calibration of the day, so the ageing and the drift of the lamps
+are slow disturbances for the NHF/MLR PID. In cascade mode the output of the
+outer PID is read as the IHF of that voltage in the calibration, i.e. the
+setpoint of an inner loop. The inner loop runs between the ticks of the outer
+loop: it sends the calibration voltage of the setpoint and trims it with a PI
+on the measured IHF, from the heat flux gauge (@110) when it faces the lamps or
+else from IHFObserver.
+
+The gains of the outer PID keep their meaning (volts of the calibration), so
+the auto-tuning and the gain schedule are used unchanged.
+"""
+
+import numpy as np
+from collections import deque
+from PID import PID_IHF as PID
+
+
+class IHFObserver():
+    """
+    Estimates the IHF from the lamp voltage with a first order plus dead time
+    model of the lamps, scaled by a slow correction from the IHF implied by the
+    thermal estimate of the NHF (see NHFFeedforward.ihf)
+    """
+
+    def __init__(self, coeff_voltstohf, time_constant=0.5, dead_time=0.2,
+        correction_time=60):
+        """
+        Parameters:
+        ----------
+        coeff_voltstohf: np.array
+            calibration of the lamps (volts to kW/m2)
+
+        time_constant, dead_time: float
+            response of the lamps in seconds (see lamps_mappingANDperformance.py)
+
+        correction_time: float
+            time constant in seconds of the correction of the model, long
+            compared to the lag of the thermal estimate
+        """
+        self.coeff_voltstohf = coeff_voltstohf
+        self.time_constant = time_constant
+        self.dead_time = dead_time
+        self.correction_time = correction_time
+        self.history = deque()
+        self.previous_time = None
+        self.model_ihf = 0.0
+        self.correction = 1.0
+
+    def update(self, now, voltage):
+        """
+        Advances the model of the lamps to now, with voltage sent since the
+        previous call
+
+        Returns:
+        -------
+        ihf: float
+            estimated IHF in kW/m2
+        """
+        self.history.append((now, voltage))
+        while len(self.history) > 1 and self.history[1][0] <= now - self.dead_time:
+            self.history.popleft()
+        delayed_voltage = self.history[0][1]
+
+        if self.previous_time is not None:
+            decay = np.exp(-(now - self.previous_time) / self.time_constant)
+            steady_ihf = max(np.polyval(self.coeff_voltstohf, delayed_voltage), 0)
+            self.model_ihf = decay * self.model_ihf + (1 - decay) * steady_ihf
+        self.previous_time = now
+
+        return self.correction * self.model_ihf
+
+    def correct(self, ihf_thermal, dt, minimum_ihf=2):
+        """
+        Moves the correction of the model towards the ratio between the IHF
+        implied by the thermal estimate and the model (called at the rate of
+        the outer loop)
+
+        Parameters:
+        ----------
+        ihf_thermal: float
+            IHF in kW/m2 from the estimated NHF and the surface losses
+
+        dt: float
+            time since the previous correction in seconds
+
+        minimum_ihf: float
+            the model is not corrected below this IHF (kW/m2), where the
+            ratio is dominated by the noise of the estimate
+        """
+        if self.model_ihf < minimum_ihf or not np.isfinite(ihf_thermal):
+            return
+        weight = min(dt / self.correction_time, 1)
+        self.correction += weight * (ihf_thermal / self.model_ihf - self.correction)
+
+
+class InnerHeatFluxLoop():
+    """
+    PI on the IHF that trims the calibration voltage of the IHF setpoint
+    """
+
+    def __init__(self, coeff_hftovolts, kp=0.02, ki=0.1, max_lamp_voltage=4.5,
+        min_lamp_voltage=0.25):
+        """
+        Parameters:
+        ----------
+        coeff_hftovolts: np.array
+            calibration of the lamps (kW/m2 to volts)
+
+        kp, ki: float
+            gains of the PI in volts per kW/m2 (and per kW/m2 s)
+        """
+        self.coeff_hftovolts = coeff_hftovolts
+        self.kp = kp
+        self.ki = ki
+        self.max_lamp_voltage = max_lamp_voltage
+        self.min_lamp_voltage = min_lamp_voltage
+        self.previous_time = None
+
+    def reset(self, now, ihf):
+        """
+        Starts the loop from the calibration voltage (no trim)
+
+        Parameters:
+        ----------
+        now: float
+            time in seconds
+
+        ihf: float
+            current IHF in kW/m2
+        """
+        self.previous_time = now
+        self.last_error = 0.0
+        self.last_input = ihf
+        self.integral_term = 0.0
+
+    def update(self, ihf_setpoint, ihf, now):
+        """
+        Parameters:
+        ----------
+        ihf_setpoint: float
+            IHF requested by the outer loop in kW/m2
+
+        ihf: float
+            measured or observed IHF in kW/m2
+
+        now: float
+            time in seconds
+
+        Returns:
+        -------
+        voltage: float
+            lamp voltage
+        """
+        feedforward_voltage = min(max(np.polyval(self.coeff_hftovolts, ihf_setpoint),
+            self.min_lamp_voltage), self.max_lamp_voltage)
+        if now <= self.previous_time:
+            return feedforward_voltage + self.integral_term
+
+        trim, self.previous_time, self.last_error, _, self.integral_term, _ = PID(
+            ihf, ihf_setpoint, self.previous_time, self.last_error, self.last_input,
+            self.integral_term, self.kp, self.ki, 0,
+            self.max_lamp_voltage - feedforward_voltage,
+            self.min_lamp_voltage - feedforward_voltage, now=now)
+        self.last_input = ihf
+        return feedforward_voltage + trim
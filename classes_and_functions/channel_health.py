@@ -0,0 +1,209 @@
+"""
+Health of the acquired channels while the test runs
+
+A thermocouple that comes off the sample, breaks (the logger then reads an
+overload, e.g. 9.9E+37) or freezes on its last value looks normal in a plot
+of the test until it is too late. The ChannelHealth keeps streaming
+statistics of every channel, updated at every reading with a constant cost
+(Welford's algorithm, vectorised over the channels of each device):
+
+    mean and variance of the readings within the valid range of the channel
+    minimum and maximum
+    rate of change between the last two valid readings (unit/s)
+    stuck readings: consecutive readings identical to the previous one
+    out of range readings: nan or outside the valid range of the channel
+
+The valid range and the number of identical readings after which a channel
+is stuck are stored in channel_limits.json next to this file.
+"""
+
+import os
+import json
+import numpy as np
+
+# limits of the channels are stored next to this file
+LIMITS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "channel_limits.json")
+DEFAULT_STUCK_READINGS = 50
+
+
+def load_channel_limits(path=LIMITS_FILE):
+    """
+    Reads the limits of each channel: {"range": [min, max], "stuck_readings": n}.
+    Channels that are not in the file have no range and the default number of
+    stuck readings. Keys starting with "_" are notes.
+    """
+    with open(path, "r") as handle:
+        limits = json.load(handle)
+    return {name: limit for name, limit in limits.items() if not name.startswith("_")}
+
+
+class ChannelHealth():
+    """
+    Streaming statistics of every acquired channel
+    """
+
+    def __init__(self, devices, limits=None):
+        """
+        Parameters:
+        ----------
+        devices: dict
+            channel names acquired by each device, e.g.
+            {"sample_temperatures": ["T4_K", "T8_K", "T12_K", "T16_K"]}
+
+        limits: dict
+            valid range and stuck readings of each channel (see load_channel_limits)
+        """
+        if limits is None:
+            limits = {}
+
+        self.channel_names = [name for channels in devices.values() for name in channels]
+        self.device_index = {}
+        first_channel = 0
+        for device, channels in devices.items():
+            self.device_index[device] = np.arange(first_channel, first_channel + len(channels))
+            first_channel += len(channels)
+
+        number_of_channels = len(self.channel_names)
+        self.lower_limit = np.array([limits.get(name, {}).get("range", [-np.inf, np.inf])[0]
+            for name in self.channel_names], dtype=float)
+        self.upper_limit = np.array([limits.get(name, {}).get("range", [-np.inf, np.inf])[1]
+            for name in self.channel_names], dtype=float)
+        self.stuck_limit = np.array([limits.get(name, {}).get("stuck_readings",
+            DEFAULT_STUCK_READINGS) for name in self.channel_names])
+
+        # Welford accumulators of the valid readings
+        self.count = np.zeros(number_of_channels, dtype=int)
+        self.mean = np.zeros(number_of_channels)
+        self.m2 = np.zeros(number_of_channels)
+        self.minimum = np.full(number_of_channels, np.inf)
+        self.maximum = np.full(number_of_channels, -np.inf)
+
+        self.last_value = np.full(number_of_channels, np.nan)
+        self.last_time = np.full(number_of_channels, np.nan)
+        self.rate = np.zeros(number_of_channels)
+        self.max_rate = np.zeros(number_of_channels)
+
+        self.readings = np.zeros(number_of_channels, dtype=int)
+        self.stuck_run = np.zeros(number_of_channels, dtype=int)
+        self.stuck_readings = np.zeros(number_of_channels, dtype=int)
+        self.out_of_range = np.zeros(number_of_channels, dtype=int)
+        self.in_range = np.ones(number_of_channels, dtype=bool)
+
+    def record(self, device, values, t):
+        """
+        Updates the statistics of the channels of one device with a reading
+
+        Parameters:
+        ----------
+        device: str
+            name of the device (key of devices in the constructor)
+
+        values: list or np.array
+            reading of each channel of the device
+
+        t: float
+            time of the reading in seconds
+        """
+        index = self.device_index[device]
+        values = np.asarray(values, dtype=float)
+        self.readings[index] += 1
+
+        valid = np.isfinite(values) & (values >= self.lower_limit[index]) & (
+            values <= self.upper_limit[index])
+        self.in_range[index] = valid
+        self.out_of_range[index] += ~valid
+        if not valid.any():
+            return
+        index, values = index[valid], values[valid]
+
+        # mean and sum of squared deviations (Welford)
+        self.count[index] += 1
+        delta = values - self.mean[index]
+        self.mean[index] += delta / self.count[index]
+        self.m2[index] += delta * (values - self.mean[index])
+        self.minimum[index] = np.minimum(self.minimum[index], values)
+        self.maximum[index] = np.maximum(self.maximum[index], values)
+
+        # rate of change and identical readings since the last valid reading
+        previous = self.count[index] > 1
+        elapsed = t - self.last_time[index]
+        rate = np.zeros(len(index))
+        np.divide(values - self.last_value[index], elapsed, out=rate,
+            where=previous & (elapsed > 0))
+        self.rate[index] = rate
+        self.max_rate[index] = np.maximum(self.max_rate[index], np.abs(rate))
+
+        repeated = previous & (values == self.last_value[index])
+        self.stuck_run[index] = np.where(repeated, self.stuck_run[index] + 1, 0)
+        self.stuck_readings[index] += repeated & (
+            self.stuck_run[index] >= self.stuck_limit[index])
+
+        self.last_value[index] = values
+        self.last_time[index] = t
+
+    @property
+    def std(self):
+        """
+        Standard deviation of the valid readings of every channel
+        """
+        std = np.zeros(len(self.channel_names))
+        np.sqrt(self.m2 / np.maximum(self.count - 1, 1), out=std)
+        return std
+
+    @property
+    def stuck(self):
+        """
+        True for the channels that are stuck at the moment
+        """
+        return self.stuck_run >= self.stuck_limit
+
+    def alarms(self):
+        """
+        Short description of the channels that are stuck or out of range at the
+        moment, e.g. "T8_K out of range, CO_volts stuck" ("ok" if there are none)
+        """
+        stuck, out = self.stuck, ~self.in_range
+        if not (stuck.any() or out.any()):
+            return "ok"
+        return ", ".join([f"{name} out of range" for name in np.array(self.channel_names)[out]]
+            + [f"{name} stuck" for name in np.array(self.channel_names)[stuck & ~out]])
+
+    def telemetry_names(self):
+        """
+        Names of the values returned by telemetry_values
+        """
+        return [f"{name}_{statistic}" for name in self.channel_names
+            for statistic in ["std", "rate", "stuck_run", "out_of_range"]]
+
+    def telemetry_values(self):
+        """
+        Standard deviation, rate of change, current stuck readings and out of
+        range readings of every channel (to be published with each sample)
+        """
+        return np.column_stack([self.std, self.rate, self.stuck_run,
+            self.out_of_range]).ravel()
+
+    def summary(self):
+        """
+        Statistics of every channel for the metadata of the test
+
+        Returns:
+        -------
+        summary: dict
+            {channel name: {"readings", "mean", "std", "min", "max", "max_rate",
+            "stuck_readings", "out_of_range"}}
+        """
+        std = self.std
+        summary = {}
+        for c, name in enumerate(self.channel_names):
+            valid = self.count[c] > 0
+            summary[name] = {"readings": int(self.readings[c]),
+                "mean": float(self.mean[c]) if valid else None,
+                "std": float(std[c]) if valid else None,
+                "min": float(self.minimum[c]) if valid else None,
+                "max": float(self.maximum[c]) if valid else None,
+                "max_rate": float(self.max_rate[c]),
+                "stuck_readings": int(self.stuck_readings[c]),
+                "out_of_range": int(self.out_of_range[c])}
+        return summary
@@ -3,8 +3,152 @@ Class use to connect to the FPA's data logger
 
 """
 
-import visa
 import sys
+import os
+import json
+import hashlib
+import numpy as np
+from transport import VisaTransport
+
+# the rest of the code works with temperatures in kelvin
+CELSIUS_TO_KELVIN = 273
+
+# measurement profiles (ranges, integration times) are stored next to this file
+PROFILES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "measurement_profiles.json")
+
+# hash of the configuration left in the logger by the last session
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "datalogger_state.json")
+
+
+def parse_readings(response, offset=0.0):
+    """
+    Parses the response of the logger in a single vectorised pass.
+
+    The reading format is configured once per session (see new_instrument) so
+    that the logger only returns the values, separated by commas.
+
+    Parameters:
+    ----------
+    response: str or np.array
+        ASCII response from the logger or array already returned by a binary
+        block transfer
+
+    offset: float
+        offset added to all the readings (e.g. CELSIUS_TO_KELVIN)
+
+    Returns:
+    -------
+    readings: np.array
+        array of floats with the readings in the order of the channel list
+    """
+    if isinstance(response, str):
+        readings = np.fromstring(response, sep=",")
+    else:
+        readings = np.asarray(response, dtype=float)
+
+    if offset:
+        readings = readings + offset
+
+    return readings
+
+
+def parse_timed_readings(response, offset=0.0):
+    """
+    Parses the response of the logger when :FORMat:READing:TIME is enabled,
+    i.e. when every reading is followed by its time stamp
+
+    Returns:
+    -------
+    readings: np.array
+        array of floats with the readings
+
+    reading_times: np.array
+        time stamp of each reading in seconds, relative to the start of the scan
+    """
+    values = parse_readings(response)
+    readings = values[0::2]
+    if offset:
+        readings = readings + offset
+
+    return readings, values[1::2]
+
+
+def load_measurement_profile(name, path=PROFILES_FILE):
+    """
+    Reads a named measurement profile from the configuration file
+
+    Parameters:
+    ----------
+    name: str
+        name of the profile (e.g. "air_10Hz")
+
+    path: str
+        json file with all the profiles
+
+    Returns:
+    -------
+    profile: dict
+        time budget, line frequency and configuration of each channel group
+    """
+    with open(path, "r") as handle:
+        all_profiles = json.load(handle)
+
+    if name not in all_profiles:
+        raise KeyError(f"Measurement profile '{name}' not in {path}. "
+            f"Available profiles: {list(all_profiles)}")
+
+    return all_profiles[name]
+
+
+def channel_count(channels):
+    """
+    Counts the channels in a SCPI channel list such as "@101,102,109" or "@202:205"
+    """
+    count = 0
+    for item in channels.strip("@()").split(","):
+        if ":" in item:
+            first, last = item.split(":")
+            count += int(last) - int(first) + 1
+        else:
+            count += 1
+    return count
+
+
+def expected_scan_time(profile):
+    """
+    Estimates the time that the logger needs to measure all the channel
+    groups of a profile once
+
+    Each channel takes its integration time (doubled when autozero is on)
+    plus the switching and settling overhead of the multiplexer.
+
+    Parameters:
+    ----------
+    profile: dict
+        measurement profile (see load_measurement_profile)
+
+    Returns:
+    -------
+    scan_time: float
+        expected time in seconds for one scan of all the groups
+    """
+    line_period = 1 / profile["line_frequency_Hz"]
+    overhead = profile["channel_overhead_s"]
+
+    scan_time = 0
+    for group in profile["channel_groups"].values():
+        if "aperture" in group:
+            integration_time = group["aperture"]
+        else:
+            integration_time = group["nplc"] * line_period
+        if group.get("autozero", "ON").upper() == "ON":
+            integration_time *= 2
+        scan_time += channel_count(group["channels"]) * (integration_time + overhead)
+
+    return scan_time
+
 
 class DataLogger():
     """
@@ -14,50 +158,337 @@ class DataLogger():
     VISA_ADDRESS = "GPIB0::9::INSTR"
     time_out = 1000
 
-    def __init__(self):
+    # binary real-number transfer is only used if the logger accepts it
+    # (see new_instrument). Otherwise readings are transferred as ASCII
+    binary_transfer = False
+
+    # channel groups of the measurement profile applied at the start of the
+    # session. If None, each query uses MEASure? with the default settings
+    channel_groups = None
+
+    # if True, the logger returns a relative time stamp after every reading
+    # and the time stamps of the last query of each group are kept here
+    reading_time = False
+    last_reading_times = {}
+
+    def __init__(self, transport=None):
         """
-        Initializes the class by checking that the connection is possible 
+        Initializes the class by checking that the connection is possible
         and sending query for the ID number of the logger
 
         Additionally, it prints to the command window that the connection
         has been successful
+
+        Parameters:
+        ----------
+        transport: VisaTransport or SocketTransport
+            connection to the logger. If None, the logger is opened through
+            GPIB at VISA_ADDRESS. The same connection is used for the whole
+            session (see new_instrument)
         """
 
-        rm = visa.ResourceManager()
-        my_instrument = rm.open_resource(self.VISA_ADDRESS)
-        idn = my_instrument.query("*IDN?")
+        if transport is None:
+            transport = VisaTransport(self.VISA_ADDRESS, self.time_out)
+        self.transport = transport
+
+        idn = self.transport.query("*IDN?")
         print(f"Successful connection to {idn}")
 
 
-    def new_instrument(self):
+    def new_instrument(self, profile_name=None, reading_time=False):
         """
-        Connects to the data logger and returns the instrument as well
-        as the visa Resource Manager (used to close the connection)
+        Configures the data logger and returns the instrument as well
+        as the session (used to close the connection)
+
+        The full reset is skipped when the configuration reported by the logger
+        already matches the one left by the last session and the content of the
+        profile has not changed since (an edited profile with the same name is
+        applied again).
+
+        Parameters:
+        ----------
+        profile_name: str
+            name of the measurement profile to apply (see
+            measurement_profiles.json). If None, channels are autoranged
+
+        reading_time: bool
+            whether the logger returns the time stamp of every reading
+            (used to align the channels, see timestamp_alignment.py)
 
         Returns:
         -------
-        rm: visa.ResourceManager
-            visa resource manager created by the visa library
+        session: DataLogger
+            this object, whose close() releases the connection
 
-        my_instrument: rm.open_resource()
-            logger instrument from which it is possible to write commands 
+        my_instrument: VisaTransport or SocketTransport
+            logger instrument from which it is possible to write commands
             and query states.
         """
 
-        rm = visa.ResourceManager()
-        my_instrument = rm.open_resource(self.VISA_ADDRESS)
+        my_instrument = self.transport
+        profile = None
+        if profile_name is not None:
+            profile = load_measurement_profile(profile_name)
+
+        # the groups of a profile applied to a previous instrument of the
+        # session (e.g. the other atmosphere of a campaign) must not be scanned
+        DataLogger.channel_groups = None
+        DataLogger.last_reading_times = {}
+
+        previous_state = DataLogger.read_state()
+        if (previous_state.get("profile_name") == profile_name) and (
+            previous_state.get("reading_time") == reading_time) and (
+            previous_state.get("profile_hash") == DataLogger.profile_hash(profile)) and (
+            previous_state.get("hash") == DataLogger.configuration_hash(
+                my_instrument, profile)):
+            print("Logger configuration unchanged, skipping reset")
+            my_instrument.write("*CLS")
+            DataLogger.binary_transfer = previous_state["binary_transfer"]
+            DataLogger.reading_time = reading_time
+            if profile is not None:
+                DataLogger.channel_groups = {name: group["channels"] for name, group
+                    in profile["channel_groups"].items()}
+
+        else:
+            # initial configuration
+            my_instrument.write(":ABORt")
+            my_instrument.write("*RST")
+            my_instrument.write("*CLS")
 
-        # initial configuration
-        my_instrument.write(":ABORt")
-        my_instrument.write("*RST")
-        my_instrument.write("*CLS")
-        my_instrument.time_out = self.time_out
+            # the reading format is set once here instead of on every query
+            DataLogger.configure_reading_format(my_instrument, reading_time)
+
+            # fix ranges and integration times once for the whole session
+            if profile is not None:
+                DataLogger.apply_measurement_profile(my_instrument, profile)
+
+            DataLogger.write_state({"profile_name": profile_name,
+                "reading_time": reading_time,
+                "binary_transfer": DataLogger.binary_transfer,
+                "profile_hash": DataLogger.profile_hash(profile),
+                "hash": DataLogger.configuration_hash(my_instrument, profile)})
+
+        if profile is not None:
+            scan_time = expected_scan_time(profile)
+            print(f"Measurement profile {profile_name}: expected scan time "
+                f"{scan_time:.3f} s (budget {profile['time_budget_s']} s)")
+            if scan_time > profile["time_budget_s"]:
+                print("Warning: expected scan time exceeds the time budget of the profile")
 
         # make sure the lamps are off before starting
         my_instrument.write(':SOURce:VOLTage %G,(%s)' % (0, '@304'))
-        
-        return (rm, my_instrument)
 
+        return (self, my_instrument)
+
+    def close(self):
+        """
+        Closes the connection to the logger
+        """
+        self.transport.close()
+
+    @staticmethod
+    def configuration_hash(my_instrument, profile=None):
+        """
+        Queries the reading format and the configuration of the channels in the
+        profile (pipelined when the transport allows it) and hashes the replies
+
+        Parameters:
+        ----------
+        my_instrument: VisaTransport or SocketTransport
+            logger instrument
+
+        profile: dict
+            measurement profile whose channels are checked
+
+        Returns:
+        -------
+        hash: str
+            sha1 of the replies of the logger
+        """
+        queries = ["*IDN?",
+            ":FORMat:READing:CHANnel?",
+            ":FORMat:READing:ALARm?",
+            ":FORMat:READing:UNIT?",
+            ":FORMat:READing:TIME?"]
+        if profile is not None:
+            for group in profile["channel_groups"].values():
+                queries.append(':CONFigure? (%s)' % (group["channels"]))
+                queries.append(':SENSe:ZERO:AUTO? (%s)' % (group["channels"]))
+                if "aperture" in group:
+                    queries.append(':SENSe:%s:APERture? (%s)' % (
+                        group["function"], group["channels"]))
+                else:
+                    queries.append(':SENSe:%s:NPLC? (%s)' % (
+                        group["function"], group["channels"]))
+
+        replies = my_instrument.query_pipelined(queries)
+        return hashlib.sha1("\n".join(replies).encode()).hexdigest()
+
+    @staticmethod
+    def profile_hash(profile=None):
+        """
+        Hashes the content of a measurement profile, so that a profile edited
+        in measurement_profiles.json is not taken for the one already applied
+
+        Parameters:
+        ----------
+        profile: dict
+            measurement profile (None if the channels are autoranged)
+
+        Returns:
+        -------
+        hash: str
+            sha1 of the profile
+        """
+        return hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+
+    @staticmethod
+    def read_state(path=STATE_FILE):
+        """
+        Returns the configuration state saved by the last session (empty dict if none)
+        """
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as handle:
+            return json.load(handle)
+
+    @staticmethod
+    def write_state(state, path=STATE_FILE):
+        """
+        Saves the configuration state of this session
+        """
+        with open(path, "w") as handle:
+            json.dump(state, handle)
+
+    @staticmethod
+    def configure_reading_format(my_instrument, reading_time=False):
+        """
+        Configures the logger so that it only returns the readings (no channel
+        number, alarm or units) and, if the logger supports it, so that they
+        are transferred as binary real numbers.
+
+        Parameters:
+        ----------
+        my_instrument: VisaTransport or SocketTransport
+            logger instrument
+
+        reading_time: bool
+            whether every reading is followed by its time stamp relative to
+            the start of the scan
+        """
+        my_instrument.write(':FORMat:READing:CHANnel %d' % (0))
+        my_instrument.write(':FORMat:READing:ALARm %d' % (0))
+        my_instrument.write(':FORMat:READing:UNIT %d' % (0))
+        my_instrument.write(':FORMat:READing:TIME %d' % (int(reading_time)))
+        my_instrument.write(':FORMat:READing:TIME:TYPE %s' % ('REL'))
+        DataLogger.reading_time = reading_time
+
+        # try binary transfer and fall back to ASCII if the command is rejected
+        my_instrument.write(':FORMat:DATA %s,%d' % ('REAL', 64))
+        error = my_instrument.query(':SYSTem:ERRor?')
+        DataLogger.binary_transfer = error.strip().startswith(("+0", "0"))
+        if not DataLogger.binary_transfer:
+            my_instrument.write(':FORMat:DATA %s' % ('ASCii'))
+            my_instrument.write("*CLS")
+
+    @staticmethod
+    def apply_measurement_profile(my_instrument, profile):
+        """
+        Configures range, integration time and autozero of every channel group
+        in the profile. Afterwards, the query functions scan the configured
+        channels with READ? instead of reconfiguring them with MEASure?
+
+        Parameters:
+        ----------
+        my_instrument: VisaTransport or SocketTransport
+            logger instrument
+
+        profile: dict
+            measurement profile (see load_measurement_profile)
+        """
+        for group in profile["channel_groups"].values():
+            channels = group["channels"]
+            function = group["function"]
+
+            if function == "TEMPerature":
+                my_instrument.write(':CONFigure:TEMPerature %s,%s,(%s)' % (
+                    group["transducer"], group["type"], channels))
+            else:
+                my_instrument.write(':CONFigure:%s %G,(%s)' % (
+                    function, group["range"], channels))
+
+            if "aperture" in group:
+                my_instrument.write(':SENSe:%s:APERture %G,(%s)' % (
+                    function, group["aperture"], channels))
+            else:
+                my_instrument.write(':SENSe:%s:NPLC %G,(%s)' % (
+                    function, group["nplc"], channels))
+
+            my_instrument.write(':SENSe:ZERO:AUTO %s,(%s)' % (
+                group.get("autozero", "ON"), channels))
+
+        DataLogger.channel_groups = {name: group["channels"] for name, group
+            in profile["channel_groups"].items()}
+
+    @staticmethod
+    def _group_query(group_name, measure_query):
+        """
+        Returns the query for a channel group: a scan of the channels configured
+        by the measurement profile or, if the group is not in the profile, the
+        MEASure? query
+        """
+        if (DataLogger.channel_groups is None) or (
+            group_name not in DataLogger.channel_groups):
+            return measure_query
+        return ':ROUTe:SCAN (%s);:READ?' % (DataLogger.channel_groups[group_name])
+
+    @staticmethod
+    def query_readings(my_instrument, query, offset=0.0, group_name=None):
+        """
+        Sends a query to the logger and returns the parsed readings, using
+        binary transfer when available
+
+        Parameters:
+        ----------
+        my_instrument: VisaTransport or SocketTransport
+            logger instrument
+
+        query: str
+            SCPI query (e.g. ':MEASure:VOLTage:DC? AUTO,(@101)')
+
+        offset: float
+            offset added to all the readings
+
+        group_name: str
+            name under which the time stamps of the readings are kept in
+            last_reading_times (only if reading_time is enabled)
+
+        Returns:
+        -------
+        readings: np.array
+            array of floats with the readings
+        """
+        if DataLogger.binary_transfer:
+            response = my_instrument.query_binary_values(query,
+                datatype="d", is_big_endian=True, container=np.array)
+        else:
+            response = my_instrument.query(query)
+
+        return DataLogger._parse_group(response, offset, group_name)
+
+    @staticmethod
+    def _parse_group(response, offset, group_name):
+        """
+        Parses the readings of a group and keeps their time stamps if enabled
+        """
+        if not DataLogger.reading_time:
+            return parse_readings(response, offset)
+
+        readings, reading_times = parse_timed_readings(response, offset)
+        DataLogger.last_reading_times[group_name] = reading_times
+        return readings
+
+    @staticmethod
     def query_data_for_HRR(my_instrument):
         """
         This function queries the voltages and temperatures needed
@@ -65,42 +496,60 @@ class DataLogger():
 
         Returns:
         -------
-        response: list
-            list of [O2, DPT, CO, CO2, APT, Inlet_O2, RH]
-        response_TCs: list
-            list of [Duct_TC, Ambient_TC]
+        response: np.array
+            volts of [O2, DPT, CO, CO2, APT, Inlet_O2, RH]
+        response_TCs: np.array
+            kelvin of [Duct_TC, Ambient_TC]
 
         """
-        my_instrument.write(':FORMat:READing:CHANnel %d' % (1))
-        my_instrument.write(':FORMat:READing:ALARm %d' % (1))
-        my_instrument.write(':FORMat:READing:UNIT %d' % (1))
-        my_instrument.write(':FORMat:READing:TIME:TYPE %s' % ('REL'))
-        response = my_instrument.query_ascii_values(
-            ':MEASure:VOLTage:DC? %s,(%s)' % (
-                'AUTO', '@101,102,103,104,109,116,201'))
-        response_TCs = my_instrument.query(
-            ':MEASure:TEMPerature? %s,%s,(%s)' % (
-                'TCouple', 'K', '@112,113'))
+        # both queries are sent before reading the replies when the transport
+        # allows pipelining
+        volts_reply, temperatures_reply = my_instrument.query_pipelined([
+            DataLogger._group_query("hrr_volts",
+                ':MEASure:VOLTage:DC? %s,(%s)' % (
+                    'AUTO', '@101,102,103,104,109,116,201')),
+            DataLogger._group_query("hrr_temperatures",
+                ':MEASure:TEMPerature? %s,%s,(%s)' % (
+                    'TCouple', 'K', '@112,113'))],
+            binary=DataLogger.binary_transfer)
+        response = DataLogger._parse_group(volts_reply, 0.0, "hrr_volts")
+        response_TCs = DataLogger._parse_group(temperatures_reply,
+            CELSIUS_TO_KELVIN, "hrr_temperatures")
 
         return (response, response_TCs)
 
+    @staticmethod
     def query_data_for_sampletemperatures(my_instrument):
         """
-        This function queries the voltages and temperatures needed
-        to calculate the HRR
-        
+        This function queries the in-depth temperatures of the sample
+
         Returns:
         -------
-        response: list
-            list of [T4, T8, T12, T16]
-        
+        response: np.array
+            kelvin of [T4, T8, T12, T16]
+
         """
-        my_instrument.write(':FORMat:READing:CHANnel %d' % (1))
-        my_instrument.write(':FORMat:READing:ALARm %d' % (1))
-        my_instrument.write(':FORMat:READing:UNIT %d' % (1))
-        my_instrument.write(':FORMat:READing:TIME:TYPE %s' % ('REL'))
-        response = my_instrument.query(
-            ':MEASure:TEMPerature? %s,%s,(%s)' % (
-                'TCouple', 'K', '@202:205'))
+        response = DataLogger.query_readings(my_instrument,
+            DataLogger._group_query("sample_temperatures",
+                ':MEASure:TEMPerature? %s,%s,(%s)' % (
+                    'TCouple', 'K', '@202:205')), CELSIUS_TO_KELVIN,
+            "sample_temperatures")
+
+        return response
+
+    @staticmethod
+    def query_heat_flux_gauge(my_instrument):
+        """
+        This function queries the voltage of the heat flux gauge (@110)
+
+        Returns:
+        -------
+        response: float
+            volts from the heat flux gauge
+
+        """
+        response = DataLogger.query_readings(my_instrument,
+            DataLogger._group_query("heat_flux_gauge",
+                ':MEASure:VOLTage:DC? (%s)' % ('@110')), 0.0, "heat_flux_gauge")
 
-        return response       
\ No newline at end of file
+        return response[0]
@@ -0,0 +1,82 @@
+"""
+Smith predictor used to compensate the dead time of the controlled loops
+
+The response of the NHF (conduction to the thermocouples) and of the MLR
+(moving average) to a change of the lamp voltage is delayed. The predictor
+runs a first order plus dead time (FOPDT) model of the loop with the same
+voltage sent to the lamps and gives the PID
+
+    measurement + model without dead time - model with dead time
+
+so the PID acts on the predicted response instead of waiting for the delayed
+one. If the model is exact, the delayed terms cancel and the loop behaves as
+if it had no dead time. Model errors are still corrected by the measurement.
+The delay line is a fixed size ring buffer, so each update has a constant cost.
+"""
+
+import numpy as np
+
+
+class SmithPredictor():
+    """
+    Dead time compensator to be placed in front of the input of the PID
+    """
+
+    def __init__(self, gain, time_constant, dead_time, dt):
+        """
+        Parameters:
+        ----------
+        gain: float
+            steady state change of the measurement per volt of the lamps
+            (e.g. kW/m2 per V or g/m2s per V)
+
+        time_constant: float
+            time constant of the model in seconds
+
+        dead_time: float
+            dead time of the model in seconds
+
+        dt: float
+            time between updates in seconds (logging period)
+        """
+        self.gain = gain
+        self.decay = np.exp(-dt / time_constant)
+        self.delay_line = np.zeros(max(1, int(round(dead_time / dt))))
+        self.index = 0
+        self.model_output = 0.0
+
+    def reset(self, voltage):
+        """
+        Sets the model at steady state for the given lamp voltage
+        """
+        self.model_output = self.gain * voltage
+        self.delay_line[:] = self.model_output
+        self.index = 0
+
+    def update(self, measurement, voltage):
+        """
+        Advances the model one period and returns the input for the PID
+
+        Parameters:
+        ----------
+        measurement: float
+            latest measurement (e.g. nhf or moving average of the mlr)
+
+        voltage: float
+            lamp voltage applied during the last period
+
+        Returns:
+        -------
+        predicted_input: float
+            measurement corrected with the response of the model that has
+            not reached the measurement yet
+        """
+        self.model_output = self.decay * self.model_output + \
+            (1 - self.decay) * self.gain * voltage
+
+        # oldest value of the ring buffer is the model output dead_time ago
+        delayed_output = self.delay_line[self.index]
+        self.delay_line[self.index] = self.model_output
+        self.index = (self.index + 1) % len(self.delay_line)
+
+        return measurement + self.model_output - delayed_output
@@ -0,0 +1,242 @@
+"""
+Multi-resolution (min/max) downsampling of recorded experiments
+
+Each level of the pyramid groups the samples of the previous level in bins of
+`factor` samples and keeps the minimum and maximum of every channel in each
+bin, so peaks and dropouts are still visible at any zoom. The viewer picks the
+coarsest level that still has about one bin per pixel for the requested time
+window, so the number of points drawn only depends on the width of the plot.
+
+The pyramid of a test (<name>_pyramid.npz) is built by the experiment scripts
+when the test ends. The pyramids of the tests of a campaign are concatenated on
+a common time axis (see campaign_pyramid), so the same viewer zooms and pans
+across the whole campaign.
+
+Use:
+python downsampling_pyramid.py <csv file or folder> [<csv file or folder> ...]
+to build the pyramid of every test recorded before the scripts built them.
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from run_metadata import find_recorded_tests, read_run_metadata
+
+
+def build_pyramid(t, values, factor=4, min_bins=256):
+    """
+    Builds the min/max levels of a recorded test
+
+    Parameters:
+    ----------
+    t: np.array
+        (N,) times in seconds, increasing
+
+    values: np.array
+        (N, channels) recorded values
+
+    factor: int
+        number of bins of a level grouped in each bin of the next level
+
+    min_bins: int
+        the coarsest level has at least this number of bins
+
+    Returns:
+    -------
+    levels: list
+        list of dicts with "t" (start time of each bin), "min" and "max"
+        ((bins, channels) arrays). Level 0 is the raw data
+    """
+    values = np.asarray(values, dtype=float).reshape(len(t), -1)
+    levels = [{"t": np.asarray(t, dtype=float), "min": values, "max": values}]
+
+    while len(levels[-1]["t"]) >= factor * min_bins:
+        previous = levels[-1]
+        number_of_bins = int(np.ceil(len(previous["t"]) / factor))
+        padding = number_of_bins * factor - len(previous["t"])
+
+        # pad the last bin with nan so that every bin has `factor` samples
+        minimum = np.pad(previous["min"], ((0, padding), (0, 0)), constant_values=np.nan)
+        maximum = np.pad(previous["max"], ((0, padding), (0, 0)), constant_values=np.nan)
+        channels = minimum.shape[1]
+
+        levels.append({"t": previous["t"][::factor],
+            "min": np.nanmin(minimum.reshape(number_of_bins, factor, channels), axis=1),
+            "max": np.nanmax(maximum.reshape(number_of_bins, factor, channels), axis=1)})
+
+    return levels
+
+
+def view(levels, t_start, t_end, pixel_width):
+    """
+    Returns the data to draw a time window with a given width in pixels
+
+    Parameters:
+    ----------
+    levels: list
+        pyramid returned by build_pyramid or load_pyramid
+
+    t_start, t_end: float
+        time window in seconds
+
+    pixel_width: int
+        width of the plot in pixels
+
+    Returns:
+    -------
+    t: np.array
+        times of the points, each bin appears twice (min then max) so that
+        the line covers the full range of the bin
+
+    values: np.array
+        (points, channels) values to be plotted
+    """
+    for level in reversed(levels):
+        first, last = np.searchsorted(level["t"], [t_start, t_end])
+        if last - first >= pixel_width or level is levels[0]:
+            break
+
+    # include the bin that contains t_start
+    first = max(first - 1, 0)
+    if level is levels[0]:
+        return level["t"][first:last], level["min"][first:last]
+
+    t = np.repeat(level["t"][first:last], 2)
+    values = np.empty((2*(last - first), level["min"].shape[1]))
+    values[0::2] = level["min"][first:last]
+    values[1::2] = level["max"][first:last]
+
+    return t, values
+
+
+def save_pyramid(path, levels, channel_names):
+    """
+    Saves the pyramid and the channel names to a .npz file
+    """
+    arrays = {"channel_names": np.array(channel_names)}
+    for l, level in enumerate(levels):
+        for key in ["t", "min", "max"]:
+            arrays[f"level{l}_{key}"] = level[key]
+    np.savez(path, **arrays)
+
+
+def load_pyramid(path):
+    """
+    Loads a pyramid saved by save_pyramid
+
+    Returns:
+    -------
+    levels: list
+        pyramid (see build_pyramid)
+
+    channel_names: list
+        name of each channel
+    """
+    data = np.load(path)
+    levels = []
+    l = 0
+    while f"level{l}_t" in data:
+        levels.append({key: data[f"level{l}_{key}"] for key in ["t", "min", "max"]})
+        l += 1
+    return levels, [str(name) for name in data["channel_names"]]
+
+
+def build_pyramid_for_test(csv_path, factor=4):
+    """
+    Builds and saves the pyramid of all the numeric channels of a recorded test
+
+    Returns:
+    -------
+    pyramid_path: str
+        path of the .npz file (<name>_pyramid.npz next to the csv file)
+    """
+    data = pd.read_csv(csv_path)
+    data = data[pd.to_numeric(data["time_seconds"], errors="coerce").notna()]
+    data = data.apply(pd.to_numeric, errors="coerce")
+    data = data.dropna(axis=1, how="all")
+
+    channel_names = [column for column in data.columns if column != "time_seconds"]
+    levels = build_pyramid(data["time_seconds"].values, data[channel_names].values,
+        factor)
+
+    pyramid_path = f"{csv_path.split('.csv')[0]}_pyramid.npz"
+    save_pyramid(pyramid_path, levels, channel_names)
+
+    return pyramid_path
+
+
+def campaign_pyramid(csv_paths, gap=60):
+    """
+    Concatenates the pyramids of several tests on a common time axis. The
+    pyramid of a test that has none is built first.
+
+    The tests are placed at their start time when every test has
+    "time_start_logging" in its metadata, and one after the other with `gap`
+    seconds between them otherwise. Level l of the campaign holds level l of
+    every test (its coarsest level if it has fewer), and the channels of all
+    the tests are kept (nan in the tests that do not record them).
+
+    Parameters:
+    ----------
+    csv_paths: list
+        csv files of the tests, in the order they were run
+
+    gap: float
+        seconds between two tests without start times
+
+    Returns:
+    -------
+    levels: list
+        pyramid of the campaign (see build_pyramid), to be used with view
+
+    channel_names: list
+        name of each channel
+
+    test_starts: np.array
+        time of the start of each test on the time axis of the campaign
+    """
+    pyramids = []
+    for csv_path in csv_paths:
+        pyramid_path = f"{csv_path.split('.csv')[0]}_pyramid.npz"
+        if not os.path.exists(pyramid_path):
+            pyramid_path = build_pyramid_for_test(csv_path)
+        pyramids.append(load_pyramid(pyramid_path))
+
+    start_times = [read_run_metadata(csv_path).get("time_start_logging")
+        for csv_path in csv_paths]
+    test_starts = np.zeros(len(csv_paths))
+    if None not in start_times:
+        test_starts = np.array(start_times) - start_times[0]
+    else:
+        for p in range(1, len(pyramids)):
+            test_starts[p] = test_starts[p-1] + pyramids[p-1][0][0]["t"][-1] + gap
+
+    channel_names = []
+    for _, names in pyramids:
+        channel_names += [name for name in names if name not in channel_names]
+
+    levels = []
+    for l in range(max(len(test_levels) for test_levels, _ in pyramids)):
+        level = {"t": [], "min": [], "max": []}
+        for (test_levels, names), test_start in zip(pyramids, test_starts):
+            test_level = test_levels[min(l, len(test_levels) - 1)]
+            columns = [names.index(name) if name in names else None for name in channel_names]
+            level["t"].append(test_level["t"] + test_start)
+            for key in ["min", "max"]:
+                values = np.full((len(test_level["t"]), len(channel_names)), np.nan)
+                for c, column in enumerate(columns):
+                    if column is not None:
+                        values[:, c] = test_level[key][:, column]
+                level[key].append(values)
+        levels.append({key: np.concatenate(arrays) for key, arrays in level.items()})
+
+    return levels, channel_names, test_starts
+
+
+if __name__ == "__main__":
+
+    # build the pyramids of all the tests given as files or folders
+    for path in sys.argv[1:]:
+        for csv_path in find_recorded_tests(path):
+            print(f"Pyramid saved to {build_pyramid_for_test(csv_path)}")
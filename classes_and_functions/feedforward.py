@@ -0,0 +1,93 @@
+"""
+Feedforward of the lamp voltage for a target NHF
+
+In steady state the NHF is the absorbed IHF minus the convective losses and
+the reradiation of the surface:
+
+    NHF = absorptivity IHF - h_convective (Ts - T_ambient)
+          - emissivity sigma (Ts**4 - T_ambient**4)
+
+so the IHF needed for a target NHF follows from the current surface
+temperature, and the voltage from the inverse calibration of the lamps. The
+PID then only trims the residual of this prediction (see trim_limits).
+
+The feedforward should not be enabled:
+- with a derivative term in the trim. Its input contains the IHF just sent, so
+  the derivative chatters between the lamp limits (main_constant_nhf.py uses
+  feedforward_kd = 0)
+- when the ramp brings the NHF close to the setpoint by the activation of the
+  PID. The predicted step then overshoots, and in simulator.py the PID alone
+  settles faster at 20 and 25 kW/m2 with the quadratic estimator
+- when the calibration of the lamps or the surface properties (emissivity,
+  absorptivity, h_convective) are not those of the test, since the whole
+  voltage is predicted from them
+"""
+
+import numpy as np
+
+STEFAN_BOLTZMANN = 5.67e-8        # W/m2K4
+
+
+class NHFFeedforward():
+    """
+    Predicts the lamp voltage needed for a target NHF
+    """
+
+    def __init__(self, coeff_hftovolts, T_ambient, h_convective=10, emissivity=0.9,
+        absorptivity=1.0, max_lamp_voltage=4.5, min_lamp_voltage=0.25):
+        """
+        Parameters:
+        ----------
+        coeff_hftovolts: np.array
+            calibration of the lamps (kW/m2 to volts)
+
+        T_ambient: float
+            temperature of the surroundings in K
+
+        h_convective: float
+            convective heat transfer coefficient in W/m2K
+
+        emissivity, absorptivity: float
+            of the surface of the sample
+        """
+        self.coeff_hftovolts = coeff_hftovolts
+        self.T_ambient = T_ambient
+        self.h_convective = h_convective
+        self.emissivity = emissivity
+        self.absorptivity = absorptivity
+        self.max_lamp_voltage = max_lamp_voltage
+        self.min_lamp_voltage = min_lamp_voltage
+
+    def surface_losses(self, surface_temperature):
+        """
+        Convective and reradiation losses in kW/m2
+        """
+        return (self.h_convective * (surface_temperature - self.T_ambient) +
+            self.emissivity * STEFAN_BOLTZMANN * (surface_temperature**4 -
+            self.T_ambient**4)) / 1000
+
+    def ihf(self, nhf_target, surface_temperature):
+        """
+        IHF in kW/m2 that gives the target NHF at the current surface temperature
+        """
+        return (nhf_target + self.surface_losses(surface_temperature)) / self.absorptivity
+
+    def voltage(self, nhf_target, surface_temperature):
+        """
+        Lamp voltage that gives the target NHF (within the limits of the lamps)
+        """
+        voltage = np.polyval(self.coeff_hftovolts, self.ihf(nhf_target, surface_temperature))
+        return min(max(voltage, self.min_lamp_voltage), self.max_lamp_voltage)
+
+    def trim_limits(self, feedforward_voltage):
+        """
+        Limits of the PID output when it trims the feedforward voltage, so
+        that the total voltage (and the integral term) stays within the
+        limits of the lamps
+
+        Returns:
+        -------
+        max_trim, min_trim: float
+        """
+        return (self.max_lamp_voltage - feedforward_voltage,
+            self.min_lamp_voltage - feedforward_voltage)
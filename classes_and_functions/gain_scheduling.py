@@ -0,0 +1,127 @@
+"""
+Gain scheduling of the PID across the operating range of the lamps
+
+The heat flux of the lamps is a cubic of the voltage, so the gain of the loop
+(and the response time of the lamps) changes with the operating point. The
+schedule keeps the loop gain of the reference gains (the ones tuned at the
+reference voltage) constant:
+
+    kp(v) = kp_ref K(v_ref)/K(v)      Ti(v) = Ti_ref tau(v)/tau(v_ref)
+
+with K(v) the gain of the lamps in kW/m2 per volt, from the identified models
+(lamps_mappingANDperformance.py) or else from the slope of the calibration,
+and tau(v) the identified time constant (constant without models). Td is
+scaled as Ti. The table is resampled on a uniform grid, so looking up the
+gains of an operating point is one index calculation and one interpolation.
+"""
+
+import numpy as np
+from system_identification import interpolate_model
+
+
+class GainSchedule():
+    """
+    Table of PID gains indexed by the operating point (lamp voltage or IHF)
+    """
+
+    def __init__(self, operating_points, kp, ki, kd, number_of_entries=64):
+        """
+        Parameters:
+        ----------
+        operating_points: np.array
+            increasing lamp voltages or IHF of the table entries
+
+        kp, ki, kd: np.array
+            gains at each entry
+
+        number_of_entries: int
+            size of the uniform grid on which the table is resampled
+        """
+        self.start = operating_points[0]
+        self.step = (operating_points[-1] - operating_points[0]) / (number_of_entries - 1)
+        grid = self.start + self.step * np.arange(number_of_entries)
+        self.table = np.column_stack([np.interp(grid, operating_points, gains)
+            for gains in [kp, ki, kd]])
+        self.operating_points = grid
+
+    def gains(self, operating_point):
+        """
+        Interpolated gains at the operating point (clamped to the table)
+
+        Returns:
+        -------
+        kp, ki, kd: float
+        """
+        position = min(max((operating_point - self.start) / self.step, 0),
+            len(self.table) - 1)
+        i = min(int(position), len(self.table) - 2)
+        weight = position - i
+        kp, ki, kd = (1 - weight) * self.table[i] + weight * self.table[i+1]
+        return kp, ki, kd
+
+    def as_dict(self):
+        """
+        Table as lists (for the metadata of the test)
+        """
+        return {"operating_points": self.operating_points.tolist(),
+            "kp": self.table[:, 0].tolist(),
+            "ki": self.table[:, 1].tolist(),
+            "kd": self.table[:, 2].tolist()}
+
+
+def build_gain_schedule(kp, ki, kd, reference_voltage, coeff_voltstohf,
+    lamp_models=None, min_lamp_voltage=0.25, max_lamp_voltage=4.5, index="voltage",
+    number_of_entries=64):
+    """
+    Generates the gain schedule from the reference gains
+
+    Parameters:
+    ----------
+    kp, ki, kd: float
+        gains tuned (or configured) at the reference voltage
+
+    reference_voltage: float
+        lamp voltage at which the reference gains were tuned
+
+    coeff_voltstohf: np.array
+        calibration of the lamps (volts to kW/m2)
+
+    lamp_models: dict
+        identified models (extract_lamp_models()). None to use the slope of
+        the calibration only
+
+    index: str
+        "voltage" or "IHF", operating point used to look up the gains
+
+    Returns:
+    -------
+    schedule: GainSchedule
+    """
+    voltages = np.linspace(min_lamp_voltage, max_lamp_voltage, number_of_entries)
+
+    if lamp_models is None:
+        slope = np.polyval(np.polyder(coeff_voltstohf), voltages)
+        reference_slope = np.polyval(np.polyder(coeff_voltstohf), reference_voltage)
+        time_constant_ratio = np.ones_like(voltages)
+    else:
+        models = [interpolate_model(lamp_models["operating_points"], v) for v in voltages]
+        reference = interpolate_model(lamp_models["operating_points"], reference_voltage)
+        slope = np.array([model["gain"] for model in models])
+        reference_slope = reference["gain"]
+        time_constant_ratio = np.array([model["time_constant"] for model in models]) / \
+            reference["time_constant"]
+
+    # avoid infinite gains where the calibration is flat
+    slope = np.maximum(slope, 0.05 * reference_slope)
+
+    kp_schedule = kp * reference_slope / slope
+    ki_schedule = ki * reference_slope / slope / time_constant_ratio
+    kd_schedule = kd * reference_slope / slope * time_constant_ratio
+
+    if index == "IHF":
+        operating_points = np.polyval(coeff_voltstohf, voltages)
+    else:
+        operating_points = voltages
+
+    return GainSchedule(operating_points, kp_schedule, ki_schedule, kd_schedule,
+        number_of_entries)
@@ -26,7 +26,7 @@ span_CO2_concentration = 2350
 
 # create instance of the data logger and check connection
 print("\nConnection to data logger")
-rm, logger = DataLogger().new_instrument()
+rm, logger = DataLogger().new_instrument("low_noise")
 
 print("Starting HRR calibration procedure.\n")
 
@@ -0,0 +1,212 @@
+"""
+Inverse heat conduction solver for the net heat flux (NHF) at the surface
+
+Sequential function specification (Beck): the heat flux at the surface is
+assumed constant over the next `future_time` seconds and is chosen so
+that the conduction model (see state_estimator.py) matches the in-depth
+thermocouples over those periods in the least squares sense. The model is
+then advanced one period with that heat flux.
+
+For a given model the estimate is a fixed linear combination of the readings
+and of the current temperature profile, so the gains are computed once and
+each update costs one small matrix-vector product. The batch mode runs the
+same recursion over a whole recorded test, with the contribution of the
+readings computed for all the rows at once.
+
+Use:
+python inverse_heat_conduction.py <csv file> [<csv file> ...]
+to reprocess recorded tests (<name>_sfs.csv next to each csv file).
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+from state_estimator import build_conduction_model, interpolation_matrix
+
+
+class SequentialFunctionSpecification():
+    """
+    Incremental (one reading per tick) and batch estimation of the NHF
+    """
+
+    def __init__(self, dt, conductivity, diffusivity,
+        thermocouple_depths=(0.004, 0.008, 0.012, 0.016), thickness=0.025,
+        dx=0.002, future_time=15):
+        """
+        Parameters:
+        ----------
+        dt: float
+            time between readings in seconds (logging period)
+
+        conductivity: float
+            W/mK
+
+        diffusivity: float
+            m2/s
+
+        thermocouple_depths: tuple
+            depth of the thermocouples in m
+
+        thickness, dx: float
+            thickness of the sample and distance between nodes in m
+
+        future_time: float
+            time in seconds over which the heat flux is assumed constant. A
+            longer time reduces the amplification of the noise of the
+            thermocouples and delays the estimates by the same time
+        """
+        A, B, self.node_depths = build_conduction_model(dt, conductivity,
+            diffusivity, thickness, dx)
+        H = interpolation_matrix(thermocouple_depths, self.node_depths)
+        self.A = A
+        self.B = B
+        self.H = H
+        self.future_steps = max(1, int(round(future_time / dt)))
+        self.number_of_thermocouples = len(thermocouple_depths)
+
+        # response of the thermocouples i = 1..r steps ahead to the current
+        # profile (Phi) and to a constant heat flux of 1 W/m2 (X)
+        Phi = []
+        X = []
+        A_power = np.eye(len(self.node_depths))
+        step_response = np.zeros(len(self.node_depths))
+        for i in range(self.future_steps):
+            step_response = A @ step_response + B
+            A_power = A @ A_power
+            X.append(H @ step_response)
+            Phi.append(H @ A_power)
+        X = np.concatenate(X)
+        Phi = np.vstack(Phi)
+
+        # q = gain_readings @ readings - gain_profile @ profile
+        self.gain_readings = X / (X @ X)
+        self.gain_profile = self.gain_readings @ Phi
+
+        self.profile = None
+        # the last future_steps readings are written twice in a buffer of twice
+        # their length, so that they are always a contiguous slice
+        self.readings = np.zeros((2 * self.future_steps, self.number_of_thermocouples))
+        self.number_of_readings = 0
+
+    def initial_profile(self, temperatures):
+        """
+        Temperature of the nodes interpolated from the thermocouple readings
+        """
+        thermocouple_depths = self.H @ self.node_depths
+        return np.interp(self.node_depths, thermocouple_depths, temperatures)
+
+    def update(self, temperatures):
+        """
+        Adds the readings of one tick
+
+        Parameters:
+        ----------
+        temperatures: np.array
+            readings of the thermocouples in K
+
+        Returns:
+        -------
+        nhf: float
+            NHF in kW/m2 during the period that started future_steps ticks
+            before this one (nan until enough readings are available)
+
+        surface_temperature: float
+            surface temperature in K at the end of that period
+        """
+        if self.profile is None:
+            self.profile = self.initial_profile(temperatures)
+            return np.nan, np.nan
+
+        r = self.future_steps
+        row = self.number_of_readings % r
+        self.readings[row] = temperatures
+        self.readings[row + r] = temperatures
+        self.number_of_readings += 1
+        if self.number_of_readings < r:
+            return np.nan, np.nan
+
+        oldest = self.number_of_readings % r
+        q = self.gain_readings @ self.readings[oldest:oldest + r].ravel() - \
+            self.gain_profile @ self.profile
+        self.profile = self.A @ self.profile + self.B * q
+
+        return q / 1000, self.profile[0]
+
+    def process(self, temperatures):
+        """
+        Batch mode: estimates the NHF of a whole recorded test. Gives the same
+        values as calling update on every row
+
+        Parameters:
+        ----------
+        temperatures: np.array
+            (N, thermocouples) readings in K. Row 0 sets the initial profile
+
+        Returns:
+        -------
+        nhf: np.array
+            (N,) NHF in kW/m2 during the period that starts at each row (nan
+            for the last future_steps rows)
+
+        surface_temperature: np.array
+            (N,) surface temperature in K at each row
+        """
+        temperatures = np.asarray(temperatures, dtype=float)
+        N = len(temperatures)
+        r = self.future_steps
+        nhf = np.full(N, np.nan)
+        surface_temperature = np.full(N, np.nan)
+        profile = self.initial_profile(temperatures[0])
+        surface_temperature[0] = profile[0]
+        number_of_estimates = N - r
+        if number_of_estimates < 1:
+            return nhf, surface_temperature
+
+        # contribution of the readings of rows k+1..k+r to each estimate, one
+        # future step at a time (memory of the order of the test, not N*r)
+        gains = self.gain_readings.reshape(r, self.number_of_thermocouples)
+        q_readings = np.zeros(number_of_estimates)
+        for i in range(r):
+            q_readings += temperatures[1 + i:1 + i + number_of_estimates] @ gains[i]
+
+        # closed loop over the rows (small matrix-vector products)
+        q = np.empty(number_of_estimates)
+        for k in range(number_of_estimates):
+            q[k] = q_readings[k] - self.gain_profile @ profile
+            profile = self.A @ profile + self.B * q[k]
+            surface_temperature[k + 1] = profile[0]
+
+        nhf[:number_of_estimates] = q / 1000
+        return nhf, surface_temperature
+
+
+def reprocess_test(csv_path, conductivity=0.19, diffusivity=1.1e-7, future_time=15):
+    """
+    Estimates the surface temperature and NHF of a recorded test with the batch
+    mode. The readings are assumed to be equally spaced (logging period)
+
+    Returns:
+    -------
+    sfs_path: str
+        path of the csv file (<name>_sfs.csv next to the csv file)
+    """
+    data = pd.read_csv(csv_path)
+    data = data[pd.to_numeric(data["time_seconds"], errors="coerce").notna()]
+    t = data["time_seconds"].astype(float).values
+    temperatures = data[["T4_K", "T8_K", "T12_K", "T16_K"]].astype(float).values
+
+    solver = SequentialFunctionSpecification(np.median(np.diff(t)), conductivity,
+        diffusivity, future_time=future_time)
+    nhf, surface_temperature = solver.process(temperatures)
+
+    sfs_path = f"{csv_path.split('.csv')[0]}_sfs.csv"
+    pd.DataFrame({"time_seconds": t, "TSurface_SFS_K": surface_temperature,
+        "NHF_SFS_kWm-2": nhf}).to_csv(sfs_path, index=False)
+
+    return sfs_path
+
+
+if __name__ == "__main__":
+
+    for csv_path in sys.argv[1:]:
+        print(f"Reprocessed test saved to {reprocess_test(csv_path)}")
@@ -21,6 +21,7 @@ from pandas import ExcelWriter
 # add path to import functions and classes (absolute path on the FPA's computer)
 sys.path.insert(1, r"C:\\Users\\FireLab\\Desktop\\Simon\\FeedbackControl_TemperatureExperiments\\classes_and_functions")
 from datalogger import DataLogger
+from lamps_extract_calibrationcoeff import CALIBRATION_FOLDER
 
 
 #####
@@ -72,7 +73,8 @@ for output_voltage in output_voltages:
 	for nmr_readings in range(nmbr_readings_pervoltage):
 
 		# read voltage from the  hf gauge
-		input_voltage = float(logger.query(':MEASure:VOLTage:DC? (%s)' % ('@110')))
+		input_voltage = DataLogger.query_readings(logger,
+			':MEASure:VOLTage:DC? (%s)' % ('@110'))[0]
 		print(f"Voltage readings from the hf gauge: {np.round(input_voltage*1000,6)} mV")
 		print(f"Corresponding heat flux: {np.round(input_voltage/hf_gauge_factor,3)} kW/m2\n")
 
@@ -105,7 +107,8 @@ for output_voltage in np.flip(output_voltages):
 	for nmr_readings in range(nmbr_readings_pervoltage):
 
 		# read voltage from the  hf gauge
-		input_voltage = float(logger.query(':MEASure:VOLTage:DC? (%s)' % ('@110')))
+		input_voltage = DataLogger.query_readings(logger,
+			':MEASure:VOLTage:DC? (%s)' % ('@110'))[0]
 		print(f"Voltage readings from the hf gauge: {np.round(input_voltage*1000,6)} mV")
 		print(f"Corresponding heat flux: {np.round(input_voltage/hf_gauge_factor,2)} kW/m2\n")
 
@@ -143,7 +146,7 @@ all_data.loc[:, "polyfit_voltage_to_heatflux"] = np.polyval(
 	coeff_voltage_to_heatflux, all_data.loc[:, "output_voltage_tolamps"])
 
 # save data into calibration data file
-address_folder = "C:\\Users\\FireLab\\Desktop\\Simon\\FeedbackControl_TemperatureExperiments\\calibration_data"
+address_folder = CALIBRATION_FOLDER
 name_file = f"{datetime.now().strftime('%Y-%m-%d-%H%M%S')}.xlsx"
 address_file = os.path.join(address_folder, name_file)
 
@@ -5,8 +5,14 @@ latest calibration performed.
 """
 
 import os
+import json
 import pandas as pd
 
+# the lamp calibrations and the identified lamp models are saved in (and read
+# from) calibration_data in the folder of the project of this file
+CALIBRATION_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+	"calibration_data")
+
 def extract_calibrationcoeff():
 	"""
 	Determines the latest polynomial fit coefficients to 
@@ -26,7 +32,7 @@ def extract_calibrationcoeff():
 	"""
 	
 	# determine the newest file in the calibration_data folder
-	path = "C:\\Users\\FireLab\\Desktop\\Simon\\FeedbackControl_MassExperiments\\calibration_data"
+	path = CALIBRATION_FOLDER
 	
 	files = os.listdir(path)
 	paths = [os.path.join(path, basename) for basename in files if ".xlsx" in basename]
@@ -40,4 +46,38 @@ def extract_calibrationcoeff():
 	fit_coefficients_voltstohf = fit_data.loc[:, 
 		"coefficients_voltage_to_heatflux"].values
 
-	return fit_coefficients_hftovolts, fit_coefficients_voltstohf
\ No newline at end of file
+	return fit_coefficients_hftovolts, fit_coefficients_voltstohf
+
+
+def extract_lamp_models():
+	"""
+	Reads the latest models of the response of the lamps identified by
+	lamps_mappingANDperformance.py
+
+	Parameters:
+	----------
+	None
+
+	Returns:
+	-------
+	lamp_models: dict
+		"operating_points": list of {"voltage", "IHF_kWm-2", "fopdt",
+		"second_order"} sorted by voltage (see system_identification.py) and
+		"file" from which they were read
+
+	"""
+
+	# determine the newest models file in the calibration_data folder
+	path = CALIBRATION_FOLDER
+
+	files = os.listdir(path)
+	paths = [os.path.join(path, basename) for basename in files if "_lamp_models.json" in basename]
+	if not paths:
+		raise FileNotFoundError(f"No lamp models in {path}, run lamps_mappingANDperformance.py")
+	latest_file = max(paths, key=os.path.getctime)
+
+	with open(latest_file, "r") as handle:
+		lamp_models = json.load(handle)
+	lamp_models["file"] = latest_file
+
+	return lamp_models
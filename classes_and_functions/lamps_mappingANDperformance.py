@@ -0,0 +1,186 @@
+"""
+Algorithm used to characterise the dynamic response of the lamps.
+
+At each operating point the lamps are held at a constant voltage, stepped up
+and back down and then driven with a PRBS around that voltage, while the heat
+flux gauge (@110) is read as fast as the logger allows. FOPDT and second
+order models are fitted for every operating point (see system_identification.py)
+and saved next to the lamp calibration, where the controllers and simulators
+read them with extract_lamp_models().
+
+"""
+
+# libraries
+import numpy as np
+import sys
+import time
+import msvcrt
+import os
+import json
+from datetime import datetime
+import pandas as pd
+import matplotlib.pyplot as plt
+
+
+# add path to import functions and classes (absolute path on the FPA's computer)
+sys.path.insert(1, r"C:\\Users\\FireLab\\Desktop\\Simon\\FeedbackControl_TemperatureExperiments\\classes_and_functions")
+from datalogger import DataLogger
+from lamps_extract_calibrationcoeff import CALIBRATION_FOLDER
+from system_identification import prbs, resample, fit_fopdt, fit_second_order, simulate_fopdt
+
+
+#####
+# CONNECT TO DATA LOGGER
+#####
+
+# only the heat flux gauge is scanned, with the shortest integration time
+print("\nConnection to data logger")
+rm, logger = DataLogger().new_instrument("lamp_identification", reading_time=True)
+
+
+#####
+# DEFINE THE TEST SEQUENCE
+#####
+
+# define constants
+lamp_voltage_limit = 4.5
+hf_gauge_factor = 0.0001017          # V/kW/m2
+operating_voltages = [1.0, 2.0, 3.0, 4.0]
+settling_time = 15                   # s
+baseline_time = 5                    # s, end of the settling period used as the equilibrium
+step_amplitude = 0.25                # V
+step_time = 10                       # s
+prbs_amplitude = 0.15                # V
+prbs_bit_time = 0.5                  # s
+resampling_period = 0.02             # s
+max_dead_time = 2                    # s
+
+# list of (operating voltage, duration, voltage) segments
+segments = []
+for operating_voltage in operating_voltages:
+	segments.append((operating_voltage, settling_time, operating_voltage))
+	segments.append((operating_voltage, step_time, operating_voltage + step_amplitude))
+	segments.append((operating_voltage, step_time, operating_voltage))
+	for bit in prbs(7):
+		segments.append((operating_voltage, prbs_bit_time,
+			operating_voltage + bit*prbs_amplitude))
+	segments.append((operating_voltage, step_time, operating_voltage))
+
+print(f"Duration of the test = {np.round(sum(s[1] for s in segments)/60, 1)} minutes")
+
+
+#####
+# DRIVE THE LAMPS AND READ THE HEAT FLUX GAUGE
+#####
+
+all_times = []
+all_operating_voltages = []
+all_output_voltages = []
+all_input_voltages = []
+
+time_start_logging = time.time()
+segment_end = time_start_logging
+bool_stop = False
+
+for operating_voltage, duration, output_voltage in segments:
+
+	# protect the lamps
+	output_voltage = min(output_voltage, lamp_voltage_limit)
+	logger.write(':SOURce:VOLTage %G,(%s)' % (output_voltage, '@304'))
+	segment_end += duration
+
+	# read the gauge without any wait until the end of the segment
+	while time.time() < segment_end:
+		t_request = time.time()
+		input_voltage = DataLogger.query_heat_flux_gauge(logger)
+		all_times.append((t_request + time.time())/2 - time_start_logging)
+		all_operating_voltages.append(operating_voltage)
+		all_output_voltages.append(output_voltage)
+		all_input_voltages.append(input_voltage)
+
+		# end if ESC is pressed
+		if msvcrt.kbhit():
+			if ord(msvcrt.getch()) == 27:
+				bool_stop = True
+				break
+
+	if bool_stop:
+		break
+
+# turn off the lamps
+logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+logger.close()
+rm.close()
+
+all_data = pd.DataFrame({"time_seconds": all_times,
+	"operating_voltage": all_operating_voltages,
+	"output_voltage_tolamps": all_output_voltages,
+	"input_voltage_fromgauge": all_input_voltages})
+all_data.loc[:, "heat_flux_kWm-2"] = all_data.loc[:, "input_voltage_fromgauge"]/hf_gauge_factor
+print(f"\nMean sampling period = {np.round(1000*all_data['time_seconds'].diff().mean(), 2)} ms")
+
+
+#####
+# FIT THE MODELS OF EACH OPERATING POINT
+#####
+
+operating_points = []
+fig, axes = plt.subplots(len(operating_voltages), 1, figsize = (12, 3*len(operating_voltages)))
+for o, operating_voltage in enumerate(operating_voltages):
+
+	# the settling period is only used to reach the operating point, except
+	# its last seconds: the equilibrium of the fit and the IHF at that voltage
+	data = all_data[all_data.loc[:, "operating_voltage"] == operating_voltage]
+	data = data[data.loc[:, "time_seconds"] >
+		data.loc[:, "time_seconds"].min() + settling_time - baseline_time]
+	if len(data) < 10:
+		continue
+
+	t = data.loc[:, "time_seconds"].values
+	_, u = resample(t, data.loc[:, "output_voltage_tolamps"].values, resampling_period)
+	time_base, y = resample(t, data.loc[:, "heat_flux_kWm-2"].values, resampling_period)
+	baseline_samples = int(baseline_time/resampling_period)
+
+	fopdt = fit_fopdt(u, y, resampling_period, max_dead_time, baseline_samples)
+	second_order = fit_second_order(u, y, resampling_period, max_dead_time,
+		baseline_samples)
+	operating_points.append({"voltage": operating_voltage,
+		"IHF_kWm-2": float(y[:baseline_samples].mean()),
+		"fopdt": fopdt,
+		"second_order": second_order})
+	print(f"\n{operating_voltage} V: FOPDT gain = {np.round(fopdt['gain'], 2)} kWm-2/V, "
+		f"time constant = {np.round(fopdt['time_constant'], 3)} s, "
+		f"dead time = {np.round(fopdt['dead_time'], 3)} s")
+
+	# compare the measurement with the response of the model
+	ax = axes[o] if len(operating_voltages) > 1 else axes
+	ax.plot(time_base, y, color = "dodgerblue", alpha = 0.5, label = "gauge")
+	ax.plot(time_base, simulate_fopdt(fopdt, u, resampling_period,
+		y[:baseline_samples].mean()),
+		color = "maroon", linewidth = 2, label = "FOPDT")
+	ax.set_ylabel("Heat Flux [kW/m2]")
+	ax.set_title(f"{operating_voltage} V")
+	ax.legend()
+ax.set_xlabel("Time [s]")
+
+
+#####
+# SAVE THE DATA AND THE MODELS NEXT TO THE LAMP CALIBRATION
+#####
+
+address_folder = CALIBRATION_FOLDER
+name_file = f"{datetime.now().strftime('%Y-%m-%d-%H%M%S')}"
+address_file = os.path.join(address_folder, name_file)
+
+all_data.to_csv(f"{address_file}_lamp_identification.csv", index = False)
+with open(f"{address_file}_lamp_models.json", "w") as handle:
+	json.dump({"date": name_file,
+		"hf_gauge_factor": hf_gauge_factor,
+		"resampling_period": resampling_period,
+		"operating_points": operating_points}, handle, indent = "\t")
+
+plt.tight_layout()
+plt.savefig(f"{address_file}_lamp_identification.pdf")
+
+print("\n\nIdentification finished")
+print(f"Total duration = {np.round((time.time() - time_start_logging)/60,1)} minutes")
@@ -0,0 +1,236 @@
+"""
+Classes used by plotting.py to follow an experiment while it runs
+
+CSVTail reads only the rows appended to the data file since the last call and
+TelemetryTail the samples received from the experiment's telemetry server.
+LineBuffer stores the samples of a line and returns a bounded number of points
+for the visible time window. BlitFigure redraws only the lines on top of a
+cached background, so the cost of a redraw does not grow with the duration
+of the test. The background is only redrawn when the axes limits change.
+"""
+
+import numpy as np
+
+
+class CSVTail():
+    """
+    Reads the new rows of a csv file that is being written by the experiment
+    """
+
+    def __init__(self, path, columns):
+        """
+        Parameters:
+        ----------
+        path: str
+            csv file written by main_constant_nhf.py
+
+        columns: list
+            names of the (numeric) columns to be returned
+        """
+        self.path = path
+        self.columns = columns
+        self.position = 0
+        self.partial_line = ""
+        self.column_index = None
+
+    def read_new(self):
+        """
+        Returns the new complete rows as a (rows, columns) array. Rows with non
+        numeric values (e.g. "end_test") are skipped
+        """
+        with open(self.path, "r", newline="") as handle:
+            handle.seek(self.position)
+            text = self.partial_line + handle.read()
+            self.position = handle.tell()
+
+        lines = text.split("\n")
+        self.partial_line = lines.pop()
+
+        # the first line is the header
+        if self.column_index is None and lines:
+            header = lines.pop(0).strip().split(",")
+            self.column_index = [header.index(column) for column in self.columns]
+
+        rows = []
+        for line in lines:
+            fields = line.strip().split(",")
+            try:
+                rows.append([float(fields[i]) for i in self.column_index])
+            except (ValueError, IndexError):
+                continue
+
+        return np.array(rows).reshape(-1, len(self.columns))
+
+
+class TelemetryTail():
+    """
+    Returns the samples received from the telemetry server since the last call
+    """
+
+    def __init__(self, client, columns):
+        """
+        Parameters:
+        ----------
+        client: telemetry.TelemetryClient
+            connection to the experiment
+
+        columns: list
+            names of the channels to be returned
+        """
+        self.client = client
+        self.columns = columns
+        self.column_index = [client.channel_names.index(column) for column in columns]
+
+    def read_new(self):
+        """
+        Returns the new samples as a (samples, columns) array
+        """
+        _, values = self.client.read_available()
+        return values[:, self.column_index]
+
+
+class LineBuffer():
+    """
+    Growing buffer with the samples of one line
+    """
+
+    def __init__(self, initial_size=4096):
+        self.t = np.empty(initial_size)
+        self.y = np.empty(initial_size)
+        self.size = 0
+
+    def append(self, t, y):
+        """
+        Appends arrays of new samples (amortised constant cost per sample)
+        """
+        new_size = self.size + len(t)
+        if new_size > len(self.t):
+            capacity = max(2*len(self.t), new_size)
+            self.t = np.resize(self.t, capacity)
+            self.y = np.resize(self.y, capacity)
+        self.t[self.size:new_size] = t
+        self.y[self.size:new_size] = y
+        self.size = new_size
+
+    def view(self, t_min, t_max, max_points):
+        """
+        Samples within [t_min, t_max], decimated to at most max_points
+        """
+        first, last = np.searchsorted(self.t[:self.size], [t_min, t_max])
+        stride = max(1, int(np.ceil((last - first) / max_points)))
+        return self.t[first:last:stride], self.y[first:last:stride]
+
+
+class BlitFigure():
+    """
+    Figure whose lines are redrawn with blitting
+    """
+
+    def __init__(self, fig, lines, window=1200, max_points=2000):
+        """
+        Parameters:
+        ----------
+        fig: matplotlib.figure.Figure
+            figure with the axes already formatted
+
+        lines: list
+            Line2D objects to be updated. They are set as animated so that
+            they are not part of the cached background
+
+        window: float
+            width of the time axis in seconds. The axis scrolls by half a
+            window when the data reaches its end. Use None to autoscale the
+            time axis to the whole test instead
+
+        max_points: int
+            maximum number of points drawn per line
+        """
+        self.fig = fig
+        self.lines = lines
+        self.buffers = [LineBuffer() for line in lines]
+        self.window = window
+        self.max_points = max_points
+        self.backgrounds = None
+
+        for line in self.lines:
+            line.set_animated(True)
+        self.fig.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        # cache the background (axes, grids, labels) after every full draw
+        self.backgrounds = [self.fig.canvas.copy_from_bbox(ax.bbox)
+            for ax in self.fig.axes]
+
+    def append(self, t, list_of_y):
+        """
+        Appends the new samples of every line
+
+        Parameters:
+        ----------
+        t: np.array
+            times of the new samples
+
+        list_of_y: list
+            one array of new values per line (same order as lines)
+        """
+        for buffer, y in zip(self.buffers, list_of_y):
+            buffer.append(t, y)
+
+    def _update_limits(self):
+        """
+        Moves the time axis and extends the y axis if needed. Returns True if
+        any limit changed (i.e. the background has to be redrawn)
+        """
+        if not self.buffers[0].size:
+            return False
+        t_last = self.buffers[0].t[self.buffers[0].size - 1]
+
+        changed = False
+        for ax in self.fig.axes:
+            ax_lines = [l for l in self.lines if l.axes is ax]
+            if not ax_lines:
+                continue
+
+            t_min, t_max = ax.get_xlim()
+            if t_last > t_max:
+                if self.window is None:
+                    t_max = 2*t_last
+                else:
+                    t_min = t_last - self.window/2
+                    t_max = t_min + self.window
+                ax.set_xlim([t_min, t_max])
+                changed = True
+
+            y_min, y_max = ax.get_ylim()
+            for line in ax_lines:
+                buffer = self.buffers[self.lines.index(line)]
+                _, y = buffer.view(t_min, t_max, self.max_points)
+                if len(y) and np.isfinite(y).any():
+                    margin = 0.1*(y_max - y_min)
+                    if np.nanmax(y) > y_max:
+                        y_max = np.nanmax(y) + margin
+                        changed = True
+                    if np.nanmin(y) < y_min:
+                        y_min = np.nanmin(y) - margin
+                        changed = True
+            ax.set_ylim([y_min, y_max])
+
+        return changed
+
+    def redraw(self):
+        """
+        Redraws the lines on top of the cached background
+        """
+        if self._update_limits() or self.backgrounds is None:
+            self.fig.canvas.draw()
+        else:
+            for background in self.backgrounds:
+                self.fig.canvas.restore_region(background)
+
+        for line, buffer in zip(self.lines, self.buffers):
+            t_min, t_max = line.axes.get_xlim()
+            line.set_data(*buffer.view(t_min, t_max, self.max_points))
+            line.axes.draw_artist(line)
+
+        self.fig.canvas.blit(self.fig.bbox)
+        self.fig.canvas.flush_events()
@@ -0,0 +1,156 @@
+"""
+Watchdog of the control loop
+
+If a query to the logger or to the load cell hangs, or the process dies, the
+last voltage sent to the lamps stays on the sample. The LoopWatchdog runs in
+its own process with its own connection to the logger. The control loop only
+writes the time of every tick into shared memory (one store, no lock), and
+when no tick arrives within the deadline the watchdog sends 0 V to the lamps
+(@304). The duration of every stall (time between the last tick before it and
+the first one after it) is recorded.
+"""
+
+import time
+import multiprocessing
+from transport import VisaTransport, SocketTransport
+
+# values of the heartbeat that are not times
+DISARMED = 0.0
+STOP = -1.0
+
+
+def open_transport(address, timeout_ms=1000):
+    """
+    Connection to the logger at the address of an existing transport (VISA
+    resource name or (host, port) of a socket)
+    """
+    if isinstance(address, (tuple, list)):
+        return SocketTransport(address[0], address[1], timeout_ms)
+    return VisaTransport(address, timeout_ms)
+
+
+def _turn_off_lamps(transport):
+    """
+    Returns True if the command was sent (the bus may be held by the hung query)
+    """
+    try:
+        transport.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+        return True
+    except Exception:
+        return False
+
+
+def _watch(heartbeat, stall_count, stalls, deadline, address, timeout_ms):
+    """
+    Loop of the watchdog process
+    """
+    transport = open_transport(address, timeout_ms)
+    parent = multiprocessing.parent_process()
+    poll_period = deadline / 10
+    stall_start = None
+    lamps_off = False
+
+    while True:
+        last_beat = heartbeat.value
+        if last_beat == STOP:
+            break
+
+        if last_beat != DISARMED and time.monotonic() - last_beat > deadline:
+            if stall_start is None:
+                stall_start = last_beat
+                lamps_off = False
+                stall_count.value += 1
+            # retried until the command goes through
+            if not lamps_off:
+                lamps_off = _turn_off_lamps(transport)
+
+        elif stall_start is not None:
+            # the loop is ticking again
+            duration = last_beat - stall_start if last_beat != DISARMED else \
+                time.monotonic() - stall_start
+            stalls.put({"start": time.time() - (time.monotonic() - stall_start),
+                "duration": duration})
+            stall_start = None
+
+        # the process of the test died (its last voltage is on the lamps)
+        if not parent.is_alive():
+            if last_beat != DISARMED and not lamps_off:
+                _turn_off_lamps(transport)
+            break
+
+        time.sleep(poll_period)
+
+    transport.close()
+
+
+class LoopWatchdog():
+    """
+    Turns the lamps off when the control loop misses its deadline
+    """
+
+    def __init__(self, address, deadline=1.0, timeout_ms=1000):
+        """
+        Parameters:
+        ----------
+        address: str or tuple
+            address of the logger (.address of the transport of the test)
+
+        deadline: float
+            maximum time in seconds between two ticks of the loop
+
+        timeout_ms: int
+            time out of the connection of the watchdog in milliseconds
+        """
+        self.deadline = deadline
+        self._heartbeat = multiprocessing.RawValue("d", DISARMED)
+        self._stall_count = multiprocessing.RawValue("i", 0)
+        self._stalls = multiprocessing.Queue()
+        self.recorded_stalls = []
+        self.process = multiprocessing.Process(target=_watch, args=(self._heartbeat,
+            self._stall_count, self._stalls, deadline, address, timeout_ms), daemon=True)
+
+    def start(self):
+        self.process.start()
+        return self
+
+    def beat(self):
+        """
+        Called once per tick of the loop. Only stores the time in shared memory,
+        so it does not wait for the watchdog
+        """
+        self._heartbeat.value = time.monotonic()
+
+    def disarm(self):
+        """
+        Stops watching the loop (e.g. while the lamps are off)
+        """
+        self._heartbeat.value = DISARMED
+
+    @property
+    def stall_count(self):
+        """
+        Number of stalls detected so far (read from the loop to mark them)
+        """
+        return self._stall_count.value
+
+    def stalls(self):
+        """
+        Stalls finished so far, as dicts with the "start" (time.time()) and the
+        "duration" in seconds
+        """
+        while not self._stalls.empty():
+            self.recorded_stalls.append(self._stalls.get())
+        return self.recorded_stalls
+
+    def stop(self):
+        """
+        Stops the process of the watchdog
+
+        Returns:
+        -------
+        stalls: list
+            see stalls()
+        """
+        self._heartbeat.value = STOP
+        self.process.join(timeout=10 * self.deadline)
+        return self.stalls()
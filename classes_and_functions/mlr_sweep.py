@@ -0,0 +1,303 @@
+"""
+Parameter sweep of the MLR controller of the N2 tests over recorded mass traces
+
+Every combination of averaging window, dead band (epsilon), activation
+threshold and PID gains is run in closed loop through the MLR pipeline of
+nitrogen_experiments/main_constant_nhf.py (differencing of the mass, moving
+average, dead band and PID, see replay.N2ControlStack) on each recorded test.
+
+The recorded mass keeps all the noise, glitches and pyrolysis of the test.
+Only the change of the voltage is modelled: the MLR responds to the
+difference between the new and the recorded lamp voltage through a first
+order plus dead time model identified on the same test, so
+
+    mass[k] = recorded_mass[k] - surface_area * sum(delta_mlr * dt)
+
+and the recorded parameters reproduce the recorded test exactly. The ramp is
+the recorded one, continued with the calibration of the test when the PID is
+activated later than during the test.
+
+The combinations are spread over a pool of processes, and the tracking error
+(MLR averaged over a fixed centred window) and the activity of the lamps are
+reported per combination.
+
+Use:
+python mlr_sweep.py <csv file or folder> [...] --averaging_window 10 30 60
+    --epsilon 0 0.1 0.2 --activation_threshold 0.9 0.95 --kp 0.1 0.2
+to save the results to mlr_sweep.csv.
+"""
+
+import os
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+from replay import N2ControlStack, load_recorded_test, fit_calibration
+from setpoints import SetpointSchedule
+from system_identification import fit_fopdt, resample
+from run_metadata import find_recorded_tests
+
+SURFACE_AREA = 0.1*0.1            # m2
+REFERENCE_WINDOW = 30             # readings of the centred average of the MLR
+DEFAULT_MODEL = {"gain": 4, "time_constant": 20, "dead_time": 3}
+IRRADIATION_RATE = 0.25           # kWm-2s-1, ramp before the PID
+
+# parameters of the sweep and their values in the N2 script
+PARAMETERS = {"averaging_window": 30, "epsilon": 0.2, "activation_threshold": 0.95,
+    "kp": 0.2, "ki": 0.04, "kd": 0.2}
+
+
+def centred_average(values, window=REFERENCE_WINDOW):
+    """
+    Moving average centred on every reading (no lag, for the evaluation only)
+    """
+    return pd.Series(values).rolling(window, center=True, min_periods=1).mean().values
+
+
+def load_trace(csv_path):
+    """
+    Recorded mass trace of a N2 test with the identified response of its MLR
+
+    Returns:
+    -------
+    trace: dict
+        "name", "time", "mass", "voltage" (sent at every reading), "ramp_start"
+        and "activation" (index of the first reading of the ramp and of the
+        PID), "setpoint" (constant, or "profile" from the activation of the
+        PID), "model" (FOPDT of the MLR in g/m2s per V) and "coeff_hftovolts"
+        (calibration of the lamps). None if the test is not a N2 test with a PID
+    """
+    data, metadata, atmosphere = load_recorded_test(csv_path)
+    profile = metadata.get("setpoint_profile")
+    if atmosphere != "N2" or (profile is not None and profile["variable"] == "IHF"):
+        return None
+
+    t = data["time_seconds"].astype(float).values
+    mass = data["mass_g"].astype(float).values
+    voltage = data["IHF_volts"].astype(float).values
+    ihf = data["IHF_kwm-2"].astype(float).values
+    pid_state = data["PID_state"].astype(str).values
+    started = np.nonzero(data["Observations"].fillna("").astype(str).str.contains(
+        "start_test").values)[0]
+
+    # the ramp starts after the pretest and the auto-tuning
+    autotune = np.nonzero(pid_state == "autotune")[0]
+    if len(autotune):
+        ramp_start = autotune[-1] + 1
+    else:
+        ramp_start = started[0] if len(started) else np.argmax(voltage > 0)
+    active = np.nonzero(pid_state == "active")[0]
+
+    # response of the MLR to the lamps from the ramp onwards
+    dt = np.median(np.diff(t))
+    mlr = - np.diff(mass, prepend=mass[0]) / np.diff(t, prepend=t[0] - dt) / SURFACE_AREA
+    time_base, u = resample(t[ramp_start:], voltage[ramp_start:], dt)
+    _, y = resample(t[ramp_start:], centred_average(mlr)[ramp_start:], dt)
+    model = fit_fopdt(u, y, dt, max_dead_time=10)
+    if not (model["gain"] > 0 and np.isfinite(model["time_constant"])):
+        print(f"{os.path.basename(csv_path)}: no response identified, default model used")
+        model = DEFAULT_MODEL
+
+    return {"name": os.path.basename(csv_path),
+        "time": t,
+        "mass": mass,
+        "voltage": voltage,
+        "ramp_start": ramp_start,
+        "activation": active[0] if len(active) else len(t),
+        "coeff_hftovolts": fit_calibration(voltage, ihf)[0],
+        "setpoint": metadata.get("setpoint", np.nan),
+        "profile": profile,
+        "model": model}
+
+
+def run_trace(trace, parameters, max_lamp_voltage=4.5, min_lamp_voltage=0.25):
+    """
+    Closed loop run of the MLR pipeline on a recorded trace
+
+    Parameters:
+    ----------
+    trace: dict
+        see load_trace
+
+    parameters: dict
+        values of PARAMETERS
+
+    Returns:
+    -------
+    mass, voltage: np.array
+        simulated mass and lamp voltage sent at every reading
+
+    activation: int
+        reading at which the PID was activated (None if never)
+    """
+    t, recorded_mass, recorded_voltage = trace["time"], trace["mass"], trace["voltage"]
+    dt = np.median(np.diff(t))
+    model = trace["model"]
+    decay = np.exp(-dt / model["time_constant"])
+    lag = int(round(model["dead_time"] / dt))
+
+    stack = N2ControlStack(dt, (parameters["kp"], parameters["ki"], parameters["kd"]),
+        SURFACE_AREA, int(parameters["averaging_window"]), parameters["epsilon"],
+        max_lamp_voltage=max_lamp_voltage, min_lamp_voltage=min_lamp_voltage,
+        capacity=len(t))
+    schedule = None if trace["profile"] is None else SetpointSchedule(trace["profile"], dt)
+    setpoint = trace["setpoint"] if schedule is None else schedule.setpoint(0)
+
+    mass = recorded_mass.copy()
+    voltage = recorded_voltage.copy()
+    delta_mlr = 0.0
+    mass_offset = 0.0
+    activation = None
+
+    for k in range(len(t)):
+        # response of the MLR to the change of the voltage sent before
+        if k > 0:
+            delta_voltage = voltage[k-1-lag] - recorded_voltage[k-1-lag] if k-1-lag >= 0 else 0
+            delta_mlr = decay * delta_mlr + (1 - decay) * model["gain"] * delta_voltage
+            mass_offset -= SURFACE_AREA * delta_mlr * (t[k] - t[k-1])
+        mass[k] = recorded_mass[k] + mass_offset
+
+        if schedule is not None and activation is not None:
+            setpoint = schedule.setpoint(t[k] - t[activation])
+        output, _ = stack.tick(t[k], mass[k], voltage[k-1] if k else 0.0, setpoint)
+
+        if activation is not None:
+            voltage[k] = output
+            continue
+
+        # the ramp continues after the activation of the test
+        if k > trace["activation"]:
+            voltage[k] = min(np.polyval(trace["coeff_hftovolts"], IRRADIATION_RATE * (
+                t[k] - t[trace["ramp_start"]])), max_lamp_voltage)
+        if k >= trace["ramp_start"] and (
+            stack.mlr_moving_average > parameters["activation_threshold"] * setpoint):
+            activation = k
+            stack.activate(t[k], voltage[k], setpoint)
+
+    return mass, voltage, activation
+
+
+def evaluate(trace, parameters, max_lamp_voltage=4.5, min_lamp_voltage=0.25):
+    """
+    Tracking error and activity of the lamps of one combination on one trace
+
+    Returns:
+    -------
+    metrics: dict
+        "tracking_rmse" and "tracking_bias" (g/m2s, MLR averaged over
+        REFERENCE_WINDOW readings minus the setpoint after the activation),
+        "activation_time" (s from the start of the ramp), "voltage_activity"
+        (V/s, total variation of the voltage) and "saturation" (fraction of the
+        time at the limits of the lamps)
+    """
+    mass, voltage, activation = run_trace(trace, parameters, max_lamp_voltage,
+        min_lamp_voltage)
+    t = trace["time"]
+    metrics = {"trace": trace["name"], **parameters}
+    if activation is None or activation >= len(t) - 2:
+        return {**metrics, "tracking_rmse": np.nan, "tracking_bias": np.nan,
+            "activation_time": np.nan, "voltage_activity": np.nan, "saturation": np.nan}
+
+    dt = np.diff(t, prepend=t[0] - np.median(np.diff(t)))
+    mlr = centred_average(- np.diff(mass, prepend=mass[0]) / dt / SURFACE_AREA)
+    setpoint = trace["setpoint"]
+    if trace["profile"] is not None:
+        schedule = SetpointSchedule(trace["profile"], np.median(dt))
+        setpoint = np.array([schedule.setpoint(time) for time in t - t[activation]])
+    error = (mlr - setpoint)[activation:]
+
+    duration = t[-1] - t[activation]
+    after = voltage[activation:]
+    return {**metrics,
+        "tracking_rmse": np.sqrt(np.mean(error**2)),
+        "tracking_bias": np.mean(error),
+        "activation_time": t[activation] - t[trace["ramp_start"]],
+        "voltage_activity": np.sum(np.abs(np.diff(after))) / duration,
+        "saturation": np.mean((after >= max_lamp_voltage) | (after <= min_lamp_voltage))}
+
+
+# traces of the worker processes (sent once to every worker)
+_traces = None
+
+
+def _init_worker(traces):
+    global _traces
+    _traces = traces
+
+
+def _evaluate_task(task):
+    trace_index, parameters = task
+    return evaluate(_traces[trace_index], parameters)
+
+
+def sweep(traces, grid, processes=None):
+    """
+    Evaluates every combination of the grid on every trace
+
+    Parameters:
+    ----------
+    traces: list
+        see load_trace
+
+    grid: dict
+        values of each parameter (the values of the N2 script for the missing ones)
+
+    processes: int
+        size of the pool (number of cpus by default)
+
+    Returns:
+    -------
+    results: pd.DataFrame
+        metrics of every trace and combination
+
+    summary: pd.DataFrame
+        metrics of every combination averaged over the traces, best tracking first
+    """
+    values = [grid.get(name, [default]) for name, default in PARAMETERS.items()]
+    combinations = [dict(zip(PARAMETERS, combination))
+        for combination in itertools.product(*values)]
+    tasks = [(trace_index, parameters) for parameters in combinations
+        for trace_index in range(len(traces))]
+
+    with Pool(processes, initializer=_init_worker, initargs=(traces,)) as pool:
+        results = pd.DataFrame(pool.map(_evaluate_task, tasks,
+            chunksize=max(1, len(tasks) // (4 * (processes or os.cpu_count())))))
+
+    summary = results.groupby(list(PARAMETERS)).agg(
+        tracking_rmse=("tracking_rmse", "mean"),
+        tracking_bias=("tracking_bias", "mean"),
+        activation_time=("activation_time", "mean"),
+        voltage_activity=("voltage_activity", "mean"),
+        saturation=("saturation", "mean"),
+        traces_activated=("tracking_rmse", "count")).reset_index()
+    return results, summary.sort_values("tracking_rmse").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Parameter sweep of the MLR controller "
+        "over recorded N2 tests")
+    parser.add_argument("paths", nargs="+", help="csv files or folders")
+    for name, default in PARAMETERS.items():
+        parser.add_argument(f"--{name}", nargs="+", type=float, default=[default])
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--output", default="mlr_sweep.csv")
+    arguments = parser.parse_args()
+
+    csv_paths = []
+    for path in arguments.paths:
+        csv_paths += find_recorded_tests(path, "N2_")
+
+    traces = [trace for trace in map(load_trace, csv_paths) if trace is not None]
+    for trace in traces:
+        model = trace["model"]
+        print(f"{trace['name']}: gain {model['gain']:.2f} gm-2s-1/V, time constant "
+            f"{model['time_constant']:.1f} s, dead time {model['dead_time']:.1f} s")
+
+    grid = {name: getattr(arguments, name) for name in PARAMETERS}
+    results, summary = sweep(traces, grid, arguments.processes)
+    results.to_csv(arguments.output, index=False)
+    summary.to_csv(f"{arguments.output.split('.csv')[0]}_summary.csv", index=False)
+    print(f"\n{len(summary)} combinations on {len(traces)} tests\n")
+    print(summary.head(10).to_string(index=False))
@@ -4,31 +4,47 @@ loggers and the load cells. Not sure this is the best way to implement the
 simultaneous plotting, but it does separate the two algorithms so that if there
 is a problem with the plotting, the logging is not afected.
 
+Only the rows appended to the csv file since the last update are read, and the
+lines are redrawn with blitting so the cost of each update does not grow with
+the duration of the test.
+
 """
 
 # import libraries
 import msvcrt
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
 import os
 import time
 import sys
+from live_plotting import CSVTail, TelemetryTail, BlitFigure
+from telemetry import TelemetryClient, DEFAULT_PORT
 
 #####
 # DETERMINE WHERE THE DATA FOR THE MOST RECENT EXPERIMENT IS
 #####
 
-# find the most recently created folder
+# the running experiment publishes its samples and its folder on this port
+# (python plotting.py <port> to follow a test published on another port)
+telemetry_port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
 path = "C:\\Users\\Firelab\\Desktop\\Simon\\FeedbackControl_TemperatureExperiments\\air_experiments"
-all_folders = [f for f in os.listdir(path) if os.path.isdir(os.path.join(path, f))]
 
-folder_creation_time = 0
-for folder in all_folders:
-	ts = os.path.getmtime(os.path.join(path, folder))
-	if ts > folder_creation_time:
-		latest_folder = folder
-		folder_creation_time = ts
+try:
+	telemetry_client = TelemetryClient(port = telemetry_port, backlog = 36000)
+	latest_folder = telemetry_client.metadata["folder"]
+	print(f"Following {telemetry_client.metadata['test']} through telemetry")
+
+# if the experiment is not publishing, find the most recently created folder
+except OSError:
+	telemetry_client = None
+	all_folders = [f for f in os.listdir(path) if os.path.isdir(os.path.join(path, f))]
+
+	folder_creation_time = 0
+	for folder in all_folders:
+		ts = os.path.getmtime(os.path.join(path, folder))
+		if ts > folder_creation_time:
+			latest_folder = folder
+			folder_creation_time = ts
 
 #####
 # CREATE AND FORMAT FIGURES
@@ -39,6 +55,8 @@ fontsize_labels = 16
 fontsize_legend = 14
 linewidth_grid = 1
 figure_size = (18,8)
+time_window = 1200    # s, use None to autoscale the time axis to the whole test
+update_period = 1     # s
 
 
 # create figures 
@@ -55,14 +73,14 @@ for a,ax in enumerate(axes0):
 	ax.set_ylim([[-5,70],[-2.5, 35]][a])
 	ax.set_yticks([np.linspace(0,70,8), np.linspace(0,35,8)][a])
 	ax.set_xlim([0,1200])
-	ax.set_xticks(np.linspace(0,1200,13))
+	ax.xaxis.set_major_locator(plt.MultipleLocator(100))
 ax1.set_ylabel("PID terms [-]", fontsize = fontsize_labels)
 ax1.set_xlabel("Time [s]", fontsize = fontsize_labels)
 ax1.yaxis.grid(True, linewidth = linewidth_grid, linestyle = "--", color = "gainsboro")
 ax1.set_ylim([-0.5,5.5])
 ax1.set_yticks(np.linspace(0,5,11))
 ax1.set_xlim([0,1200])
-ax1.set_xticks(np.linspace(0,1200,13))
+ax1.xaxis.set_major_locator(plt.MultipleLocator(100))
 
 # add lines and legend for plots in figure 0
 ihf_line, = axes0[0].plot([],[], color = "maroon", alpha = 0.75, linewidth = 2)
@@ -83,69 +101,63 @@ for i in range(3):
 ax1.legend(fancybox = True, loc = "upper right", fontsize = fontsize_legend)
 
 
+# lines are redrawn on top of a cached background
+blit_figures = [BlitFigure(fig0, [ihf_line, nhf_line, nhf_surface_line, nhf_mean_line],
+	window = time_window),
+	BlitFigure(fig1, list_PIDterms_plots, window = time_window)]
+plt.show(block = False)
+plt.pause(0.1)
+
+
 #####
-# KEEP UPLOADING, READING AND PLOTTING THE DATA WHILE THE EXPERIMENT CONTINUES
+# KEEP READING THE NEW ROWS AND PLOTTING THEM WHILE THE EXPERIMENT CONTINUES
 #####
 
+plotted_columns = ["time_seconds", "IHF_kwm-2", "NHF_kwm-2",
+	"NHF_surfacelosses_kwm-2", "NHF_mean_kWm-2", "PID_proportional",
+	"PID_integral", "PID_derivative"]
+
 latest_folder_path = os.path.join(path, latest_folder)
-bool_filecreation = False
-# main file takes some time to create the pickle
-while not bool_filecreation:
-	try:
-		for file in os.listdir(latest_folder_path):
-			if ".pkl" in file:
-				pickle_file = file
-
-		pickle_file_path = os.path.join(latest_folder_path, pickle_file)
-		print(f"Latest file is: {pickle_file.split('.')[0]}")
-		bool_filecreation = True
-	except:
-		print("Pickle file not created yet")
-		time.sleep(10)
-
-# do an infinite loop where it reads the data and plots it to both figures
+if telemetry_client is not None:
+	data_file = TelemetryTail(telemetry_client, plotted_columns)
+
+else:
+	bool_filecreation = False
+	# main file takes some time to create the csv file
+	while not bool_filecreation:
+		try:
+			for file in os.listdir(latest_folder_path):
+				if file.endswith(".csv") and not file.endswith("_aligned.csv"):
+					csv_file = file
+
+			csv_file_path = os.path.join(latest_folder_path, csv_file)
+			print(f"Latest file is: {csv_file.split('.')[0]}")
+			bool_filecreation = True
+		except:
+			print("Data file not created yet")
+			time.sleep(10)
+
+	data_file = CSVTail(csv_file_path, plotted_columns)
+
+# do an infinite loop where it reads the new rows and plots them to both figures
 while True:
 
 	try:
-		with open(pickle_file_path, "rb") as handle:
-			all_data = pickle.load(handle)
-			
-			# extract the data
-			time_array = all_data["time"]
-			ihf = all_data["IHF"]
-			nhf_fit = all_data["nhf_fit"]
-			nhf_surface = all_data["nhf_surface"]
-			nhf_mean = all_data["nhf_mean"]
-
-			time_step = all_data["time_step"]
-			PID_prop = all_data["PID_proportional"]
-			PID_integral = all_data["PID_integral"]
-			PID_dev = all_data["PID_derivative"]
-
-			# modify plots in figure 0
-			ihf_line.set_data([time_array[:time_step]],
-				[ihf[:time_step]])
-			nhf_line.set_data(time_array[:time_step],
-				nhf[:time_step])
-			nhf_surface_line.set_data(time_array[:time_step],
-				nhf_surface[:time_step])
-			nhf_mean_line.set_data(time_array[:time_step],
-				nhf_mean[:time_step])
-
-			# modify plots in figure 1
-			for l, line in enumerate(list_PIDterms_plots):
-				line.set_data(time_array[:time_step],
-					[PID_prop, PID_integral, PID_dev][l][:time_step])
-
-			# pause the figure
-			plt.pause(1)
-
+		new_rows = data_file.read_new()
+		if len(new_rows):
+			time_array = new_rows[:, 0]
+			blit_figures[0].append(time_array, new_rows[:, 1:5].T)
+			blit_figures[1].append(time_array, new_rows[:, 5:8].T)
 
+		for blit_figure in blit_figures:
+			blit_figure.redraw()
 
 	except Exception as e:
-		# print(f"\nError when loading pickle or plotting data\n")
+		# print(f"\nError when reading the data or plotting\n")
 		# print(e)
-		time.sleep(1)
+		pass
+
+	time.sleep(update_period)
 
 
 	if msvcrt.kbhit():
@@ -156,4 +168,3 @@ while True:
 	    		figure.savefig(f'{folder_path}/{["IHF_MLR.pdf","PID_terms.pdf"][f]}')
 	    	print("Exiting plotting script")
 	    	sys.exit(0)
-plt.show()
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Reanalysis of the derived columns of recorded air tests
+
+The surface temperature and NHF written during a test depend on constants of
+the air script (conductivity, h_total and the depth of the thermocouples).
+The quadratic fit of every row is a linear function of the four readings, so
+for each set of depths it is one (3, 4) matrix, and the derived columns of a
+whole test for all the parameter combinations are computed at once from the
+(N, 4) array of readings.
+
+Use:
+python reanalysis.py <csv file or folder> [...] --conductivity 0.17 0.19 0.21 --h_total 20 28
+to save the results of every combination to <name>_reanalysis.npz (and to
+<name>_reanalysis.csv if there is a single combination).
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from run_metadata import find_recorded_tests
+
+DEPTHS = (0.004, 0.008, 0.012, 0.016)
+
+
+def parameter_grid(conductivity=(0.19,), h_total=(28,), depths=(DEPTHS,)):
+    """
+    All the combinations of the given values
+
+    Returns:
+    -------
+    conductivity, h_total: np.array
+        (P,) value of each combination
+
+    depths: np.array
+        (P, 4) depths of the thermocouples of each combination in m
+    """
+    depths = np.asarray(depths, dtype=float).reshape(-1, len(DEPTHS))
+    k, h, d = np.meshgrid(np.asarray(conductivity, dtype=float),
+        np.asarray(h_total, dtype=float), np.arange(len(depths)), indexing="ij")
+    return k.ravel(), h.ravel(), depths[d.ravel()]
+
+
+def reanalyse(temperatures, IHF, conductivity, h_total, depths):
+    """
+    Recomputes the derived columns as in main_constant_nhf.py for P parameter
+    combinations
+
+    Parameters:
+    ----------
+    temperatures: np.array
+        (N, 4) readings T4, T8, T12 and T16 in K
+
+    IHF: np.array
+        (N,) IHF in kW/m2
+
+    conductivity, h_total: np.array
+        (P,) W/mK and W/m2K
+
+    depths: np.array
+        (P, 4) depths of the thermocouples in m
+
+    Returns:
+    -------
+    results: dict
+        (P, N) arrays "TSurface_K", "NHF_kwm-2", "NHF_surfacelosses_kwm-2" and
+        "NHF_mean_kWm-2"
+    """
+    temperatures = np.asarray(temperatures, dtype=float)
+    conductivity = np.atleast_1d(np.asarray(conductivity, dtype=float))
+    h_total = np.atleast_1d(np.asarray(h_total, dtype=float))
+    depths = np.asarray(depths, dtype=float).reshape(-1, temperatures.shape[1])
+
+    # least squares quadratic fit (as np.polyfit): coefficients = pinv(V) @ T,
+    # computed once per set of depths
+    unique_depths, depths_index = np.unique(depths, axis=0, return_inverse=True)
+    vandermonde = unique_depths[:, :, None] ** np.array([2, 1, 0])
+    fit = np.linalg.pinv(vandermonde)[:, 1:]
+    slope, surface = np.einsum("dcj,nj->cdn", fit, temperatures)
+    depths_index = depths_index.ravel()
+
+    surface_temperature = surface[depths_index]
+    surface_losses = h_total[:, None] * (surface_temperature -
+        temperatures.mean(axis=1)) / 1000
+    nhf = -conductivity[:, None] * slope[depths_index] / 1000
+    nhf_surfacelosses = np.asarray(IHF, dtype=float) - surface_losses
+
+    return {"TSurface_K": surface_temperature,
+        "NHF_kwm-2": nhf,
+        "NHF_surfacelosses_kwm-2": nhf_surfacelosses,
+        "NHF_mean_kWm-2": (nhf + nhf_surfacelosses) / 2}
+
+
+def load_test(csv_path):
+    """
+    Numeric rows of a recorded air test
+
+    Returns:
+    -------
+    data: pd.DataFrame
+        rows of the csv file with a numeric time
+    """
+    data = pd.read_csv(csv_path)
+    return data[pd.to_numeric(data["time_seconds"], errors="coerce").notna()].copy()
+
+
+def reanalyse_test(csv_path, conductivity, h_total, depths):
+    """
+    Reanalyses a recorded test for all the given combinations and saves the
+    results next to the csv file
+
+    Returns:
+    -------
+    reanalysis_path: str
+        path of the .npz file
+    """
+    data = load_test(csv_path)
+    temperatures = data[["T4_K", "T8_K", "T12_K", "T16_K"]].astype(float).values
+    results = reanalyse(temperatures, data["IHF_kwm-2"].astype(float).values,
+        conductivity, h_total, depths)
+
+    name = csv_path.split(".csv")[0]
+    np.savez(f"{name}_reanalysis.npz", time_seconds=data["time_seconds"].astype(float).values,
+        conductivity=conductivity, h_total=h_total, depths=depths, **results)
+
+    # a single combination is also saved as the original file with new columns
+    if len(conductivity) == 1:
+        for column, values in results.items():
+            data[column] = values[0]
+        data.to_csv(f"{name}_reanalysis.csv", index=False)
+
+    return f"{name}_reanalysis.npz"
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Reanalysis of recorded air tests")
+    parser.add_argument("paths", nargs="+", help="csv files or folders")
+    parser.add_argument("--conductivity", nargs="+", type=float, default=[0.19])
+    parser.add_argument("--h_total", nargs="+", type=float, default=[28])
+    parser.add_argument("--depths", nargs=4, type=float, action="append",
+        help="depths of T4, T8, T12 and T16 in m (can be repeated)")
+    arguments = parser.parse_args()
+
+    conductivity, h_total, depths = parameter_grid(arguments.conductivity,
+        arguments.h_total, arguments.depths or [DEPTHS])
+
+    for path in arguments.paths:
+        for csv_path in find_recorded_tests(path, "air_"):
+            print(f"Reanalysis saved to {reanalyse_test(csv_path, conductivity, h_total, depths)}")
@@ -0,0 +1,195 @@
+"""
+Relay auto-tuning of the PID (Astrom and Hagglund)
+
+The lamp voltage is switched between bias + amplitude and bias - amplitude
+every time the measurement crosses the setpoint (with a small hysteresis).
+The loop then oscillates at its ultimate period Pu with an amplitude a, and
+the ultimate gain is
+
+    Ku = 4 amplitude / (pi sqrt(a**2 - hysteresis**2))
+
+The PID gains follow from Ku and Pu with one of the tuning rules below. The
+gains that worked for a material are cached, so later tests with the same
+material start with them.
+"""
+
+import os
+import json
+import numpy as np
+
+GAINS_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pid_gains.json")
+
+# kp/Ku, Ti/Pu and Td/Pu of each rule (ki = kp/Ti and kd = kp*Td)
+TUNING_RULES = {"ziegler_nichols": (0.6, 0.5, 0.125),
+    "some_overshoot": (0.33, 0.5, 0.33),
+    "no_overshoot": (0.2, 0.5, 0.33)}
+
+
+class RelayAutoTuner():
+    """
+    Drives the lamps with a relay until the oscillation is characterised
+    """
+
+    def __init__(self, setpoint, bias_voltage, amplitude, hysteresis, cycles=3,
+        max_duration=600, rule="some_overshoot", max_lamp_voltage=4.5,
+        min_lamp_voltage=0.25, max_half_period=None):
+        """
+        Parameters:
+        ----------
+        setpoint: float
+            value around which the measurement oscillates (nhf or mlr)
+
+        bias_voltage: float
+            lamp voltage at the centre of the relay
+
+        amplitude: float
+            half of the change of the lamp voltage at each switch in volts
+
+        hysteresis: float
+            the measurement has to cross the setpoint by this value to switch
+            (same units as the setpoint), so that the noise does not switch it
+
+        cycles: int
+            number of periods measured after the first one, which is discarded
+
+        max_duration: float
+            the tuning fails if the oscillation is not characterised after
+            this time in seconds
+
+        rule: str
+            key of TUNING_RULES
+
+        max_half_period: float
+            the tuning fails if the output is not switched for this time in
+            seconds (e.g. a sample that does not respond to the high output).
+            None for no limit
+        """
+        self.setpoint = setpoint
+        self.high = min(bias_voltage + amplitude, max_lamp_voltage)
+        self.low = max(bias_voltage - amplitude, min_lamp_voltage)
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.max_duration = max_duration
+        self.max_half_period = max_half_period
+        self.rule = rule
+
+        self.output = self.high
+        self.start_time = None
+        self.last_switch_time = None
+        self.switch_times = []
+        self.amplitudes = []
+        self.cycle_max = -np.inf
+        self.cycle_min = np.inf
+        self.done = False
+        self.failed = False
+
+    def update(self, t, measurement):
+        """
+        Called every tick while tuning
+
+        Parameters:
+        ----------
+        t: float
+            time in seconds
+
+        measurement: float
+            current nhf or mlr
+
+        Returns:
+        -------
+        output: float
+            lamp voltage for the next period
+        """
+        if self.start_time is None:
+            self.start_time = t
+            self.last_switch_time = t
+
+        self.cycle_max = max(self.cycle_max, measurement)
+        self.cycle_min = min(self.cycle_min, measurement)
+
+        error = self.setpoint - measurement
+        if self.output == self.low and error > self.hysteresis:
+            # a period ends at every switch to the high output
+            self.output = self.high
+            self.last_switch_time = t
+            self.switch_times.append(t)
+            if len(self.switch_times) > 1:
+                self.amplitudes.append((self.cycle_max - self.cycle_min) / 2)
+            self.cycle_max = -np.inf
+            self.cycle_min = np.inf
+        elif self.output == self.high and error < -self.hysteresis:
+            self.output = self.low
+            self.last_switch_time = t
+
+        if len(self.amplitudes) > self.cycles:
+            self.done = True
+        elif (t - self.start_time > self.max_duration) or (self.max_half_period is not None
+            and t - self.last_switch_time > self.max_half_period):
+            self.done = True
+            self.failed = True
+            self.output = self.low
+
+        return self.output
+
+    def result(self):
+        """
+        Ultimate gain and period and the PID gains (None if the tuning failed)
+
+        Returns:
+        -------
+        result: dict
+            "ultimate_gain", "ultimate_period", "oscillation_amplitude",
+            "bias_voltage", "rule", "kp", "ki" and "kd"
+        """
+        if self.failed or len(self.amplitudes) <= self.cycles:
+            return None
+
+        # the first period (from the start of the relay) is discarded
+        ultimate_period = np.mean(np.diff(self.switch_times[1:]))
+        oscillation_amplitude = np.mean(self.amplitudes[1:])
+        relay_amplitude = (self.high - self.low) / 2
+        ultimate_gain = 4 * relay_amplitude / (np.pi * np.sqrt(max(
+            oscillation_amplitude**2 - self.hysteresis**2, 1e-12)))
+
+        kp_ratio, ti_ratio, td_ratio = TUNING_RULES[self.rule]
+        kp = kp_ratio * ultimate_gain
+        return {"ultimate_gain": float(ultimate_gain),
+            "ultimate_period": float(ultimate_period),
+            "oscillation_amplitude": float(oscillation_amplitude),
+            "bias_voltage": float((self.high + self.low) / 2),
+            "rule": self.rule,
+            "kp": float(kp),
+            "ki": float(kp / (ti_ratio * ultimate_period)),
+            "kd": float(kp * td_ratio * ultimate_period)}
+
+
+def load_cached_gains(experiment, material, path=GAINS_CACHE_FILE):
+    """
+    Returns the cached {"kp", "ki", "kd", ...} of a material (None if not cached)
+
+    Parameters:
+    ----------
+    experiment: str
+        "air" or "N2" (the gains of each loop are different)
+
+    material: str
+        material of the sample, as entered at the start of the test
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as handle:
+        cache = json.load(handle)
+    return cache.get(experiment, {}).get(material)
+
+
+def save_cached_gains(experiment, material, gains, path=GAINS_CACHE_FILE):
+    """
+    Saves the gains of a material for the following tests
+    """
+    cache = {}
+    if os.path.exists(path):
+        with open(path, "r") as handle:
+            cache = json.load(handle)
+    cache.setdefault(experiment, {})[material] = gains
+    with open(path, "w") as handle:
+        json.dump(cache, handle, indent="\t")
@@ -0,0 +1,430 @@
+"""
+Replay of recorded tests through the current estimators and controller
+
+The sensor streams of a recorded air or N2 test (thermocouples or mass) are fed
+tick by tick, with their recorded times, to the same estimators and PID as the
+test scripts, and the lamp voltage that the current code would have sent is
+saved next to the voltage that was actually sent. The PID is activated at the
+tick where it was activated during the test, with the recorded IHF applied
+before it (open loop: the sample responded to the recorded lamps), so the
+difference between both voltages shows the effect of a change of the code or
+of its settings. The time of every tick is measured, so the replay is also a
+benchmark of the cost of the control stack.
+
+Use:
+python replay.py <csv file or folder> [...] --estimator kalman --kp 0.05
+to save <name>_replay.csv next to every test and print the difference of the
+lamp voltage and the cost per tick.
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from PID import PID_IHF as PID
+from run_metadata import read_run_metadata, find_recorded_tests
+from state_estimator import ConductionKalmanFilter
+from inverse_heat_conduction import SequentialFunctionSpecification
+from dead_time_compensation import SmithPredictor
+from feedforward import NHFFeedforward
+from setpoints import SetpointRateLimiter, SetpointSchedule
+
+DEPTHS = (0.004, 0.008, 0.012, 0.016)
+
+
+def load_recorded_test(csv_path):
+    """
+    Numeric rows of a recorded test and its metadata
+
+    Returns:
+    -------
+    data: pd.DataFrame
+        rows of the csv file with a numeric time
+
+    metadata: dict
+        see run_metadata.py (empty for the tests recorded before it)
+
+    atmosphere: str
+        "air" or "N2"
+    """
+    data = pd.read_csv(csv_path)
+    data = data[pd.to_numeric(data["time_seconds"], errors="coerce").notna()].reset_index(
+        drop=True)
+    atmosphere = "N2" if "mass_g" in data.columns else "air"
+    return data, read_run_metadata(csv_path), atmosphere
+
+
+def fit_calibration(volts, ihf):
+    """
+    Cubic calibrations of the lamps (kW/m2 to volts and volts to kW/m2) from
+    the voltage and IHF recorded during the test
+    """
+    on = volts > 0
+    return np.polyfit(ihf[on], volts[on], 3), np.polyfit(volts[on], ihf[on], 3)
+
+
+class AirControlStack():
+    """
+    Estimators and PID of air_experiments/main_constant_nhf.py
+    """
+
+    def __init__(self, dt, gains, control_variable="NHF", estimator="quadratic",
+        feedforward=False, smith_predictor=False, smith_model=None, conductivity=0.19,
+        diffusivity=1.1e-7, h_total=28, sfs_future_time=15, h_convective=10,
+        emissivity=0.9, Ts_max_rate=0.5, max_lamp_voltage=4.5, min_lamp_voltage=0.25):
+        """
+        Parameters:
+        ----------
+        dt: float
+            logging period of the test in seconds
+
+        gains: tuple
+            kp, ki and kd of the PID
+
+        control_variable, estimator, feedforward, smith_predictor, ...:
+            settings of the test script (see run_test)
+        """
+        self.kp, self.ki, self.kd = gains
+        self.control_variable = control_variable
+        self.estimator = estimator
+        self.feedforward = feedforward
+        self.smith_predictor = smith_predictor
+        self.conductivity = conductivity
+        self.h_total = h_total
+        self.h_convective = h_convective
+        self.emissivity = emissivity
+        self.max_lamp_voltage = max_lamp_voltage
+        self.min_lamp_voltage = min_lamp_voltage
+        smith_model = smith_model or {"gain": 10, "time_constant": 30, "dead_time": 5}
+
+        self.kalman_filter = ConductionKalmanFilter(dt, conductivity, diffusivity,
+            h_total=h_total)
+        self.inverse_solver = SequentialFunctionSpecification(dt, conductivity, diffusivity,
+            future_time=sfs_future_time)
+        self.smith = SmithPredictor(smith_model["gain"], smith_model["time_constant"],
+            smith_model["dead_time"], dt)
+        self.limiter = SetpointRateLimiter(Ts_max_rate)
+        self.feedforward_model = None
+        self.active = False
+
+    def estimate(self, temperatures, ihf_applied, volts_applied):
+        """
+        Surface temperature and input of the PID from the thermocouples
+        """
+        coefficients = np.polyfit(DEPTHS, temperatures, 2)
+        surface_temperature = coefficients[2]
+        surface_losses = self.h_total * (surface_temperature - np.mean(temperatures)) / 1000
+        nhf_fit = - (self.conductivity * coefficients[1]) / 1000
+        input_nhf = (nhf_fit + ihf_applied - surface_losses) / 2
+
+        kalman_temperature, nhf_kf, _, _ = self.kalman_filter.update(temperatures, ihf_applied)
+        nhf_sfs, sfs_temperature = self.inverse_solver.update(temperatures)
+        if self.estimator == "kalman":
+            input_nhf, surface_temperature = nhf_kf, kalman_temperature
+        elif self.estimator == "sfs":
+            input_nhf, surface_temperature = nhf_sfs, sfs_temperature
+        if self.smith_predictor:
+            input_nhf = self.smith.update(input_nhf, volts_applied)
+        return surface_temperature, input_nhf
+
+    def activate(self, t, voltage, setpoint, coeff_hftovolts, T_ambient):
+        """
+        Starts the PID after the tick of its activation, from the voltage sent
+        at that tick (the PID runs from the next tick)
+        """
+        self.active = True
+        self.previous_time = t
+        self.last_input = self.pid_input
+        self.last_error = setpoint - self.pid_input
+        self.limiter.reset(self.surface_temperature, t)
+        self.integral_term = 0 if self.feedforward else voltage
+        self.feedforward_model = NHFFeedforward(coeff_hftovolts, T_ambient,
+            self.h_convective, self.emissivity, max_lamp_voltage=self.max_lamp_voltage,
+            min_lamp_voltage=self.min_lamp_voltage)
+
+    def tick(self, t, temperatures, ihf_applied, volts_applied, setpoint):
+        """
+        One tick of the loop
+
+        Returns:
+        -------
+        voltage: float
+            lamp voltage of the PID (nan while it is not active)
+
+        pid_input: float
+        """
+        surface_temperature, input_nhf = self.estimate(temperatures, ihf_applied,
+            volts_applied)
+        pid_input = surface_temperature if self.control_variable == "surface_temperature" \
+            else input_nhf
+        self.surface_temperature, self.pid_input = surface_temperature, pid_input
+        if not self.active:
+            return np.nan, pid_input
+
+        feedforward_voltage = 0
+        max_trim, min_trim = self.max_lamp_voltage, self.min_lamp_voltage
+        if self.feedforward:
+            feedforward_voltage = self.feedforward_model.voltage(setpoint, surface_temperature)
+            max_trim, min_trim = self.feedforward_model.trim_limits(feedforward_voltage)
+        if self.control_variable == "surface_temperature":
+            setpoint = self.limiter.update(setpoint, t,
+                hold=volts_applied >= self.max_lamp_voltage)
+
+        output, self.previous_time, self.last_error, _, self.integral_term, _ = PID(
+            pid_input, setpoint, self.previous_time, self.last_error, self.last_input,
+            self.integral_term, self.kp, self.ki, self.kd, max_trim, min_trim, now=t)
+        self.last_input = pid_input
+        return feedforward_voltage + output, pid_input
+
+
+class N2ControlStack():
+    """
+    Moving average of the MLR and PID of nitrogen_experiments/main_constant_nhf.py
+    """
+
+    def __init__(self, dt, gains, surface_area=0.1*0.1, averaging_window=30, epsilon=0.2,
+        smith_predictor=False, smith_model=None, max_lamp_voltage=4.5,
+        min_lamp_voltage=0.25, capacity=36000):
+        self.kp, self.ki, self.kd = gains
+        self.surface_area = surface_area
+        self.averaging_window = averaging_window
+        self.epsilon = epsilon
+        self.smith_predictor = smith_predictor
+        self.max_lamp_voltage = max_lamp_voltage
+        self.min_lamp_voltage = min_lamp_voltage
+        smith_model = smith_model or {"gain": 4, "time_constant": 20, "dead_time": 3}
+        self.smith = SmithPredictor(smith_model["gain"], smith_model["time_constant"],
+            smith_model["dead_time"], dt)
+        self.times = np.zeros(capacity)
+        self.mass = np.zeros(capacity)
+        self.mlr = np.zeros(capacity)
+        self.time_step = 0
+        self.active = False
+
+    def activate(self, t, voltage, setpoint):
+        """
+        Starts the PID after the tick of its activation (see AirControlStack.activate)
+        """
+        self.active = True
+        self.previous_time = t
+        self.last_input = self.mlr_feedback
+        self.last_error = setpoint - self.mlr_moving_average
+        self.integral_term = voltage
+
+    def tick(self, t, mass, volts_applied, setpoint):
+        """
+        One tick of the loop (see AirControlStack.tick)
+        """
+        k = self.time_step
+        self.times[k], self.mass[k] = t, mass
+        if k > 0:
+            self.mlr[k] = - np.round((self.mass[k] - self.mass[k-1]) /
+                (self.times[k] - self.times[k-1]) / self.surface_area, 1)
+        self.time_step += 1
+        mlr_moving_average = self.mlr[max(k - self.averaging_window, 0):k].mean() if k else 0.0
+
+        mlr_feedback = mlr_moving_average
+        if self.smith_predictor:
+            mlr_feedback = self.smith.update(mlr_moving_average, volts_applied)
+        self.mlr_moving_average, self.mlr_feedback = mlr_moving_average, mlr_feedback
+        if not self.active:
+            return np.nan, mlr_feedback
+
+        input_mlr = mlr_feedback
+        if np.abs(mlr_feedback - setpoint) < self.epsilon * setpoint:
+            input_mlr = setpoint
+
+        output, self.previous_time, self.last_error, _, self.integral_term, _ = PID(
+            input_mlr, setpoint, self.previous_time, self.last_error, self.last_input,
+            self.integral_term, self.kp, self.ki, self.kd, self.max_lamp_voltage,
+            self.min_lamp_voltage, now=t)
+        self.last_input = mlr_feedback
+        return output, mlr_feedback
+
+
+def replay_test(csv_path, gains=None, **settings):
+    """
+    Replays a recorded test
+
+    Parameters:
+    ----------
+    csv_path: str
+        csv file of the test
+
+    gains: tuple
+        kp, ki and kd. A gain that is None (all of them if gains is None) is
+        the gain of the metadata (or of the script)
+
+    settings:
+        keyword arguments of AirControlStack or N2ControlStack (the settings
+        of the test recorded in the metadata are used by default)
+
+    Returns:
+    -------
+    replay: pd.DataFrame
+        time, PID state, recorded and replayed voltage, replayed input of the
+        PID, setpoint and compute time of every tick
+
+    tick_times: np.array
+        compute time of every tick in seconds
+    """
+    data, metadata, atmosphere = load_recorded_test(csv_path)
+    t = data["time_seconds"].astype(float).values
+    volts = data["IHF_volts"].astype(float).values
+    ihf = data["IHF_kwm-2"].astype(float).values
+    pid_state = data["PID_state"].astype(str).values
+    dt = metadata.get("time_logging_period", 0.1)
+
+    default_gains = {"kp": 0.04, "ki": 0.008, "kd": 0.04} if atmosphere == "air" else \
+        {"kp": 0.2, "ki": 0.04, "kd": 0.2}
+    recorded_gains = metadata.get("PID_gains", default_gains)
+    if gains is None:
+        gains = (None, None, None)
+    gains = tuple(recorded_gains[key] if gain is None else gain
+        for key, gain in zip(["kp", "ki", "kd"], gains))
+
+    # the air rows have the voltage applied before their reading, the N2 rows
+    # the voltage sent after it
+    if atmosphere == "air":
+        volts_applied, ihf_applied = volts, ihf
+        volts_sent = np.append(volts[1:], np.nan)
+    else:
+        volts_sent = volts
+        volts_applied = np.append(0.0, volts[:-1])
+        ihf_applied = np.append(0.0, ihf[:-1])
+
+    if atmosphere == "air":
+        control_variable = metadata.get("control_variable", "NHF")
+        settings.setdefault("control_variable", control_variable)
+        settings.setdefault("feedforward", metadata.get("feedforward", False))
+        stack = AirControlStack(dt, gains, **settings)
+        temperatures = data[["T4_K", "T8_K", "T12_K", "T16_K"]].astype(float).values
+        coeff_hftovolts, _ = fit_calibration(volts, ihf)
+    else:
+        stack = N2ControlStack(dt, gains, capacity=len(t), **settings)
+        mass = data["mass_g"].astype(float).values
+
+    # constant setpoint or profile from the activation of the PID
+    setpoint = metadata.get("setpoint", np.nan)
+    profile = metadata.get("setpoint_profile")
+    schedule = None
+    if profile is not None and profile["variable"] != "IHF":
+        schedule = SetpointSchedule(profile, dt)
+
+    active = np.nonzero(pid_state == "active")[0]
+    activation = active[0] if len(active) else len(t)
+    voltage_replayed = np.full(len(t), np.nan)
+    pid_input = np.full(len(t), np.nan)
+    setpoints = np.full(len(t), np.nan)
+    tick_times = np.zeros(len(t))
+
+    for k in range(len(t)):
+        if schedule is not None and k >= activation:
+            setpoint = schedule.setpoint(t[k] - t[activation])
+        setpoints[k] = setpoint
+
+        tick_start = time.perf_counter()
+        if atmosphere == "air":
+            voltage_replayed[k], pid_input[k] = stack.tick(t[k], temperatures[k],
+                ihf_applied[k], volts_applied[k], setpoint)
+        else:
+            voltage_replayed[k], pid_input[k] = stack.tick(t[k], mass[k],
+                volts_applied[k], setpoint)
+
+        # the voltage of the ramp is sent at the tick of the activation
+        if k == activation:
+            if atmosphere == "air":
+                stack.activate(t[k], volts_sent[k], setpoint, coeff_hftovolts,
+                    temperatures[0].mean())
+            else:
+                stack.activate(t[k], volts_sent[k], setpoint)
+        tick_times[k] = time.perf_counter() - tick_start
+
+    replay = pd.DataFrame({"time_seconds": t,
+        "PID_state": pid_state,
+        "voltage_recorded": volts_sent,
+        "voltage_replayed": voltage_replayed,
+        "PID_input_replayed": pid_input,
+        "setpoint": setpoints,
+        "tick_compute_us": 1e6 * tick_times})
+    return replay, tick_times
+
+
+def compare_voltages(replay):
+    """
+    Difference between the replayed and the recorded voltage while the PID is active
+
+    Returns:
+    -------
+    rms, max_abs: float
+        V (nan if the PID was never active)
+    """
+    difference = (replay["voltage_replayed"] - replay["voltage_recorded"]).dropna().values
+    if not len(difference):
+        return np.nan, np.nan
+    return np.sqrt(np.mean(difference**2)), np.max(np.abs(difference))
+
+
+def benchmark(tick_times, dt=0.1):
+    """
+    Cost of the control stack per tick
+
+    Returns:
+    -------
+    summary: dict
+        mean, median, 99th percentile and maximum in microseconds, ticks per
+        second and speed up over real time
+    """
+    return {"mean_us": 1e6 * tick_times.mean(),
+        "median_us": 1e6 * np.median(tick_times),
+        "p99_us": 1e6 * np.percentile(tick_times, 99),
+        "max_us": 1e6 * tick_times.max(),
+        "ticks_per_second": 1 / tick_times.mean(),
+        "speed_up": dt / tick_times.mean()}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay of recorded tests through the "
+        "current control code")
+    parser.add_argument("paths", nargs="+", help="csv files or folders")
+    parser.add_argument("--kp", type=float)
+    parser.add_argument("--ki", type=float)
+    parser.add_argument("--kd", type=float)
+    parser.add_argument("--estimator", choices=["quadratic", "kalman", "sfs"],
+        help="input of the PID of the air tests (quadratic by default)")
+    parser.add_argument("--feedforward", action="store_true", default=None)
+    parser.add_argument("--smith_predictor", action="store_true", default=None)
+    arguments = parser.parse_args()
+
+    csv_paths = []
+    for path in arguments.paths:
+        csv_paths += find_recorded_tests(path)
+
+    all_tick_times = []
+    print(f"{'test':<40} {'RMS [V]':>8} {'max [V]':>8} {'mean [us]':>10} {'p99 [us]':>10}")
+    for csv_path in csv_paths:
+        data, metadata, atmosphere = load_recorded_test(csv_path)
+        # the gains that are not given are those of the test
+        gains = (arguments.kp, arguments.ki, arguments.kd)
+        settings = {key: value for key, value in [("estimator", arguments.estimator),
+            ("feedforward", arguments.feedforward),
+            ("smith_predictor", arguments.smith_predictor)] if value is not None}
+        if atmosphere == "N2":
+            settings.pop("estimator", None)
+            settings.pop("feedforward", None)
+
+        replay, tick_times = replay_test(csv_path, gains, **settings)
+        replay.to_csv(f"{csv_path.split('.csv')[0]}_replay.csv", index=False)
+        rms, max_abs = compare_voltages(replay)
+        summary = benchmark(tick_times)
+        all_tick_times.append(tick_times)
+        print(f"{os.path.basename(csv_path)[:40]:<40} {rms:>8.3f} {max_abs:>8.3f} "
+            f"{summary['mean_us']:>10.1f} {summary['p99_us']:>10.1f}")
+
+    if all_tick_times:
+        summary = benchmark(np.concatenate(all_tick_times))
+        print(f"\n{sum(len(tick_times) for tick_times in all_tick_times)} ticks: "
+            f"{summary['ticks_per_second']:.0f} ticks/s, {summary['speed_up']:.0f} times "
+            "faster than real time")
@@ -0,0 +1,263 @@
+"""
+Crash-safe journal of a running test
+
+The state of the controller and of the recorder (PID terms, time step, byte
+offset of the csv file, ...) is appended to <name>_journal.jsonl next to the
+csv file at a fixed rate, after the rows it refers to have been flushed, and
+each record is forced to the disk. If the process dies, the last complete
+record is enough to resume the test: the csv file is cut back to the offset of
+that record, the arrays are refilled from the rows already recorded and the
+controller continues from its journaled state. The last record of a finished
+test is {"type": "finished"}, and of a test stopped by an error
+{"type": "aborted"}, so neither is resumed.
+
+A test is only resumed if the operator confirms it and the script was started
+again soon enough after the last record (see confirm_resume): once the
+watchdog has turned the lamps off the sample cools down, and after a gap much
+longer than its thermal time constant it is no longer the same test.
+"""
+
+import os
+import csv
+import json
+import time
+import numpy as np
+from run_metadata import to_builtin
+
+# s, longest gap between the last record and the restart of the script for a
+# test to be resumed. Of the order of the thermal time constant of the heated
+# layer of the sample, d^2/alpha with d = 4 mm (first thermocouple) and
+# alpha = 1.1e-7 m2/s (PMMA), i.e. about 150 s. A test can set its own value
+# with "max_resume_gap"
+MAX_RESUME_GAP = 150.0
+
+
+def journal_path(full_name_of_file):
+    """
+    Path of the journal of a test
+    """
+    return f"{full_name_of_file.split('.csv')[0]}_journal.jsonl"
+
+
+class RunJournal():
+    """
+    Appends the state of a test to its journal at a fixed rate
+    """
+
+    def __init__(self, full_name_of_file, test=None, flush_rate=2):
+        """
+        Parameters:
+        ----------
+        full_name_of_file: str
+            csv file of the test
+
+        test: dict
+            definition of a new test (see run_test), None when a test is resumed
+
+        flush_rate: float
+            records per second
+        """
+        self.period = 1 / flush_rate
+        self.previous_record = -np.inf
+        self.handle = open(journal_path(full_name_of_file), "a")
+        if test is not None:
+            self._write({"type": "start", "test": test})
+
+    def _write(self, record):
+        self.handle.write(json.dumps(record, default=to_builtin) + "\n")
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def due(self, now):
+        """
+        True when a record is due (so that the state is only collected at the
+        rate of the journal)
+        """
+        return now - self.previous_record >= self.period
+
+    def record(self, state, now):
+        """
+        Parameters:
+        ----------
+        state: dict
+            state of the controller and of the recorder (numpy values are
+            converted, see run_metadata.to_builtin)
+
+        now: float
+            time.time() of the record
+        """
+        self._write({"type": "state", "time": now, **state})
+        self.previous_record = now
+
+    def mark_resume(self, gap, now):
+        """
+        Records that the test was resumed after gap seconds without logging
+        """
+        self._write({"type": "resume", "time": now, "gap": gap})
+
+    def finish(self):
+        """
+        Marks the test as finished and closes the journal
+        """
+        self._write({"type": "finished"})
+        self.handle.close()
+
+    def abort(self, reason="error"):
+        """
+        Marks a test that was stopped (it is not resumed) and closes the journal
+        """
+        self._write({"type": "aborted", "reason": reason})
+        self.handle.close()
+
+    def close(self):
+        self.handle.close()
+
+
+def read_journal(full_name_of_file):
+    """
+    Reads the journal of a test. A record cut by the crash is ignored.
+
+    Returns:
+    -------
+    test: dict
+        definition of the test (None if there is no journal)
+
+    state: dict
+        last complete state record (None if there is none)
+
+    finished: bool
+        True if the test was finished or aborted
+    """
+    test, state, finished = None, None, False
+    path = journal_path(full_name_of_file)
+    if not os.path.exists(path):
+        return test, state, finished
+
+    with open(path, "r") as handle:
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record["type"] == "start":
+                test = record["test"]
+            elif record["type"] == "state":
+                state = record
+            finished = record["type"] in ["finished", "aborted"]
+    return test, state, finished
+
+
+def is_unfinished(full_name_of_file):
+    """
+    True if the test has a journal with a state to resume from
+    """
+    test, state, finished = read_journal(full_name_of_file)
+    return test is not None and state is not None and not finished
+
+
+def confirm_resume(full_name_of_file, restart_time=None, max_gap=None):
+    """
+    Asks the operator whether an unfinished test is resumed. A test whose last
+    record is older than max_gap when the script was started again is not
+    resumed. A test that is not resumed is marked as aborted, so it is not
+    offered again.
+
+    Parameters:
+    ----------
+    full_name_of_file: str
+        csv file of an unfinished test (see is_unfinished)
+
+    restart_time: float
+        time.time() at which the script was started again (now if None). The
+        time the operator takes to answer is not part of the gap
+
+    max_gap: float
+        longest gap in seconds. If None, "max_resume_gap" of the test or
+        MAX_RESUME_GAP
+
+    Returns:
+    -------
+    resume: bool
+        True if the test is resumed
+    """
+    test, state, _ = read_journal(full_name_of_file)
+    if restart_time is None:
+        restart_time = time.time()
+    if max_gap is None:
+        max_gap = test.get("max_resume_gap", MAX_RESUME_GAP)
+
+    gap = restart_time - state["time"]
+    if gap > max_gap:
+        print(f"\n{full_name_of_file} was interrupted {gap:.0f} seconds before the "
+            f"restart (more than {max_gap:.0f} seconds), it is not resumed")
+        RunJournal(full_name_of_file).abort("resume_gap")
+        return False
+
+    answer = input(f"\nResume {full_name_of_file}, interrupted {gap:.0f} seconds "
+        "before the restart? [y/n] ")
+    if answer.strip().lower() != "y":
+        RunJournal(full_name_of_file).abort("not_resumed")
+        return False
+    return True
+
+
+def find_unfinished_test(folder="."):
+    """
+    Most recent test in the folders of the tests that was not finished
+
+    Returns:
+    -------
+    full_name_of_file: str
+        csv file of the test (None if all the tests are finished)
+
+    test: dict
+        definition of the test
+    """
+    candidates = []
+    for name_of_folder in os.listdir(folder):
+        full_name_of_file = os.path.join(folder, name_of_folder, f"{name_of_folder}.csv")
+        if os.path.exists(journal_path(full_name_of_file)) and is_unfinished(full_name_of_file):
+            candidates.append((os.path.getmtime(journal_path(full_name_of_file)),
+                full_name_of_file))
+    if not candidates:
+        return None, None
+
+    full_name_of_file = max(candidates)[1]
+    return full_name_of_file, read_journal(full_name_of_file)[0]
+
+
+def reopen_recorder(full_name_of_file, csv_offset):
+    """
+    Cuts the csv file back to the offset of the last journal record (the rows
+    written after it do not match the journaled state) and reads the rows
+    recorded until then
+
+    Parameters:
+    ----------
+    full_name_of_file: str
+        csv file of the test
+
+    csv_offset: int
+        size in bytes of the csv file at the last journal record
+
+    Returns:
+    -------
+    recorded: dict
+        column name: array of the numeric rows (nan where a value is not numeric)
+    """
+    with open(full_name_of_file, "r+b") as handle:
+        handle.truncate(csv_offset)
+
+    with open(full_name_of_file, "r", newline="") as handle:
+        reader = csv.reader(handle)
+        header = next(reader)
+        rows = [row for row in reader if row and row[0] != ""]
+
+    def numeric(value):
+        try:
+            return float(value)
+        except ValueError:
+            return np.nan
+
+    return {column: np.array([numeric(row[c]) for row in rows])
+        for c, column in enumerate(header)}
@@ -0,0 +1,89 @@
+"""
+Metadata of a test (parameters, gains, results of the auto-tuning, ...)
+
+The metadata is kept in <name>_metadata.json next to the csv file of the test
+and every call merges new fields into it, so each part of the test records
+its own information.
+"""
+
+import os
+import json
+import numpy as np
+from datetime import datetime
+
+
+def to_builtin(value):
+    """
+    json default for the values that are not builtins: numpy arrays and
+    scalars are converted, any other object is saved as its string
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def metadata_path(full_name_of_file):
+    """
+    Path of the metadata file of a test
+    """
+    return f"{full_name_of_file.split('.csv')[0]}_metadata.json"
+
+
+def find_recorded_tests(path, prefix=""):
+    """
+    csv files of the tests recorded in a folder and its subfolders
+
+    Each test is recorded in <name>/<name>.csv, so the files written next to
+    it (aligned channels, reanalyses, replays, sweeps, ...) are never taken as
+    tests. A path to a csv file is returned as it is.
+
+    Parameters:
+    ----------
+    path: str
+        folder or csv file
+
+    prefix: str
+        start of the names of the tests, e.g. "air_" or "N2_"
+
+    Returns:
+    -------
+    csv_paths: list
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(root, file) for root, _, files in os.walk(path)
+        for file in files if file == f"{os.path.basename(root)}.csv"
+        and file.startswith(prefix))
+
+
+def read_run_metadata(full_name_of_file):
+    """
+    Returns the metadata of a test (empty dict if none)
+    """
+    path = metadata_path(full_name_of_file)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as handle:
+        return json.load(handle)
+
+
+def update_run_metadata(full_name_of_file, fields):
+    """
+    Merges the fields into the metadata of a test
+
+    Parameters:
+    ----------
+    full_name_of_file: str
+        csv file of the test
+
+    fields: dict
+        values to be added or replaced (numpy values are converted, see
+        to_builtin)
+    """
+    metadata = read_run_metadata(full_name_of_file)
+    metadata.update(fields)
+    metadata["last_updated"] = datetime.now().isoformat(timespec="seconds")
+    with open(metadata_path(full_name_of_file), "w") as handle:
+        json.dump(metadata, handle, indent="\t", default=to_builtin)
@@ -0,0 +1,234 @@
+"""
+Setpoints of the PID that change during a test
+
+Setpoint profiles are named in setpoint_profiles.json, as a list of segments
+of one variable ("NHF", "MLR", "surface_temperature" or "IHF"):
+
+    {"type": "step", "value": 20, "duration": 300}
+    {"type": "ramp", "to": 30, "rate": 0.05}          (or "duration", and "from")
+    {"type": "hold", "duration": 120}                 (value at the end of the
+                                                       previous segment)
+    {"type": "table", "time": [...], "value": [...]}  (or "file", a csv of
+                                                       time and value columns)
+
+Each segment may have a "name" for the events logged in the data file, and
+the duration of the last one may be omitted (its end value is then held).
+Before the test the profile is compiled on a uniform grid of the logging
+period, so each tick looks up the setpoint with one index calculation.
+
+The setpoint sent to the PID can also be rate limited, so that a step of the
+target (e.g. of the surface temperature) does not drive the lamps into
+saturation, and it waits while the lamps are saturated so that the error
+does not wind up.
+"""
+
+import os
+import json
+import numpy as np
+
+PROFILES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "setpoint_profiles.json")
+
+
+class SetpointRateLimiter():
+    """
+    Follows a target setpoint with a maximum rate of change
+    """
+
+    def __init__(self, max_rate):
+        """
+        Parameters:
+        ----------
+        max_rate: float
+            maximum change of the setpoint per second (units of the setpoint)
+        """
+        self.max_rate = max_rate
+        self.setpoint = None
+        self.previous_time = None
+
+    def reset(self, setpoint, now):
+        """
+        Starts the setpoint from the current value of the measurement
+        """
+        self.setpoint = setpoint
+        self.previous_time = now
+
+    def update(self, target, now, hold=False):
+        """
+        Parameters:
+        ----------
+        target: float
+            setpoint requested (constant or programmed)
+
+        now: float
+            time in seconds
+
+        hold: bool
+            keeps the setpoint (e.g. while the lamps are saturated)
+
+        Returns:
+        -------
+        setpoint: float
+            rate limited setpoint
+        """
+        max_change = self.max_rate * (now - self.previous_time)
+        self.previous_time = now
+        if not hold:
+            self.setpoint += min(max(target - self.setpoint, -max_change), max_change)
+        return self.setpoint
+
+
+def load_setpoint_profile(name, path=PROFILES_FILE):
+    """
+    Reads a named setpoint profile from the configuration file
+
+    The csv files of the table segments are relative to the folder of the
+    configuration file.
+
+    Returns:
+    -------
+    profile: dict
+        "variable" and list of "segments"
+    """
+    with open(path, "r") as handle:
+        all_profiles = json.load(handle)
+
+    if name not in all_profiles:
+        raise KeyError(f"Setpoint profile '{name}' not in {path}. "
+            f"Available profiles: {list(all_profiles)}")
+
+    profile = all_profiles[name]
+    for segment in profile["segments"]:
+        if "file" in segment:
+            segment["file"] = os.path.join(os.path.dirname(os.path.abspath(path)),
+                segment["file"])
+    return profile
+
+
+def ramp_profile(rate, start=0.0, end=np.inf, variable="IHF"):
+    """
+    Profile of a single ramp (e.g. the IHF ramp before the PID is active)
+    """
+    segment = {"type": "ramp", "name": "ramp", "from": start, "rate": rate}
+    if np.isfinite(end):
+        segment["to"] = end
+    return {"variable": variable, "segments": [segment]}
+
+
+def _segment_trace(segment, start_value, default_duration):
+    """
+    Times (from the start of the segment) and values that define a segment
+    """
+    kind = segment["type"]
+    duration = segment.get("duration", default_duration)
+
+    if kind == "step":
+        return np.array([0, duration]), np.array([segment["value"]] * 2, dtype=float)
+
+    if kind == "hold":
+        return np.array([0, duration]), np.array([start_value] * 2, dtype=float)
+
+    if kind == "ramp":
+        start = segment.get("from", start_value)
+        if "to" not in segment:
+            # open ended ramp, until the end of the test
+            end = start + segment["rate"] * duration
+        else:
+            end = segment["to"]
+            if "rate" in segment:
+                duration = abs(end - start) / segment["rate"]
+        return np.array([0, duration]), np.array([start, end], dtype=float)
+
+    if kind == "table":
+        if "file" in segment:
+            table = np.loadtxt(segment["file"], delimiter=",", skiprows=1, usecols=(0, 1),
+                ndmin=2)
+            times, values = table[:, 0], table[:, 1]
+        else:
+            times = np.asarray(segment["time"], dtype=float)
+            values = np.asarray(segment["value"], dtype=float)
+        times = times - times[0]
+        if "duration" in segment:
+            times = np.append(times, duration)
+            values = np.append(values, values[-1])
+        return times, values
+
+    raise ValueError(f"Unknown type of setpoint segment '{kind}'")
+
+
+class SetpointSchedule():
+    """
+    Setpoint profile compiled on a uniform time grid
+    """
+
+    def __init__(self, profile, dt, max_duration=3600):
+        """
+        Parameters:
+        ----------
+        profile: dict
+            "variable" and "segments" (see load_setpoint_profile)
+
+        dt: float
+            time step of the grid in seconds (logging period)
+
+        max_duration: float
+            length of the test in seconds, for the segments without duration
+        """
+        self.variable = profile["variable"]
+        self.dt = dt
+        segments = profile["segments"]
+
+        times, values, starts = [], [], []
+        start_time, start_value = 0.0, segments[0].get("value",
+            segments[0].get("from", 0.0))
+        for number, segment in enumerate(segments):
+            segment_times, segment_values = _segment_trace(segment, start_value,
+                max_duration - start_time)
+            starts.append(start_time)
+            times.append(start_time + segment_times)
+            values.append(segment_values)
+            start_time += segment_times[-1]
+            start_value = segment_values[-1]
+
+        # steps between segments are kept by sampling each segment on its own
+        # part of the grid
+        number_of_entries = int(np.ceil(max(start_time, dt) / dt)) + 1
+        grid = dt * np.arange(number_of_entries)
+        self.starts = np.array(starts)
+        self.segment_index = np.clip(np.searchsorted(self.starts, grid, side="right") - 1,
+            0, len(segments) - 1)
+        self.table = np.empty(number_of_entries)
+        for number in range(len(segments)):
+            in_segment = self.segment_index == number
+            self.table[in_segment] = np.interp(grid[in_segment], times[number],
+                values[number])
+        self.names = [segment.get("name", f"{number}_{segment['type']}")
+            for number, segment in enumerate(segments)]
+        self.duration = start_time
+
+    def _position(self, t):
+        # the small offset keeps ticks on the grid in their own entry
+        return min(max(int(t / self.dt + 1e-9), 0), len(self.table) - 1)
+
+    def setpoint(self, t):
+        """
+        Setpoint at t seconds from the start of the profile (the last value
+        is held after its end)
+        """
+        return self.table[self._position(t)]
+
+    def segment(self, t):
+        """
+        Number of the segment at t seconds from the start of the profile
+        """
+        return self.segment_index[self._position(t)]
+
+    def event(self, previous_segment, t):
+        """
+        Returns the segment at t and the event to log when it differs from
+        previous_segment ("" otherwise)
+        """
+        segment = self.segment(t)
+        if segment == previous_segment:
+            return segment, ""
+        return segment, f"{self.variable}_segment_{self.names[segment]}"
@@ -0,0 +1,243 @@
+"""
+Offline simulator of the air experiments
+
+The lamps are a first order plus dead time response to the cubic calibration
+of the voltage, and the sample is the finite difference conduction model of
+state_estimator.py with convective and reradiation losses at the surface. The
+thermocouples are read with noise at the logging period, so the controllers
+of main_constant_nhf.py can be run faster than real time and compared.
+
+Use:
+python simulator.py
+to benchmark the settling time after the activation of the PID with and
+without the feedforward of the lamp voltage, with the gains of the script.
+"""
+
+import numpy as np
+from state_estimator import build_conduction_model, interpolation_matrix
+from state_estimator import ConductionKalmanFilter
+from feedforward import NHFFeedforward, STEFAN_BOLTZMANN
+from PID import PID_IHF as PID
+
+# calibration of a typical day (volts to kW/m2 and kW/m2 to volts)
+COEFF_VOLTSTOHF = np.array([-0.25, 3.5, 2.0, 0.0])
+_voltages = np.linspace(0, 4.5, 100)
+COEFF_HFTOVOLTS = np.polyfit(np.polyval(COEFF_VOLTSTOHF, _voltages), _voltages, 3)
+
+
+class AirTestSimulator():
+    """
+    Lamps and sample of an air test
+    """
+
+    def __init__(self, dt=0.1, coeff_voltstohf=COEFF_VOLTSTOHF, lamp_time_constant=0.5,
+        lamp_dead_time=0.2, conductivity=0.19, diffusivity=1.1e-7, thickness=0.025,
+        h_convective=10, emissivity=0.9, absorptivity=1.0, T_ambient=293,
+        thermocouple_depths=(0.004, 0.008, 0.012, 0.016), temperature_noise=0.2,
+        seed=0):
+        """
+        Parameters:
+        ----------
+        dt: float
+            logging period in seconds
+
+        coeff_voltstohf: np.array
+            steady state calibration of the lamps
+
+        lamp_time_constant, lamp_dead_time: float
+            response of the lamps in seconds (see lamps_mappingANDperformance.py)
+
+        h_convective, emissivity, absorptivity: float
+            surface of the sample
+
+        temperature_noise: float
+            standard deviation of the thermocouple readings in K
+        """
+        self.dt = dt
+        self.coeff_voltstohf = coeff_voltstohf
+        self.lamp_decay = np.exp(-dt / lamp_time_constant)
+        self.lamp_delay = np.zeros(max(1, int(round(lamp_dead_time / dt))))
+        self.delay_index = 0
+        self.A, self.B, node_depths = build_conduction_model(dt, conductivity,
+            diffusivity, thickness)
+        self.H = interpolation_matrix(thermocouple_depths, node_depths)
+        self.h_convective = h_convective
+        self.emissivity = emissivity
+        self.absorptivity = absorptivity
+        self.T_ambient = T_ambient
+        self.temperature_noise = temperature_noise
+        self.random = np.random.default_rng(seed)
+
+        self.temperatures = np.full(len(node_depths), float(T_ambient))
+        self.ihf = 0.0
+        self.nhf = 0.0
+
+    @property
+    def surface_temperature(self):
+        return self.temperatures[0]
+
+    def read_thermocouples(self):
+        """
+        Readings of the thermocouples in K
+        """
+        return self.H @ self.temperatures + self.random.normal(0,
+            self.temperature_noise, len(self.H))
+
+    def step(self, voltage):
+        """
+        Applies the lamp voltage during one logging period
+        """
+        delayed_voltage = self.lamp_delay[self.delay_index]
+        self.lamp_delay[self.delay_index] = voltage
+        self.delay_index = (self.delay_index + 1) % len(self.lamp_delay)
+        steady_ihf = max(np.polyval(self.coeff_voltstohf, delayed_voltage), 0)
+        self.ihf = self.lamp_decay * self.ihf + (1 - self.lamp_decay) * steady_ihf
+
+        Ts = self.surface_temperature
+        losses = self.h_convective * (Ts - self.T_ambient) + self.emissivity * \
+            STEFAN_BOLTZMANN * (Ts**4 - self.T_ambient**4)
+        self.nhf = self.absorptivity * 1000 * self.ihf - losses
+        self.temperatures = self.A @ self.temperatures + self.B * self.nhf
+
+
+def simulate_air_test(nhf_desired, feedforward=False, estimator="quadratic",
+    duration=900, simulator=None, kp=0.04, ki=0.008, kd=None, conductivity=0.19,
+    diffusivity=1.1e-7, h_total=28,
+    irradiation_rate=0.25, surface_temperature_activation=573,
+    max_lamp_voltage=4.5, min_lamp_voltage=0.25):
+    """
+    Runs the test loop of air_experiments/main_constant_nhf.py (ramp, PID
+    activation and quadratic fit of the nhf) on the simulator
+
+    Parameters:
+    ----------
+    nhf_desired: float
+        kW/m2
+
+    feedforward: bool
+        adds the feedforward voltage of NHFFeedforward to the PID trim
+
+    estimator: str
+        input of the PID, "quadratic" (mean of the quadratic fit and surface
+        losses) or "kalman" (see state_estimator.py)
+
+    duration: float
+        simulated time in seconds
+
+    kp, ki, kd: float
+        gains of the PID. kd is the one of main_constant_nhf.py by default
+        (0.04, or feedforward_kd = 0 with the feedforward)
+
+    Returns:
+    -------
+    results: dict
+        arrays "time", "nhf" (true NHF in kW/m2), "nhf_input" (input of the
+        PID), "voltage" and the "activation_time" of the PID in seconds
+    """
+    if kd is None:
+        kd = 0 if feedforward else 0.04
+    simulator = simulator or AirTestSimulator()
+    dt = simulator.dt
+    number_of_steps = int(duration / dt)
+    depths = [0.004, 0.008, 0.012, 0.016]
+    feedforward_model = NHFFeedforward(COEFF_HFTOVOLTS, simulator.T_ambient,
+        max_lamp_voltage=max_lamp_voltage, min_lamp_voltage=min_lamp_voltage)
+
+    kalman_filter = ConductionKalmanFilter(dt, conductivity, diffusivity, h_total=h_total)
+
+    results = {key: np.zeros(number_of_steps) for key in ["time", "nhf", "nhf_input", "voltage"]}
+    results["activation_time"] = None
+    PID_state = "not_active"
+    ihf_sent = 0.0
+
+    for time_step in range(number_of_steps):
+        t = time_step * dt
+        temperatures = simulator.read_thermocouples()
+
+        # quadratic fit of the nhf as in the experiment
+        coefficients = np.polyfit(depths, temperatures, 2)
+        surface_temperature = coefficients[2]
+        surface_losses = h_total * (surface_temperature - temperatures.mean()) / 1000
+        nhf_fit = - (conductivity * coefficients[1]) / 1000
+        nhf_input = (nhf_fit + ihf_sent - surface_losses) / 2
+        if estimator == "kalman":
+            surface_temperature, nhf_input, _, _ = kalman_filter.update(temperatures,
+                ihf_sent)
+
+        if PID_state == "not_active":
+            ihf_sent = t * irradiation_rate
+            voltage_output = min(np.polyval(COEFF_HFTOVOLTS, ihf_sent), max_lamp_voltage)
+            if surface_temperature > surface_temperature_activation and t > 100:
+                PID_state = "active"
+                results["activation_time"] = t
+                previous_pid_time = t
+                last_error = nhf_desired - nhf_input
+                last_input = nhf_input
+
+                # the PID starts from the ramp voltage, or only trims the feedforward
+                pid_integral_term = 0.0 if feedforward else voltage_output
+
+        elif PID_state == "active":
+            max_trim, min_trim = max_lamp_voltage, min_lamp_voltage
+            feedforward_voltage = 0.0
+            if feedforward:
+                feedforward_voltage = feedforward_model.voltage(nhf_desired,
+                    surface_temperature)
+                max_trim, min_trim = feedforward_model.trim_limits(feedforward_voltage)
+            trim, previous_pid_time, last_error, _, pid_integral_term, _ = PID(
+                nhf_input, nhf_desired, previous_pid_time, last_error, last_input,
+                pid_integral_term, kp, ki, kd, max_trim, min_trim, now=t + dt)
+            voltage_output = feedforward_voltage + trim
+            ihf_sent = np.polyval(COEFF_VOLTSTOHF, voltage_output)
+            last_input = nhf_input
+
+        simulator.step(voltage_output)
+        results["time"][time_step] = t
+        results["nhf"][time_step] = simulator.nhf / 1000
+        results["nhf_input"][time_step] = nhf_input
+        results["voltage"][time_step] = voltage_output
+
+    return results
+
+
+def settling_time(results, nhf_desired, tolerance=0.05, hold=60, window=1.0):
+    """
+    Time after the activation of the PID until the input of the PID (averaged
+    over window seconds) enters the band of tolerance*nhf_desired around the
+    setpoint and stays in it for the following hold seconds (None if never)
+    """
+    if results["activation_time"] is None:
+        return None
+    dt = results["time"][1] - results["time"][0]
+    after = results["time"] >= results["activation_time"]
+    samples = max(1, int(round(window / dt)))
+    nhf_average = np.convolve(results["nhf_input"][after], np.ones(samples) / samples,
+        mode="valid")
+    inside = np.abs(nhf_average - nhf_desired) <= tolerance * nhf_desired
+
+    # number of consecutive samples inside the band from each sample onwards
+    hold_samples = int(round(hold / dt))
+    run = np.zeros(len(inside) + 1, dtype=int)
+    for i in range(len(inside) - 1, -1, -1):
+        run[i] = run[i+1] + 1 if inside[i] else 0
+    settled = np.nonzero(run[:-1] >= hold_samples)[0]
+    if not len(settled):
+        return None
+    return settled[0] * dt + (samples - 1) * dt
+
+
+if __name__ == "__main__":
+
+    # the gains shipped in main_constant_nhf.py (kd = 0.04 for the PID alone and
+    # 0 with the feedforward) and the PID alone without derivative term
+    configurations = [("PID [s]", False, None), ("PID kd=0 [s]", False, 0),
+        ("PID + feedforward [s]", True, None)]
+    for estimator in ["quadratic", "kalman"]:
+        print(f"\nPID input: {estimator}")
+        print(f"{'NHF [kW/m2]':>12} " + " ".join(f"{name:>22}" for name, _, _ in configurations))
+        for nhf_desired in [10, 15, 20, 25]:
+            times = [settling_time(simulate_air_test(nhf_desired, feedforward, estimator,
+                duration=400, kd=kd), nhf_desired) for _, feedforward, kd in configurations]
+            print(f"{nhf_desired:>12} " + " ".join(f"{'-' if t is None else np.round(t, 1):>22}"
+                for t in times))
+    print("\n- : does not settle")
@@ -0,0 +1,226 @@
+"""
+Streaming estimator of the surface temperature and the net heat flux (NHF)
+
+The sample is discretised in depth (implicit finite differences, insulated
+back face) and the heat flux at the surface is the absorbed incident heat flux
+minus the surface losses plus an unknown disturbance:
+
+    q_surface = absorptivity*IHF - h_total*(T_surface - T_ambient) + d
+
+A Kalman filter fuses the four in-depth thermocouples with the known IHF and
+estimates the temperature profile and d (random walk). All matrices are built
+once, so each update has the same (small) cost for the whole test.
+"""
+
+import numpy as np
+
+
+def build_conduction_model(dt, conductivity, diffusivity, thickness=0.025, dx=0.002):
+    """
+    Implicit (backward Euler) finite difference model of the conduction in the
+    sample, with a heat flux imposed at the surface and an insulated back face
+
+        T[k+1] = A T[k] + B q_surface[k]
+
+    Parameters:
+    ----------
+    dt: float
+        time step in seconds
+
+    conductivity: float
+        W/mK
+
+    diffusivity: float
+        m2/s
+
+    thickness: float
+        thickness of the sample in m
+
+    dx: float
+        distance between nodes in m
+
+    Returns:
+    -------
+    A: np.array
+        (nodes, nodes) state matrix
+
+    B: np.array
+        (nodes,) response of the nodes to a surface heat flux of 1 W/m2
+
+    depths: np.array
+        depth of each node in m (node 0 is the surface)
+    """
+    number_of_nodes = int(round(thickness / dx)) + 1
+    depths = np.arange(number_of_nodes) * dx
+    fourier = diffusivity * dt / dx**2
+
+    # conduction between neighbouring nodes (half control volumes at the faces)
+    L = np.zeros((number_of_nodes, number_of_nodes))
+    for i in range(1, number_of_nodes - 1):
+        L[i, i-1:i+2] = [fourier, -2*fourier, fourier]
+    L[0, 0:2] = [-2*fourier, 2*fourier]
+    L[-1, -2:] = [2*fourier, -2*fourier]
+
+    # heat flux into the half control volume of the surface node
+    b = np.zeros(number_of_nodes)
+    b[0] = 2 * dt * diffusivity / (conductivity * dx)
+
+    M_inverse = np.linalg.inv(np.eye(number_of_nodes) - L)
+    return M_inverse, M_inverse @ b, depths
+
+
+def interpolation_matrix(depths, node_depths):
+    """
+    (len(depths), nodes) matrix that linearly interpolates the node
+    temperatures at the given depths
+    """
+    H = np.zeros((len(depths), len(node_depths)))
+    for row, depth in enumerate(depths):
+        i = min(np.searchsorted(node_depths, depth, side="right") - 1, len(node_depths) - 2)
+        weight = (depth - node_depths[i]) / (node_depths[i+1] - node_depths[i])
+        H[row, i] = 1 - weight
+        H[row, i+1] = weight
+    return H
+
+
+class ConductionKalmanFilter():
+    """
+    Kalman filter over the in-depth conduction model of the sample
+    """
+
+    def __init__(self, dt, conductivity, diffusivity,
+        thermocouple_depths=(0.004, 0.008, 0.012, 0.016), thickness=0.025,
+        dx=0.002, h_total=28, absorptivity=1.0, temperature_noise=0.2,
+        model_noise=0.05, disturbance_noise=0.2):
+        """
+        Parameters:
+        ----------
+        dt: float
+            time between updates in seconds (logging period)
+
+        conductivity: float
+            W/mK
+
+        diffusivity: float
+            m2/s
+
+        thermocouple_depths: tuple
+            depth of the thermocouples in m
+
+        thickness, dx: float
+            thickness of the sample and distance between nodes in m
+
+        h_total: float
+            total heat transfer coefficient of the surface losses in W/m2K
+
+        absorptivity: float
+            fraction of the IHF absorbed by the surface
+
+        temperature_noise: float
+            standard deviation of the thermocouple readings in K
+
+        model_noise: float
+            standard deviation of the error of the conduction model per step in K
+
+        disturbance_noise: float
+            standard deviation of the change of the disturbance per second in kW/m2
+        """
+        A, B, self.node_depths = build_conduction_model(dt, conductivity,
+            diffusivity, thickness, dx)
+        number_of_nodes = len(self.node_depths)
+        self.h_total = h_total / 1000            # kW/m2K
+        self.absorptivity = absorptivity
+
+        # surface heat flux in kW/m2
+        B = 1000 * B
+
+        # augmented state: node temperatures and disturbance d (kW/m2)
+        self.F = np.zeros((number_of_nodes + 1, number_of_nodes + 1))
+        self.F[:number_of_nodes, :number_of_nodes] = A
+        self.F[:number_of_nodes, 0] -= B * self.h_total
+        self.F[:number_of_nodes, -1] = B
+        self.F[-1, -1] = 1
+        self.B = np.append(B, 0)
+
+        self.H = np.zeros((len(thermocouple_depths), number_of_nodes + 1))
+        self.H[:, :number_of_nodes] = interpolation_matrix(thermocouple_depths,
+            self.node_depths)
+
+        self.Q = np.diag(np.append(np.full(number_of_nodes, model_noise**2),
+            disturbance_noise**2 * dt))
+        self.R = np.eye(len(thermocouple_depths)) * temperature_noise**2
+
+        # NHF = absorptivity*IHF + h_total*T_ambient + c @ x
+        self.c = np.zeros(number_of_nodes + 1)
+        self.c[0] = -self.h_total
+        self.c[-1] = 1
+
+        self.x = None
+        self.P = None
+        self.T_ambient = None
+
+    def initialise(self, temperatures, T_ambient=None):
+        """
+        Sets the initial temperature profile from the thermocouples
+
+        Parameters:
+        ----------
+        temperatures: np.array
+            readings of the thermocouples in K
+
+        T_ambient: float
+            temperature used for the surface losses. Mean of the readings by default
+        """
+        thermocouple_depths = self.H[:, :-1] @ self.node_depths
+        profile = np.interp(self.node_depths, thermocouple_depths, temperatures)
+        self.x = np.append(profile, 0)
+        self.P = np.diag(np.append(np.full(len(self.node_depths), 1.0), 1.0))
+        if T_ambient is None:
+            T_ambient = np.mean(temperatures)
+        self.T_ambient = T_ambient
+
+    def update(self, temperatures, IHF):
+        """
+        Predicts with the IHF applied during the last step and corrects with
+        the thermocouple readings
+
+        Parameters:
+        ----------
+        temperatures: np.array
+            readings of the thermocouples in K
+
+        IHF: float
+            incident heat flux during the last step in kW/m2
+
+        Returns:
+        -------
+        surface_temperature: float
+            estimated surface temperature in K
+
+        nhf: float
+            estimated net heat flux in kW/m2
+
+        surface_temperature_std, nhf_std: float
+            standard deviation of both estimates
+        """
+        if self.x is None:
+            self.initialise(temperatures)
+
+        # predict
+        surface_input = self.absorptivity * IHF + self.h_total * self.T_ambient
+        self.x = self.F @ self.x + self.B * surface_input
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+        # correct
+        innovation = np.asarray(temperatures) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = np.linalg.solve(S, self.H @ self.P).T
+        self.x = self.x + K @ innovation
+        self.P = self.P - K @ self.H @ self.P
+
+        surface_temperature = self.x[0]
+        nhf = self.absorptivity * IHF + self.h_total * self.T_ambient + self.c @ self.x
+        surface_temperature_std = np.sqrt(self.P[0, 0])
+        nhf_std = np.sqrt(self.c @ self.P @ self.c)
+
+        return surface_temperature, nhf, surface_temperature_std, nhf_std
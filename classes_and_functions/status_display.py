@@ -0,0 +1,102 @@
+"""
+Live status of the experiment in the command window
+
+The control loop only hands over a snapshot of its latest values (a dict) and
+a background thread redraws the status in place at a low rate. Writing to the
+Windows console blocks, so the control loop never prints directly.
+"""
+
+import os
+import sys
+import threading
+from collections import deque
+
+
+class ConsoleStatus():
+    """
+    Redraws the latest snapshot of the experiment in place, from its own thread
+    """
+
+    def __init__(self, rate_hz=2, stream=sys.stdout):
+        """
+        Parameters:
+        ----------
+        rate_hz: float
+            number of redraws per second
+
+        stream: file
+            where the status is written (command window by default)
+        """
+        self.period = 1 / rate_hz
+        self.stream = stream
+        self._snapshot = None
+        self._messages = deque(maxlen=100)
+        self._lines_drawn = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+        # enable ANSI escape sequences in the Windows console
+        if os.name == "nt":
+            os.system("")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Draws the last snapshot and stops the thread
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def update(self, snapshot):
+        """
+        Called from the control loop. Only replaces the reference to the
+        snapshot, so it never waits for the command window
+
+        Parameters:
+        ----------
+        snapshot: dict
+            {label: value} to be shown. Values are shown with two decimals
+        """
+        self._snapshot = snapshot
+
+    def log(self, message):
+        """
+        Queues a message (e.g. "PID ACTIVE") that is printed above the status
+        """
+        self._messages.append(message)
+
+    def _format(self, snapshot):
+        lines = []
+        for label, value in snapshot.items():
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            lines.append(f"{label:>20}: {value}")
+        return lines
+
+    def _draw(self):
+        output = []
+
+        # move the cursor to the start of the previous status and clear it
+        if self._lines_drawn:
+            output.append(f"\x1b[{self._lines_drawn}F\x1b[J")
+            self._lines_drawn = 0
+
+        while self._messages:
+            output.append(f"{self._messages.popleft()}\n")
+
+        snapshot = self._snapshot
+        if snapshot is not None:
+            lines = self._format(snapshot)
+            output.append("\n".join(lines) + "\n")
+            self._lines_drawn = len(lines)
+
+        self.stream.write("".join(output))
+        self.stream.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            self._draw()
+        self._draw()
@@ -0,0 +1,183 @@
+"""
+Identification of the response of the FPA lamps from step and PRBS tests
+
+The readings are resampled on a uniform time base and low order discrete
+models are fitted by least squares for every candidate dead time at once:
+
+    first order plus dead time (FOPDT):
+        y[k+1] = a y[k] + b u[k-d]
+    second order plus dead time:
+        y[k+1] = a1 y[k] + a2 y[k-1] + b u[k-d]
+
+where u and y are the deviations of the lamp voltage and of the measured heat
+flux from their values at the start of the test. The dead time with the
+lowest residual is kept and the discrete coefficients are converted to the
+gain, time constants and dead time used by the controllers and simulators.
+"""
+
+import numpy as np
+
+
+def prbs(order=7, seed=1):
+    """
+    Maximum length pseudo random binary sequence (2**order - 1 values of
+    -1 and 1) generated with a linear feedback shift register
+
+    Parameters:
+    ----------
+    order: int
+        number of bits of the register (5 to 9)
+
+    seed: int
+        initial (non zero) state of the register
+    """
+    taps = {5: (5, 3), 6: (6, 5), 7: (7, 6), 8: (8, 6, 5, 4), 9: (9, 5)}[order]
+    state = seed
+    sequence = np.empty(2**order - 1)
+    for i in range(len(sequence)):
+        bit = 0
+        for tap in taps:
+            bit ^= (state >> (tap - 1)) & 1
+        sequence[i] = 1 if state & 1 else -1
+        state = ((state << 1) | bit) & (2**order - 1)
+    return sequence
+
+
+def resample(t, values, dt):
+    """
+    Linear interpolation of irregularly sampled readings on a uniform time base
+    """
+    time_base = np.arange(t[0], t[-1], dt)
+    return time_base, np.interp(time_base, t, values)
+
+
+def _lagged(signal, lag, length):
+    """
+    signal[k - lag] for k = 0..length-1 (the first value is held before the start)
+    """
+    return np.concatenate([np.full(lag, signal[0]), signal])[:length]
+
+
+def _least_squares(regressors, target):
+    coefficients, _, _, _ = np.linalg.lstsq(regressors, target, rcond=None)
+    residual = target - regressors @ coefficients
+    return coefficients, np.sqrt(np.mean(residual**2))
+
+
+def fit_fopdt(u, y, dt, max_dead_time=5.0, baseline_samples=1):
+    """
+    Fits a first order plus dead time model
+
+    Parameters:
+    ----------
+    u: np.array
+        lamp voltage on a uniform time base
+
+    y: np.array
+        measured response (e.g. heat flux in kW/m2) on the same time base
+
+    dt: float
+        period of the time base in seconds
+
+    max_dead_time: float
+        largest dead time tried in seconds
+
+    baseline_samples: int
+        number of first samples, at equilibrium, averaged to give the origin
+        of u and y (1 uses the first sample)
+
+    Returns:
+    -------
+    model: dict
+        "gain" (units of y per volt), "time_constant" and "dead_time" in
+        seconds, and "rmse" of the one step prediction
+    """
+    u = u - u[:baseline_samples].mean()
+    y = y - y[:baseline_samples].mean()
+    best = None
+    for lag in range(int(max_dead_time / dt) + 1):
+        regressors = np.column_stack([y[:-1], _lagged(u, lag, len(u))[:-1]])
+        coefficients, rmse = _least_squares(regressors, y[1:])
+        if best is None or rmse < best[2]:
+            best = (lag, coefficients, rmse)
+
+    lag, (a, b), rmse = best
+    a = min(max(a, 1e-9), 1 - 1e-9)
+    return {"gain": b / (1 - a),
+        "time_constant": -dt / np.log(a),
+        "dead_time": lag * dt,
+        "rmse": rmse}
+
+
+def fit_second_order(u, y, dt, max_dead_time=5.0, baseline_samples=1):
+    """
+    Fits a second order plus dead time model (see fit_fopdt for the parameters)
+
+    Returns:
+    -------
+    model: dict
+        "gain", "dead_time", "rmse" and either "time_constants" (two real
+        poles) or "natural_frequency" (rad/s) and "damping" (complex poles)
+    """
+    u = u - u[:baseline_samples].mean()
+    y = y - y[:baseline_samples].mean()
+    best = None
+    for lag in range(int(max_dead_time / dt) + 1):
+        regressors = np.column_stack([y[1:-1], y[:-2], _lagged(u, lag, len(u))[1:-1]])
+        coefficients, rmse = _least_squares(regressors, y[2:])
+        if best is None or rmse < best[2]:
+            best = (lag, coefficients, rmse)
+
+    lag, (a1, a2, b), rmse = best
+    model = {"gain": b / (1 - a1 - a2), "dead_time": lag * dt, "rmse": rmse}
+
+    # continuous poles from the roots of z**2 - a1 z - a2
+    poles = np.log(np.roots([1, -a1, -a2]).astype(complex)) / dt
+    if np.all(np.abs(poles.imag) < 1e-9):
+        model["time_constants"] = sorted((-1 / poles.real).tolist())
+    else:
+        natural_frequency = np.abs(poles[0])
+        model["natural_frequency"] = natural_frequency
+        model["damping"] = -poles[0].real / natural_frequency
+    return model
+
+
+def simulate_fopdt(model, u, dt, y0=0.0):
+    """
+    Response of a FOPDT model to the lamp voltages u (deviations from the
+    first value) starting from y0
+    """
+    a = np.exp(-dt / model["time_constant"])
+    delayed_u = _lagged(u - u[0], int(round(model["dead_time"] / dt)), len(u))
+    y = np.empty(len(u))
+    y[0] = 0
+    for k in range(len(u) - 1):
+        y[k+1] = a * y[k] + (1 - a) * model["gain"] * delayed_u[k]
+    return y0 + y
+
+
+def interpolate_model(operating_points, voltage, model_type="fopdt"):
+    """
+    Linear interpolation of the identified models between operating points
+
+    Parameters:
+    ----------
+    operating_points: list
+        "operating_points" of the lamp models file (sorted by voltage)
+
+    voltage: float
+        lamp voltage
+
+    model_type: str
+        "fopdt" or "second_order"
+
+    Returns:
+    -------
+    model: dict
+        gain, time constant and dead time at the given voltage
+    """
+    voltages = [point["voltage"] for point in operating_points]
+    models = [point[model_type] for point in operating_points]
+    keys = [key for key, value in models[0].items() if np.isscalar(value)]
+    return {key: float(np.interp(voltage, voltages, [model[key] for model in models]))
+        for key in keys}
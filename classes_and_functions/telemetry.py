@@ -0,0 +1,308 @@
+"""
+Local telemetry server used to follow an experiment from several viewers
+
+The experiment publishes every sample to a TelemetryServer, which only appends
+it to a bounded queue per subscriber: the control loop never waits for a
+viewer. Each subscriber has its own sender thread that encodes the samples as
+binary frames and drops the oldest samples if the viewer cannot keep up.
+
+Frames (little endian):
+header: type (uint8), sequence (uint32), time (float64), length (uint32)
+    METADATA: utf-8 json with the channel names and information of the test
+    KEYFRAME: float64 value of every channel
+    DELTA: float32 difference of every channel with the previous frame
+A KEYFRAME is sent periodically, after any dropped sample and whenever a
+value or its delta is not finite, so the deltas are always applied to finite
+values the viewer already has.
+
+The port is 5555 unless the TELEMETRY_PORT environment variable is set.
+
+A new subscriber sends one json line, e.g. {"backlog": 600}, to receive the
+last samples of the test before the live ones.
+"""
+
+import os
+import json
+import socket
+import struct
+import threading
+from collections import deque
+import numpy as np
+
+METADATA = 0
+KEYFRAME = 1
+DELTA = 2
+
+HEADER = struct.Struct("<BIdI")
+
+DEFAULT_PORT = int(os.environ.get("TELEMETRY_PORT", 5555))
+
+
+def encode_frame(frame_type, sequence, t, payload):
+    """
+    Returns the bytes of a frame
+    """
+    return HEADER.pack(frame_type, sequence, t, len(payload)) + payload
+
+
+class _Subscriber():
+    """
+    Connection to one viewer, served by its own thread
+    """
+
+    def __init__(self, connection, queue_size, keyframe_interval):
+        self.connection = connection
+        self.queue = deque(maxlen=queue_size)
+        self.new_sample = threading.Event()
+        self.keyframe_interval = keyframe_interval
+        self.dropped_samples = 0
+        self.closed = False
+
+    def send_samples(self, samples):
+        """
+        Encodes the samples as keyframes/deltas and sends them
+        """
+        for sequence, t, values in samples:
+            delta = None
+            if (self.reference is not None) and (sequence == self.last_sequence + 1) and (
+                self.frames_since_keyframe < self.keyframe_interval):
+                delta = (values - self.reference).astype("<f4")
+                # a non-finite value (e.g. a failed reading) would stay in the
+                # values of the viewer until the next keyframe
+                if not np.isfinite(delta).all():
+                    delta = None
+
+            if delta is None:
+                if self.last_sequence is not None and sequence != self.last_sequence + 1:
+                    self.dropped_samples += sequence - self.last_sequence - 1
+                frame = encode_frame(KEYFRAME, sequence, t, values.astype("<f8").tobytes())
+                self.reference = values.copy()
+                self.frames_since_keyframe = 0
+            else:
+                frame = encode_frame(DELTA, sequence, t, delta.tobytes())
+                # follow the values reconstructed by the viewer so that the
+                # rounding of the deltas does not accumulate
+                self.reference += delta
+                self.frames_since_keyframe += 1
+
+            self.connection.sendall(frame)
+            self.last_sequence = sequence
+
+    def run(self, metadata, backlog):
+        self.reference = None
+        self.last_sequence = None
+        self.frames_since_keyframe = 0
+        try:
+            self.connection.sendall(encode_frame(METADATA, 0, 0.0,
+                json.dumps(metadata).encode("utf-8")))
+            self.send_samples(backlog)
+
+            while not self.closed:
+                self.new_sample.wait(1)
+                self.new_sample.clear()
+                while self.queue:
+                    self.send_samples([self.queue.popleft()])
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self.connection.close()
+
+
+class TelemetryServer():
+    """
+    Publishes the samples of an experiment to any number of local viewers
+    """
+
+    def __init__(self, channel_names, metadata=None, host="127.0.0.1", port=DEFAULT_PORT,
+        backlog_size=36000, queue_size=100, keyframe_interval=100):
+        """
+        Parameters:
+        ----------
+        channel_names: list
+            name of each value of the published samples
+
+        metadata: dict
+            information sent to every viewer when it connects (e.g. test name)
+
+        host, port:
+            address where the viewers connect
+
+        backlog_size: int
+            number of latest samples kept for viewers that join late
+
+        queue_size: int
+            samples queued per viewer. Older samples are dropped if the viewer
+            is slower than the experiment
+
+        keyframe_interval: int
+            maximum number of delta frames between keyframes
+        """
+        self.metadata = dict(metadata or {})
+        self.metadata["channel_names"] = list(channel_names)
+        self.queue_size = queue_size
+        self.keyframe_interval = keyframe_interval
+        self.backlog = deque(maxlen=backlog_size)
+        self.subscribers = []
+        self.sequence = 0
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.address = self.server.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            # the viewer can ask for the latest samples of the test
+            try:
+                connection.settimeout(1)
+                request = json.loads(connection.makefile("r").readline() or "{}")
+                connection.settimeout(None)
+            except (OSError, ValueError):
+                request = {}
+            number_of_samples = int(request.get("backlog", 0))
+            backlog = list(self.backlog)[-number_of_samples:] if number_of_samples else []
+
+            subscriber = _Subscriber(connection, self.queue_size, self.keyframe_interval)
+            self.subscribers.append(subscriber)
+            threading.Thread(target=subscriber.run, args=(self.metadata, backlog),
+                daemon=True).start()
+
+    def publish(self, t, values):
+        """
+        Called from the control loop. Queues the sample for every viewer and
+        returns immediately
+
+        Parameters:
+        ----------
+        t: float
+            time of the sample in seconds
+
+        values: list or np.array
+            value of each channel
+        """
+        sample = (self.sequence, t, np.array(values, dtype=float))
+        self.sequence += 1
+        self.backlog.append(sample)
+
+        for subscriber in list(self.subscribers):
+            if subscriber.closed:
+                self.subscribers.remove(subscriber)
+                continue
+            subscriber.queue.append(sample)
+            subscriber.new_sample.set()
+
+    def close(self):
+        self.server.close()
+        for subscriber in self.subscribers:
+            subscriber.closed = True
+            subscriber.new_sample.set()
+
+
+class TelemetryClient():
+    """
+    Viewer side of the TelemetryServer
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, backlog=0, timeout=5):
+        """
+        Connects to the server and reads the metadata of the test
+
+        Parameters:
+        ----------
+        backlog: int
+            number of latest samples requested before the live ones
+        """
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.sendall((json.dumps({"backlog": backlog}) + "\n").encode("utf-8"))
+        self._buffer = b""
+        self.values = None
+        self.last_sequence = None
+
+        frame_type, _, _, payload = self._read_frame()
+        self.metadata = json.loads(payload.decode("utf-8"))
+        self.channel_names = self.metadata["channel_names"]
+
+    def _receive(self, number_of_bytes):
+        while len(self._buffer) < number_of_bytes:
+            part_response = self.sock.recv(65536)
+            if not part_response:
+                raise ConnectionError("Telemetry server closed the connection")
+            self._buffer += part_response
+        data = self._buffer[:number_of_bytes]
+        self._buffer = self._buffer[number_of_bytes:]
+        return data
+
+    def _read_frame(self):
+        frame_type, sequence, t, length = HEADER.unpack(self._receive(HEADER.size))
+        return frame_type, sequence, t, self._receive(length)
+
+    def read(self):
+        """
+        Waits for the next sample
+
+        Returns:
+        -------
+        sequence: int
+            number of the sample (gaps mean samples dropped by the server)
+
+        t: float
+            time of the sample
+
+        values: np.array
+            value of each channel
+        """
+        frame_type, sequence, t, payload = self._read_frame()
+        if frame_type == KEYFRAME:
+            self.values = np.frombuffer(payload, dtype="<f8").copy()
+        elif frame_type == DELTA:
+            self.values = self.values + np.frombuffer(payload, dtype="<f4")
+        self.last_sequence = sequence
+        return sequence, t, self.values
+
+    def read_available(self, max_samples=100000):
+        """
+        Returns all the samples already received without waiting
+
+        Returns:
+        -------
+        t: np.array
+            times of the samples
+
+        values: np.array
+            (samples, channels) values
+        """
+        t, values = [], []
+        self.sock.setblocking(False)
+        try:
+            while True:
+                part_response = self.sock.recv(65536)
+                if not part_response:
+                    break
+                self._buffer += part_response
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.setblocking(True)
+
+        # decode the complete frames only
+        while len(t) < max_samples and len(self._buffer) >= HEADER.size:
+            length = HEADER.unpack(self._buffer[:HEADER.size])[3]
+            if len(self._buffer) < HEADER.size + length:
+                break
+            _, sample_t, sample_values = self.read()
+            t.append(sample_t)
+            values.append(sample_values)
+
+        return np.array(t), np.array(values).reshape(len(t), len(self.channel_names))
+
+    def close(self):
+        self.sock.close()
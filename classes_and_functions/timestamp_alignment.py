@@ -0,0 +1,193 @@
+"""
+Alignment of the channels acquired from different devices on a common time base
+
+Each device (logger channel groups, load cell) is queried at a different instant
+and the gas analysers see the gases several seconds after they leave the sample.
+The TimestampAligner stores the acquisition time of every reading, corrected
+by the transport delay of its channel, and resamples all the channels onto a
+common time base: sample by sample while the test runs (streaming) or once
+the test is finished (batch).
+"""
+
+import os
+import json
+import numpy as np
+
+# transport delays of the gas analysers are stored next to this file
+DELAYS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "channel_delays.json")
+
+
+def load_channel_delays(path=DELAYS_FILE):
+    """
+    Reads the transport delay (seconds) of each channel. Channels that are not
+    in the file have no delay. Keys starting with "_" are notes.
+    """
+    with open(path, "r") as handle:
+        delays = json.load(handle)
+    return {name: delay for name, delay in delays.items() if not name.startswith("_")}
+
+
+class TimestampAligner():
+    """
+    Stores readings with their own acquisition time and resamples them onto a
+    common time base
+    """
+
+    def __init__(self, devices, delays=None, capacity=36000):
+        """
+        Parameters:
+        ----------
+        devices: dict
+            channel names acquired by each device, e.g.
+            {"sample_temperatures": ["T4", "T8", "T12", "T16"]}
+
+        delays: dict
+            transport delay in seconds of each channel (see load_channel_delays)
+
+        capacity: int
+            maximum number of readings stored per channel
+        """
+        if delays is None:
+            delays = {}
+
+        self.channel_names = [name for channels in devices.values() for name in channels]
+        self.device_index = {}
+        first_channel = 0
+        for device, channels in devices.items():
+            self.device_index[device] = np.arange(first_channel, first_channel + len(channels))
+            first_channel += len(channels)
+
+        number_of_channels = len(self.channel_names)
+        self.delays = np.array([delays.get(name, 0.0) for name in self.channel_names])
+        self.times = np.full((number_of_channels, capacity), np.nan)
+        self.values = np.full((number_of_channels, capacity), np.nan)
+        self.counts = np.zeros(number_of_channels, dtype=int)
+
+    def record(self, device, values, t_request, t_reply, reading_times=None):
+        """
+        Stores the readings of one device
+
+        The acquisition time is the midpoint of the query or, if the logger
+        returns its own (relative) time stamps, the time of the request plus
+        the time stamp of each reading. The transport delay of each channel is
+        then subtracted.
+
+        Parameters:
+        ----------
+        device: str
+            name of the device (key of devices in the constructor)
+
+        values: np.array
+            readings in the order of the channels of the device
+
+        t_request: float
+            time.time() right before the query
+
+        t_reply: float
+            time.time() right after the reply
+
+        reading_times: np.array
+            relative time stamps returned by the logger (:FORMat:READing:TIME)
+        """
+        index = self.device_index[device]
+        if reading_times is None:
+            acquisition_times = np.full(len(index), (t_request + t_reply) / 2)
+        else:
+            acquisition_times = t_request + np.asarray(reading_times) - np.min(reading_times)
+
+        position = self.counts[index]
+        self.times[index, position] = acquisition_times - self.delays[index]
+        self.values[index, position] = values
+        self.counts[index] += 1
+
+    def latest_complete_time(self):
+        """
+        Latest time for which all the channels have a reading at or after it,
+        i.e. the latest time that can be resampled without extrapolating.
+        Channels without readings yet are not waited for (nan if no channel
+        has a reading)
+        """
+        recorded = self.counts > 0
+        if not np.any(recorded):
+            return np.nan
+        last_times = self.times[recorded, self.counts[recorded] - 1]
+        return np.min(last_times)
+
+    def sample_latest(self):
+        """
+        Streaming mode at the latest complete time (see sample), used to hand
+        the aligned channels to the consumers while the test runs
+
+        Returns:
+        -------
+        t: float
+            latest complete time (time.time() scale)
+
+        aligned_values: np.array
+            value of each channel at t
+        """
+        t = self.latest_complete_time()
+        return t, self.sample(t)
+
+    def sample(self, t):
+        """
+        Streaming mode. Interpolates every channel at time t between the two
+        readings that bracket it (binary search, so the cost does not grow
+        with the length of the test)
+
+        Parameters:
+        ----------
+        t: float
+            time (time.time() scale) at which all the channels are resampled.
+            Use latest_complete_time() to avoid extrapolation
+
+        Returns:
+        -------
+        aligned_values: np.array
+            value of each channel at t (nan if t is outside the readings)
+        """
+        aligned_values = np.full(len(self.channel_names), np.nan)
+        for channel, count in enumerate(self.counts):
+            position = np.searchsorted(self.times[channel, :count], t)
+            first = max(position - 1, 0)
+            aligned_values[channel] = np.interp(t, self.times[channel, first:position+1],
+                self.values[channel, first:position+1], left=np.nan, right=np.nan)
+        return aligned_values
+
+    def align(self, time_base=None, period=0.1):
+        """
+        Batch mode. Resamples every channel of the whole test onto a common time base
+
+        Parameters:
+        ----------
+        time_base: np.array
+            times (time.time() scale) at which the channels are resampled. If None,
+            a uniform time base with the given period is used between the first
+            and the last time where all the channels have readings (channels
+            without readings are nan)
+
+        period: float
+            period of the uniform time base in seconds
+
+        Returns:
+        -------
+        time_base: np.array
+            common times
+
+        aligned_values: np.array
+            (len(time_base), number of channels) array with the resampled values
+        """
+        if time_base is None:
+            start = np.max(self.times[self.counts > 0, 0])
+            end = self.latest_complete_time()
+            time_base = np.arange(start, end, period)
+
+        aligned_values = np.full((len(time_base), len(self.channel_names)), np.nan)
+        for channel, count in enumerate(self.counts):
+            if count == 0:
+                continue
+            aligned_values[:, channel] = np.interp(time_base, self.times[channel, :count],
+                self.values[channel, :count], left=np.nan, right=np.nan)
+
+        return time_base, aligned_values
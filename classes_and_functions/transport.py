@@ -0,0 +1,291 @@
+"""
+Transports used to send SCPI commands to the FPA's data logger
+
+VisaTransport talks to the logger through GPIB (or any other VISA resource).
+SocketTransport talks to loggers with a LAN interface through a raw TCP socket
+(port 5025) and can pipeline several queries before reading the replies.
+LocalSCPIStandIn is a small TCP server that behaves like the logger so that
+the code can be run without the instrument.
+
+All transports expose the methods used by the rest of the code (write, query,
+query_binary_values and close) so they can replace a pyvisa resource.
+"""
+
+import socket
+import threading
+import numpy as np
+
+# one visa ResourceManager is shared by all the connections of the process
+_resource_manager = None
+
+
+def get_resource_manager():
+    """
+    Returns the visa ResourceManager of the process, creating it the first time
+    """
+    global _resource_manager
+    if _resource_manager is None:
+        import visa
+        _resource_manager = visa.ResourceManager()
+    return _resource_manager
+
+
+class VisaTransport():
+    """
+    Connection to the logger through a VISA resource (e.g. "GPIB0::9::INSTR")
+    """
+
+    def __init__(self, address, timeout_ms=1000):
+        """
+        Opens the VISA resource using the shared ResourceManager
+
+        Parameters:
+        ----------
+        address: str
+            VISA address of the logger
+
+        timeout_ms: int
+            time out for reads and writes in milliseconds
+        """
+        self.address = address
+        self.resource = get_resource_manager().open_resource(address)
+        self.resource.timeout = timeout_ms
+
+    def write(self, command):
+        self.resource.write(command)
+
+    def query(self, query):
+        return self.resource.query(query)
+
+    def query_binary_values(self, query, datatype="d", is_big_endian=True,
+        container=np.array):
+        return self.resource.query_binary_values(query, datatype=datatype,
+            is_big_endian=is_big_endian, container=container)
+
+    def query_pipelined(self, queries, binary=False):
+        """
+        GPIB cannot queue several replies, so the queries are sent one by one
+        """
+        if binary:
+            return [self.query_binary_values(query) for query in queries]
+        return [self.query(query) for query in queries]
+
+    def close(self):
+        if self.resource is not None:
+            self.resource.close()
+            self.resource = None
+
+
+class SocketTransport():
+    """
+    Connection to the logger through a raw SCPI socket
+    """
+
+    def __init__(self, host, port=5025, timeout_ms=1000):
+        """
+        Opens the TCP connection. The connection is kept open for the whole
+        session instead of being created for every query
+
+        Parameters:
+        ----------
+        host: str
+            IP address of the logger
+
+        port: int
+            SCPI raw socket port (5025 for Keysight instruments)
+
+        timeout_ms: int
+            time out for reads and writes in milliseconds
+        """
+        self.address = (host, port)
+        self.sock = socket.create_connection(self.address, timeout=timeout_ms/1000)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b""
+
+    def _receive(self, number_of_bytes):
+        """
+        Returns exactly number_of_bytes from the socket
+        """
+        while len(self._buffer) < number_of_bytes:
+            part_response = self.sock.recv(65536)
+            if not part_response:
+                raise ConnectionError("Connection closed by the logger")
+            self._buffer += part_response
+        data = self._buffer[:number_of_bytes]
+        self._buffer = self._buffer[number_of_bytes:]
+        return data
+
+    def _read_line(self):
+        """
+        Returns the next reply terminated by a new line
+        """
+        while b"\n" not in self._buffer:
+            part_response = self.sock.recv(65536)
+            if not part_response:
+                raise ConnectionError("Connection closed by the logger")
+            self._buffer += part_response
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line.decode("ascii").strip()
+
+    def _read_binary_block(self, datatype="d", is_big_endian=True):
+        """
+        Reads an IEEE 488.2 definite length block (#<n><length><data>\\n)
+        """
+        header = self._receive(2)
+        if header[:1] != b"#":
+            raise ValueError(f"Expected a binary block, received {header}")
+        number_of_digits = int(header[1:2])
+        length = int(self._receive(number_of_digits))
+        data = self._receive(length)
+        # consume the terminator
+        self._read_line()
+
+        dtype = np.dtype(datatype).newbyteorder(">" if is_big_endian else "<")
+        return np.frombuffer(data, dtype=dtype).astype(float)
+
+    def write(self, command):
+        self.sock.sendall(f"{command}\n".encode("ascii"))
+
+    def query(self, query):
+        self.write(query)
+        return self._read_line()
+
+    def query_binary_values(self, query, datatype="d", is_big_endian=True,
+        container=np.array):
+        self.write(query)
+        return container(self._read_binary_block(datatype, is_big_endian))
+
+    def query_pipelined(self, queries, binary=False):
+        """
+        Sends all the queries in one packet and then reads the replies in order,
+        so the round trips to the logger overlap
+
+        Parameters:
+        ----------
+        queries: list
+            list of SCPI queries
+
+        binary: bool
+            whether the replies are binary blocks
+
+        Returns:
+        -------
+        replies: list
+            replies (str or np.array) in the order of the queries
+        """
+        self.sock.sendall("".join(f"{query}\n" for query in queries).encode("ascii"))
+        if binary:
+            return [self._read_binary_block() for query in queries]
+        return [self._read_line() for query in queries]
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class LocalSCPIStandIn():
+    """
+    Minimal TCP server that answers like the data logger. Readings are random
+    values around a configurable level. Useful to run the acquisition code and
+    the SocketTransport without the instrument.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, reading_level=20.0):
+        """
+        Starts the server in a background thread. Use port=0 to let the
+        operating system choose a free port (see self.address)
+        """
+        self.reading_level = reading_level
+        self.binary_transfer = False
+        self.state = {}
+        self.commands = []
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.address = self.server.getsockname()
+
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(connection,),
+                daemon=True).start()
+
+    def _handle(self, connection):
+        buffer = b""
+        with connection:
+            while True:
+                try:
+                    part_request = connection.recv(65536)
+                except OSError:
+                    return
+                if not part_request:
+                    return
+                buffer += part_request
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    for command in line.decode("ascii").strip().split(";"):
+                        reply = self._reply(command.strip())
+                        if reply is not None:
+                            connection.sendall(reply)
+
+    def _number_of_readings(self, command):
+        if "(@" not in command:
+            return 1
+        channels = command.split("(@")[1].split(")")[0]
+        count = 0
+        for item in channels.split(","):
+            if ":" in item:
+                first, last = item.split(":")
+                count += int(last) - int(first) + 1
+            else:
+                count += 1
+        return count
+
+    def _reply(self, command):
+        """
+        Returns the bytes sent back for a command (None for commands without reply)
+        """
+        self.commands.append(command)
+        upper_command = command.upper()
+
+        if upper_command.startswith(":ROUT") and "SCAN" in upper_command:
+            self.state["scan"] = self._number_of_readings(command)
+        if upper_command.startswith(":FORM") and "DATA" in upper_command:
+            self.binary_transfer = "REAL" in upper_command
+        if not upper_command.endswith("?") and "? " not in upper_command:
+            key = command.split(" ")[0].upper()
+            self.state[key] = command[len(key):].strip()
+            return None
+
+        if upper_command == "*IDN?":
+            return b"LOCAL,SCPI stand-in,0,1.0\n"
+        if upper_command.startswith(":SYST") and "ERR" in upper_command:
+            return b"+0,\"No error\"\n"
+
+        if upper_command.startswith((":MEAS", ":READ")):
+            if upper_command.startswith(":READ"):
+                number_of_readings = self.state.get("scan", 1)
+            else:
+                number_of_readings = self._number_of_readings(command)
+            readings = self.reading_level + np.random.normal(0, 0.1, number_of_readings)
+            if self.binary_transfer:
+                data = readings.astype(">f8").tobytes()
+                length = str(len(data)).encode("ascii")
+                return b"#" + str(len(length)).encode("ascii") + length + data + b"\n"
+            return (",".join(f"{reading:+.8E}" for reading in readings) + "\n").encode("ascii")
+
+        # configuration queries reply with the last value written
+        key = command.split(" ")[0].rstrip("?").upper()
+        return f"{self.state.get(key, '0')}\n".encode("ascii")
+
+    def close(self):
+        self.server.close()
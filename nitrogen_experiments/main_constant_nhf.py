@@ -9,6 +9,14 @@ desired value.
 2. Once the mlr is within the desired value, the control of the lamps is passed to the PID controller,
 until the test is ended.
 
+The test itself is run by run_test, so that a campaign of tests can share
+the connections to the instruments and the calibration (see
+campaigns/run_campaign.py).
+
+The state of the test is journaled while it runs. If the process dies, running
+the script again offers to resume the unfinished test where the journal was
+recorded, if it was interrupted shortly before (see run_journal.py).
+
 Use command: 'prompt $g' to shorten command prompt
 """
 
@@ -26,322 +34,924 @@ import os
 import pickle
 
 # add path to import functions and classes (absolute path on the FPA's computer)
-sys.path.insert(1, r"C:\\Users\\FireLab\\Desktop\\Simon\\FeedbackControl_MassExperiments\\classes_and_functions")
+sys.path.insert(1, r"C:\\Users\\FireLab\\Desktop\\Simon\\FeedbackControl_TemperatureExperiments\\classes_and_functions")
 from loadcell import MettlerToledoDevice
 from datalogger import DataLogger
 from PID import PID_IHF as PID
-from lamps_extract_calibrationcoeff import extract_calibrationcoeff
+from lamps_extract_calibrationcoeff import extract_calibrationcoeff, extract_lamp_models
+from timestamp_alignment import TimestampAligner, load_channel_delays
+from status_display import ConsoleStatus
+from telemetry import TelemetryServer, DEFAULT_PORT
+from dead_time_compensation import SmithPredictor
+from relay_autotune import RelayAutoTuner, load_cached_gains, save_cached_gains
+from run_metadata import read_run_metadata, update_run_metadata
+from gain_scheduling import build_gain_schedule
+from cascade_control import InnerHeatFluxLoop
+from setpoints import SetpointSchedule, load_setpoint_profile, ramp_profile
+from run_journal import RunJournal, read_journal, find_unfinished_test, confirm_resume, reopen_recorder
+from loop_watchdog import LoopWatchdog
+from channel_health import ChannelHealth, load_channel_limits
+from downsampling_pyramid import build_pyramid_for_test
 
 #####
-# CONNECT TO LOAD CELL AND DATA LOGGER AND INSTANTIATE CLASSES
+# CONNECT TO LOAD CELL AND DATA LOGGER AND LOAD THE CALIBRATION
 #####
 
-# create instance of the load cell class and check connection
-print("\nConnection to load cell")
-load_cell = MettlerToledoDevice()
-
-# create instance of the data logger and check connection
-print("\nConnection to data logger")
-rm, logger = DataLogger().new_instrument()
+# setpoint profile of setpoint_profiles.json, None for a constant setpoint
+# entered at the prompt. MLR profiles start at the activation of the PID, IHF
+# profiles replace the ramp and the PID
+setpoint_profile = None
 
 
-#####
-# REQUEST FROM THE USER THE DESIRED MLR (CONSTANT) AND THE NAME OF THE EXPERIMENT
-#####
-while True:
-	try:
-		mlr_desired = float(input("\nInput mlr to be kept contant throughout the test (g/s):\n"))
-		number_of_test = input("Input number of test in format XXX:\n" )
-		material = input("Input material:\n").lower()
-
-		name_of_file = f"N2_{number_of_test}_{material}_{mlr_desired}gm-2s-1.csv"
-
-		# confirm the values entered by user
-		confirmation = input(f"\nDesired mlr = {mlr_desired} g/m2s. \nName of file: {name_of_file}.\nProceed?\n")
-		if not confirmation.lower() in ["yes", "y"]:
-			continue
-		else:
-			break
+def connect_instruments(session=None, load_cell=None):
+	"""
+	Connects to the load cell and configures the data logger for the N2 tests
 
-	except Exception as e:
-		print("Invalid file name or mlr")
+	Parameters:
+	----------
+	session: DataLogger
+		connection already open (e.g. by a campaign). If None, the logger is
+		connected
 
-		# turn off the lamps and close the instrument
-		logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
-		logger.close()
-		rm.close()
-		sys.exit()
+	load_cell: MettlerToledoDevice
+		load cell already connected. If None, it is connected
 
-name_of_folder = name_of_file.split(".csv")[0]
-full_name_of_file = os.path.join(name_of_folder, name_of_file)
-# create folder with the name of the file
-if not os.path.exists(name_of_folder):
-	os.mkdir(name_of_folder)
-# do not overwrite the file
-else:
-	print("File already exists")
-	sys.exit()
+	Returns:
+	-------
+	load_cell: MettlerToledoDevice
 
+	rm, logger: DataLogger, VisaTransport
+		session and instrument (see DataLogger.new_instrument)
+	"""
+	# create instance of the load cell class and check connection
+	if load_cell is None:
+		print("\nConnection to load cell")
+		load_cell = MettlerToledoDevice()
 
+	# create instance of the data logger and check connection
+	print("\nConnection to data logger")
+	if session is None:
+		session = DataLogger()
+	rm, logger = session.new_instrument()
+	return load_cell, rm, logger
 
-#####
-# INITIALIZE USEFUL PARAMETERS AND START TEST
-#####
 
-print("Starting test")
-
-# experiment parameters
-time_pretesting_period = 60  # s
-time_logging_period = 0.1    # s
-surface_area = 0.1*0.1       # m2
-averaging_window = 30        # readings
-irradiation_rate = 0.25       # kWm-2s-1
-
-# epsilon is percentage of mlr_desired used to forcefully reduce oscillations
-epsilon = 0.2   # %
-
-# FPA lamps
-max_lamp_voltage = 4.5
-min_lamp_voltage = 0.25
-
-# extract regression coefficients from the latest calibration file
-coeff_hftovolts, coeff_voltstohf = extract_calibrationcoeff()
-
-# create arrays large enough to accomodate one hour of data at the pre-set maximum logging frequency
-t_array = np.zeros(int(3600/time_logging_period))
-IHF = np.zeros_like(t_array)
-IHF_volts = np.zeros_like(t_array)
-mass = np.zeros_like(t_array)
-mlr = np.zeros_like(t_array)
-mlr_moving_average_array = np.zeros_like(t_array)
-
-# PID
-PID_state = "not_active"
-PID_kp = 0.2
-PID_ki = 0.04
-PID_kd = 0.2
-PID_integral_term_array = np.zeros_like(t_array)
-PID_proportional_term_array = np.zeros_like(t_array)
-PID_derivative_term_array = np.zeros_like(t_array)
-
-# open csv file to write data
-with open(full_name_of_file, "w", newline = "") as handle:
-	writer = csv.writer(handle)
-	writer.writerows([['time_seconds', "mass_g", 
-		"IHF_volts", "IHF_kwm-2",
-		"mlr_g/m-2s-1", "mlr_movingaverage_gm-2s-1", 
-		"Observations", "PID_state"]])
-
-	# record the number of readings
-	time_step = 0
-
-	# ------
-	# record mass for a period of 60 seconds before starting
-	# ------
-	print(f"\nGathering data for {time_pretesting_period} seconds before testing")
-	time.sleep(2)
-
-	time_start_logging = time.time()
-	previous_log = time.time()
-	while time.time() - time_start_logging < time_pretesting_period:
-
-		# enforce a maximum logging frequency given by 1/time_logging_period
-		if time.time() - previous_log < time_logging_period:
-			continue
-		else:
+def load_calibrations():
+	"""
+	Regression coefficients from the latest calibration file of the lamps
+	"""
+	coeff_hftovolts, coeff_voltstohf = extract_calibrationcoeff()
+	return {"coeff_hftovolts": coeff_hftovolts,
+		"coeff_voltstohf": coeff_voltstohf}
 
-			t_array[time_step] = time.time() - time_start_logging
-			mass[time_step] = load_cell.query_weight()
 
-			if time_step == 0:
-				mlr[time_step] = 0
-			else:
-				# calculate mlr and force all negative readings to zero
-				mlr[time_step] = - np.round((mass[time_step] - mass[time_step-1]) / (t_array[time_step] - t_array[time_step-1])/surface_area,1)
-				mlr[mlr<0]=0
-
-				# while I haven't done the necessary number of readings, averaging window needs to be smaller
-				averaging_window_pretest = np.min([averaging_window, time_step])
-				mlr_moving_average = mlr[time_step - averaging_window_pretest:time_step].mean()
-				mlr_moving_average_array[time_step] = mlr_moving_average			
-
-			# write data to the csv file
-			if time_step == 0:
-				writer.writerows([[t_array[time_step], mass[time_step], 
-					IHF_volts[time_step], IHF[time_step],
-					mlr[time_step], mlr_moving_average_array[time_step], 
-					"start_logging", PID_state]])
-			else:
-				writer.writerows([[t_array[time_step], mass[time_step], 
-					IHF_volts[time_step], IHF[time_step], 
-					mlr[time_step],	mlr_moving_average_array[time_step],
-					"", PID_state]])
-
-
-			previous_log = time.time()
-			time_step_lastpretest = time_step
-			time_step += 1
-
-		# end if ESC is pressed
-		if msvcrt.kbhit():
-			if ord(msvcrt.getch()) == 27:
-				break
-
-	# ------
-	# define additional parameters for start of test
-	# ------
-
-	bool_start_test = True
-	bool_PID_active = False
-	time_start_test = time.time()
-	previous_log = time_start_test
-	print("\nStarting lamps")
+#####
+# REQUEST FROM THE USER THE DESIRED MLR (CONSTANT) AND THE NAME OF THE EXPERIMENT
+#####
 
+def test_file_name(test):
+	"""
+	Name of the csv file of a test (see run_test)
+	"""
+	if test.get("setpoint_profile") is not None:
+		setpoint_description = test["setpoint_profile"]
+	else:
+		setpoint_description = f"{test['setpoint']}gm-2s-1"
+	return f"N2_{test['number_of_test']}_{test['material']}_{setpoint_description}.csv"
+
+
+def request_test(setpoint_profile=None):
+	"""
+	Asks for the mlr (unless there is a setpoint profile), the number of the
+	test and the material
+
+	Returns:
+	-------
+	test: dict
+		definition of the test (see run_test), None if the values are invalid
+	"""
 	while True:
 		try:
+			mlr_desired = np.nan
+			if setpoint_profile is None:
+				mlr_desired = float(input("\nInput mlr to be kept contant throughout the test (g/s):\n"))
+			number_of_test = input("Input number of test in format XXX:\n" )
+			material = input("Input material:\n").lower()
+
+			test = {"atmosphere": "N2",
+				"number_of_test": number_of_test,
+				"material": material,
+				"setpoint": mlr_desired,
+				"setpoint_profile": setpoint_profile}
+			name_of_file = test_file_name(test)
+
+			# confirm the values entered by user
+			confirmation = input(f"\nDesired mlr = {setpoint_profile or mlr_desired}. \nName of file: {name_of_file}.\nProceed?\n")
+			if not confirmation.lower() in ["yes", "y"]:
+				continue
+			else:
+				return test
 
-			# enforce a maximum logging frequency given by 1/time_logging_period
-			if time.time() - previous_log < time_logging_period:
-				pass
+		except Exception as e:
+			print("Invalid file name or mlr")
+			return None
+
+
+def run_test(load_cell, logger, test, calibrations, resume=False):
+	"""
+	Runs one test, from the pretest period until ESC is pressed (or until its
+	duration), and turns the lamps off
+
+	Parameters:
+	----------
+	load_cell: MettlerToledoDevice
+
+	logger: VisaTransport or SocketTransport
+		data logger configured by connect_instruments
+
+	test: dict
+		"number_of_test", "material", "setpoint" (g/m2s, ignored with a
+		profile), "setpoint_profile" (None for a constant setpoint) and
+		optionally "duration" (s from the start of the lamps), "telemetry_port"
+		and "max_resume_gap" (s, see run_journal.confirm_resume)
+
+	calibrations: dict
+		see load_calibrations
+
+	resume: bool
+		continues the unfinished test of the same name from its journal
+
+	Returns:
+	-------
+	full_name_of_file: str
+		csv file of the test (None if the test already exists)
+	"""
+	setpoint_profile = test.get("setpoint_profile")
+	material = test["material"]
+	test_duration = test.get("duration")
+	name_of_file = test_file_name(test)
+
+	mlr_desired = test["setpoint"]
+	if setpoint_profile is not None:
+		profile = load_setpoint_profile(setpoint_profile)
+		if profile["variable"] not in ["MLR", "IHF"]:
+			raise ValueError(f"The profile {setpoint_profile} is not of MLR or IHF")
+
+	name_of_folder = name_of_file.split(".csv")[0]
+	full_name_of_file = os.path.join(name_of_folder, name_of_file)
+	# create folder with the name of the file
+	if not os.path.exists(name_of_folder):
+		os.mkdir(name_of_folder)
+	# do not overwrite the file
+	elif not resume:
+		print("File already exists")
+		return None
+	else:
+		_, journal_state, _ = read_journal(full_name_of_file)
+
+
+	#####
+	# INITIALIZE USEFUL PARAMETERS AND START TEST
+	#####
+
+	print("Starting test")
+
+	# experiment parameters
+	time_pretesting_period = 60  # s
+	time_logging_period = 0.1    # s
+	surface_area = 0.1*0.1       # m2
+	averaging_window = 30        # readings
+	irradiation_rate = 0.25       # kWm-2s-1, ramp before the PID
+	status_rate = 2              # Hz
+	telemetry_port = test.get("telemetry_port", DEFAULT_PORT)
+	journal_rate = 2             # Hz, records of the state for a resume
+	watchdog_deadline = 1.0      # s, the lamps are turned off if a tick takes longer
+
+	# epsilon is percentage of mlr_desired used to forcefully reduce oscillations
+	epsilon = 0.2   # %
+
+	# dead time compensation of the PID input with a first order plus dead time
+	# model of the mlr moving average per lamp volt (gain in gm-2s-1/V, times in s).
+	# With the compensation epsilon can be reduced or set to 0
+	smith_predictor = False
+	smith_model = {"gain": 4, "time_constant": 20, "dead_time": 3}
+
+	# relay auto-tuning of the PID during the ramp: "off" (configured gains),
+	# "cached" (gains cached for the material, tuned if there are none) or "on"
+	# (always tuned). A cold sample does not respond to the relay, so the relay
+	# starts from the voltage of the ramp once the mlr reaches
+	# autotune_start_fraction of the setpoint, and the ramp continues from there
+	# after the tuning
+	autotune = "off"
+	autotune_start_fraction = 0.8
+	autotune_relay_amplitude = 0.5   # V
+	autotune_hysteresis = 0.2        # gm-2s-1
+	autotune_cycles = 3
+	autotune_max_duration = 600      # s
+	autotune_max_half_period = 60    # s, the tuning fails if the relay does not switch
+
+	# gain scheduling of the PID across the range of the lamps: "off", "voltage"
+	# or "IHF" (operating point used to look up the gains)
+	gain_scheduling = "off"
+	schedule_reference_voltage = 3.0 # V, where the configured gains were tuned
+
+	# cascade control of the lamps: "off" or "gauge" (inner IHF loop on the heat
+	# flux gauge @110, which has to face the lamps, see cascade_control.py). There
+	# are no in-depth thermocouples to correct an observer of the IHF in these tests
+	cascade_control = "off"
+	inner_loop_period = 0.02     # s
+	inner_loop_kp = 0.02         # V per kWm-2
+	inner_loop_ki = 0.1          # V per kWm-2s
+	hf_gauge_factor = 0.0001017  # V/kW/m2
+
+	# FPA lamps
+	max_lamp_voltage = 4.5
+	min_lamp_voltage = 0.25
+
+	# regression coefficients of the calibration (loaded once per session)
+	coeff_hftovolts = calibrations["coeff_hftovolts"]
+	coeff_voltstohf = calibrations["coeff_voltstohf"]
+
+	# setpoints looked up at every tick (time from the start of the lamps for the
+	# IHF, from the activation of the PID for the MLR)
+	ramp_schedule = SetpointSchedule(ramp_profile(irradiation_rate), time_logging_period)
+	setpoint_schedule = None
+	if setpoint_profile is not None:
+		setpoint_schedule = SetpointSchedule(profile, time_logging_period)
+		if setpoint_schedule.variable == "IHF":
+			ramp_schedule = setpoint_schedule
+		else:
+			mlr_desired = setpoint_schedule.setpoint(0)
+	bool_programmed_IHF = (setpoint_schedule is not None) and (
+		setpoint_schedule.variable == "IHF")
+	previous_segment = None
+	profile_event = ""
+
+	# create arrays large enough to accomodate one hour of data at the pre-set maximum logging frequency
+	t_array = np.zeros(int(3600/time_logging_period))
+	IHF = np.zeros_like(t_array)
+	IHF_volts = np.zeros_like(t_array)
+	mass = np.zeros_like(t_array)
+	mlr = np.zeros_like(t_array)
+	mlr_moving_average_array = np.zeros_like(t_array)
+
+	# streaming statistics of every channel to catch a faulty sensor during the test
+	health = ChannelHealth({"load_cell": ["mass_g"],
+		"heat_flux_gauge": ["IHF_measured_kWm-2"]}, load_channel_limits())
+
+	# the load cell and the logger (lamp voltage and, in cascade mode, the heat
+	# flux gauge read by the inner loop) are stamped with their own acquisition
+	# time, so that they can be aligned while the test runs (for the live
+	# viewers) and after the test
+	acquired_channels = {"load_cell": ["mass_g"], "lamps": ["IHF_volts"]}
+	aligner_capacity = len(t_array)
+	if cascade_control == "gauge":
+		acquired_channels["heat_flux_gauge"] = ["IHF_measured_kWm-2"]
+		aligner_capacity = int(len(t_array) * time_logging_period / inner_loop_period)
+	aligner = TimestampAligner(acquired_channels, load_channel_delays(),
+		capacity=aligner_capacity)
+
+	# PID
+	PID_state = "not_active"
+	smith = SmithPredictor(smith_model["gain"], smith_model["time_constant"],
+		smith_model["dead_time"], time_logging_period)
+	PID_kp = 0.2
+	PID_ki = 0.04
+	PID_kd = 0.2
+	PID_integral_term_array = np.zeros_like(t_array)
+	PID_proportional_term_array = np.zeros_like(t_array)
+	PID_derivative_term_array = np.zeros_like(t_array)
+
+	# gains cached by the auto-tuning of previous tests with the same material
+	gains_source = "configured"
+	cached_gains = load_cached_gains("N2", material)
+	if autotune == "cached" and cached_gains is not None:
+		PID_kp = cached_gains["kp"]
+		PID_ki = cached_gains["ki"]
+		PID_kd = cached_gains["kd"]
+		gains_source = "cached"
+		schedule_reference_voltage = cached_gains.get("bias_voltage",
+			schedule_reference_voltage)
+	bool_autotune = ((autotune == "on") or (autotune == "cached" and cached_gains is None)
+		) and not bool_programmed_IHF
+
+	# identified response of the lamps, used by the gain scheduling
+	lamp_models = None
+	if gain_scheduling != "off":
+		try:
+			lamp_models = extract_lamp_models()
+			print(f"Lamp models read from {lamp_models['file']}")
+		except (OSError, ValueError) as e:
+			print(f"\nWARNING: lamp models not read ({e})"
+				"\nThe gains are scheduled with the calibration slope\n")
+
+	# record the parameters of the test
+	update_run_metadata(full_name_of_file, {"test": name_of_file,
+		"material": material,
+		"setpoint": mlr_desired,
+		"setpoint_profile": None if setpoint_profile is None else profile,
+		"time_logging_period": time_logging_period,
+		"PID_gains": {"kp": PID_kp, "ki": PID_ki, "kd": PID_kd},
+		"gains_source": gains_source,
+		"cascade_control": cascade_control,
+		"lamp_models": None if lamp_models is None else lamp_models["file"]})
+
+	# the output of the PID is the IHF setpoint of the inner loop in cascade mode
+	inner_loop = InnerHeatFluxLoop(coeff_hftovolts, inner_loop_kp, inner_loop_ki,
+		max_lamp_voltage, min_lamp_voltage)
+
+	# open csv file to write data (a resumed test continues after the rows
+	# recorded until its last journal record)
+	if resume:
+		recorded = reopen_recorder(full_name_of_file, journal_state["csv_offset"])
+	with open(full_name_of_file, "a" if resume else "w", newline = "") as handle:
+		writer = csv.writer(handle)
+		if not resume:
+			writer.writerows([['time_seconds', "mass_g", 
+				"IHF_volts", "IHF_kwm-2",
+				"mlr_g/m-2s-1", "mlr_movingaverage_gm-2s-1", 
+				"Observations", "PID_state", "IHF_measured_kWm-2"]])
+
+		# released in the finally below, even if the test fails
+		telemetry = journal = watchdog = status = None
+		bool_completed = False
+		try:
+			# every sample is also published to the live viewers, followed by the
+			# health of the acquired channels and by the acquired channels aligned
+			# at the latest complete time
+			telemetry = TelemetryServer(['time_seconds', "mass_g",
+				"IHF_volts", "IHF_kwm-2",
+				"mlr_g/m-2s-1", "mlr_movingaverage_gm-2s-1"] + health.telemetry_names()
+				+ ["aligned_time_seconds"] + [f"aligned_{name}" for name in aligner.channel_names],
+				{"test": name_of_file, "folder": os.path.abspath(name_of_folder)},
+				port = telemetry_port)
+			journal = RunJournal(full_name_of_file, None if resume else test, journal_rate)
+
+			# the watchdog process connects to the logger during the pretest and
+			# watches the loop from its first tick
+			watchdog = LoopWatchdog(logger.address, watchdog_deadline).start()
+			stall_count = 0
+
+			# record the number of readings
+			time_step = 0
+
+			# ------
+			# record mass for a period of 60 seconds before starting
+			# ------
+			if resume:
+				time_pretesting_period = 0
 			else:
+				print(f"\nGathering data for {time_pretesting_period} seconds before testing")
+				time.sleep(2)
 
-				# record time for this reading
-				t_array[time_step] = time.time() - time_start_logging
+			time_start_logging = time.time()
+			previous_log = time.time()
+			while time.time() - time_start_logging < time_pretesting_period:
 
-				# query mass and update array
-				mass[time_step] = load_cell.query_weight()
-				
-				# calculate mlr and force all negative readings to zero
-				mlr[time_step] = - np.round((mass[time_step] - mass[time_step-1]) / 
-					(t_array[time_step] - t_array[time_step-1])/surface_area,1)
-				mlr_moving_average = mlr[time_step - averaging_window:time_step].mean()
-				mlr_moving_average_array[time_step] = mlr_moving_average
-
-				input_mlr = mlr_moving_average
-
-				# forcefully remove the error if we are epsilon percent from the desired value
-				current_error = mlr_desired - mlr_moving_average
-				if np.abs(mlr_moving_average - mlr_desired) < epsilon * mlr_desired:
-					input_mlr = mlr_desired
-
-				# start with a ramped IHF, and once mlr reaches 0.8*mlr_desired, activate PID
-				if PID_state == "not_active":
-					IHF[time_step+1] = (t_array[time_step] - 
-						t_array[time_step_lastpretest]) * irradiation_rate
-					IHF_volts[time_step+1] = np.polyval(
-						coeff_hftovolts,IHF[time_step+1])
-					voltage_output = IHF_volts[time_step+1]
-
-					if voltage_output > max_lamp_voltage:
-						voltage_output = max_lamp_voltage
-						IHF_volts[time_step+1] = max_lamp_voltage
-						IHF[time_step+1] = np.polyval(
-							coeff_voltstohf, IHF_volts[time_step+1])
-
-					if mlr_moving_average > 0.95*mlr_desired:
-						PID_state = "active"
-						print("\n-----")
-						print("PID ACTIVE")
-						print("-----\n")
-
-						# set pid parameters
-						previous_pid_time = time.time()
-						last_error = mlr_desired - mlr_moving_average
-						last_input = mlr_moving_average
-						pid_integral_term = voltage_output
-						pid_proportional_term = 0
-						pid_derivative_term = 0
-
-
-				# call PID
-				elif PID_state == "active":
+				# enforce a maximum logging frequency given by 1/time_logging_period
+				if time.time() - previous_log < time_logging_period:
+					continue
+				else:
 
-					voltage_output, previous_pid_time, last_error, pid_proportional_term, \
-					pid_integral_term, pid_derivative_term = \
-											PID(
-											input_mlr, mlr_desired, previous_pid_time, 
-											last_error, last_input, pid_integral_term, PID_kp, PID_ki, PID_kd,
-											max_lamp_voltage, min_lamp_voltage)
-					IHF_volts[time_step+1] = voltage_output
-					IHF[time_step+1] = np.polyval(
-						coeff_voltstohf, IHF_volts[time_step+1])
-					last_input = mlr_moving_average
-
-					PID_proportional_term_array[time_step] = pid_proportional_term
-					PID_integral_term_array[time_step] = pid_integral_term
-					PID_derivative_term_array[time_step] = pid_derivative_term
-
-				# write IHF to the lamps
+					t_array[time_step] = time.time() - time_start_logging
+					t_request = time.time()
+					mass[time_step] = load_cell.query_weight()
+					aligner.record("load_cell", [mass[time_step]], t_request, time.time())
+					# the lamps are off during the pretest
+					aligner.record("lamps", [0.0], t_request, t_request)
+					health.record("load_cell", [mass[time_step]], t_array[time_step])
+
+					if time_step == 0:
+						mlr[time_step] = 0
+					else:
+						# calculate mlr and force all negative readings to zero
+						mlr[time_step] = - np.round((mass[time_step] - mass[time_step-1]) / (t_array[time_step] - t_array[time_step-1])/surface_area,1)
+						mlr[mlr<0]=0
+
+						# while I haven't done the necessary number of readings, averaging window needs to be smaller
+						averaging_window_pretest = np.min([averaging_window, time_step])
+						mlr_moving_average = mlr[time_step - averaging_window_pretest:time_step].mean()
+						mlr_moving_average_array[time_step] = mlr_moving_average			
+
+					# write data to the csv file (the heat flux gauge is not read
+					# during the pretest)
+					if time_step == 0:
+						writer.writerows([[t_array[time_step], mass[time_step], 
+							IHF_volts[time_step], IHF[time_step],
+							mlr[time_step], mlr_moving_average_array[time_step], 
+							"start_logging", PID_state, ""]])
+					else:
+						writer.writerows([[t_array[time_step], mass[time_step], 
+							IHF_volts[time_step], IHF[time_step], 
+							mlr[time_step],	mlr_moving_average_array[time_step],
+							"", PID_state, ""]])
+					aligned_time, aligned_values = aligner.sample_latest()
+					telemetry.publish(t_array[time_step], [t_array[time_step], mass[time_step],
+						IHF_volts[time_step], IHF[time_step],
+						mlr[time_step], mlr_moving_average_array[time_step]]
+						+ list(health.telemetry_values()) + [aligned_time - time_start_logging]
+						+ list(aligned_values))
+
+					previous_log = time.time()
+					time_step_lastpretest = time_step
+					time_step += 1
+
+				# end if ESC is pressed
+				if msvcrt.kbhit():
+					if ord(msvcrt.getch()) == 27:
+						break
+
+			# ------
+			# define additional parameters for start of test
+			# ------
+
+			bool_start_test = True
+			start_message = "start_test"
+			bool_PID_active = False
+			time_start_test = time.time()
+			previous_log = time_start_test
+			previous_tick_start = time_start_test
+			previous_inner_tick = time_start_test
+			ihf_measured = 0
+			print("\nStarting lamps")
+
+			# time of the ramp during which the relay auto-tuning held the lamps
+			time_ramp_paused = 0.0
+			time_ramp_autotune = None
+
+			# ------
+			# continue an unfinished test from the state of its last journal record
+			# ------
+			if resume:
+				now = time.time()
+				gap = now - journal_state["time"]
+
+				# arrays of the rows recorded until the journal record (each row has
+				# the IHF sent after its reading)
+				time_step = min(journal_state["time_step"], len(recorded["time_seconds"]))
+				t_array[:time_step] = recorded["time_seconds"][:time_step]
+				mass[:time_step] = recorded["mass_g"][:time_step]
+				mlr[:time_step] = recorded["mlr_g/m-2s-1"][:time_step]
+				mlr_moving_average_array[:time_step] = recorded["mlr_movingaverage_gm-2s-1"][:time_step]
+				IHF_volts[1:time_step+1] = recorded["IHF_volts"][:time_step]
+				IHF[1:time_step+1] = recorded["IHF_kwm-2"][:time_step]
+
+				# the terms of the PID are only in the pickle
+				try:
+					with open(f"{full_name_of_file.split('.csv')[0]}.pkl", "rb") as pickle_handle:
+						previous_data = pickle.load(pickle_handle)
+					for key, array in [("PID_proportional", PID_proportional_term_array),
+						("PID_integral", PID_integral_term_array),
+						("PID_derivative", PID_derivative_term_array)]:
+						array[:time_step] = previous_data[key][:time_step]
+				except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+					print("The terms of the PID before the restart are lost")
+
+				# times of the test in the time.time() scale of the journal
+				time_start_logging = journal_state["time_start_logging"]
+				time_start_test = journal_state["time_start_test"]
+				time_step_lastpretest = journal_state["time_step_lastpretest"]
+
+				# controller
+				PID_state = journal_state["PID_state"]
+				PID_kp, PID_ki, PID_kd = journal_state["PID_gains"]
+				gains_source = journal_state["gains_source"]
+				schedule_reference_voltage = journal_state["schedule_reference_voltage"]
+				mlr_desired = journal_state["mlr_desired"]
+				previous_segment = journal_state["previous_segment"]
+				voltage_output = journal_state["voltage_output"]
+				time_ramp_paused = journal_state["time_ramp_paused"]
+
+				# the relay auto-tuning is started again from the ramp where the relay
+				# started, the PID continues with its integral and last input (its
+				# time restarts so the gap is not integrated)
+				bool_autotune = PID_state == "autotune"
+				if bool_autotune:
+					PID_state = "not_active"
+					time_ramp_paused = now - time_start_logging - \
+						t_array[time_step_lastpretest] - journal_state["time_ramp_autotune"]
+				elif PID_state == "active":
+					time_PID_activation = journal_state["time_PID_activation"]
+					previous_pid_time = now
+					last_error = journal_state["last_error"]
+					last_input = journal_state["last_input"]
+					pid_integral_term = journal_state["pid_integral_term"]
+					pid_proportional_term = 0
+					pid_derivative_term = 0
+					ihf_setpoint = journal_state["ihf_setpoint"]
+					inner_loop.reset(now, ihf_measured)
+					inner_loop.integral_term = journal_state["inner_loop_integral"]
+					if gain_scheduling != "off":
+						schedule = build_gain_schedule(PID_kp, PID_ki, PID_kd,
+							schedule_reference_voltage, coeff_voltstohf, lamp_models,
+							min_lamp_voltage, max_lamp_voltage, gain_scheduling)
+
+				# the lamps are set again and the gap is marked in the next row
 				logger.write(':SOURce:VOLTage %G,(%s)' % (voltage_output, '@304'))
-
-				# write data to the csv file
-				if bool_start_test:
-					writer.writerows([[t_array[time_step], mass[time_step], 
-						voltage_output, IHF[time_step+1],
-						mlr[time_step], mlr_moving_average, 
-						"start_test", PID_state]])
-					bool_start_test = False
-				else:
-					writer.writerows([[t_array[time_step], mass[time_step], 
-						voltage_output, IHF[time_step+1],
-						mlr[time_step], mlr_moving_average, 
-						"", PID_state]])
-
-				# save data as a a dict in a pickle to be read and plotted by another algorithm
-				data_for_pickle = {"time":t_array,
-									"IHF": IHF,
-									"IHF_volts": IHF,
-									"mlr": mlr,
-									"mlr_moving_average": mlr_moving_average_array,
-									"time_step": time_step,
-									"PID_proportional":PID_proportional_term_array,
-									"PID_integral": PID_integral_term_array,
-									"PID_derivative": PID_derivative_term_array,
-									}
-				with open(f"{full_name_of_file.split('.csv')[0]}.pkl", "wb") as handle:
-					pickle.dump(data_for_pickle, handle)
-
-				# print the result of this iteration to the terminal window
-				print(f"\nPID state: {PID_state}")
-				print(f"time:{np.round(time.time() - time_start_test,4)}")
-				print(f"IHF:{np.round(IHF[time_step+1],4)}")
-				print(f"mass: {mass[time_step]}")
-				print(f"mlr:{np.round(mlr_moving_average,4)}\n")
-
-				previous_log = time.time()
-
-				time_step += 1
+				start_message = f"resume_after_{gap:.1f}s"
+				journal.mark_resume(gap, now)
+				update_run_metadata(full_name_of_file, {
+					"PID_gains": {"kp": PID_kp, "ki": PID_ki, "kd": PID_kd},
+					"gains_source": gains_source,
+					"resumes": read_run_metadata(full_name_of_file).get("resumes", []) + [
+						{"time": now - time_start_logging, "gap": gap}]})
+				print(f"Test resumed after {gap:.1f} seconds without logging")
+
+			if bool_autotune:
+				print(f"The PID is auto-tuned once the mlr reaches {autotune_start_fraction} "
+					"of the setpoint")
+
+			# the status is redrawn by its own thread so the loop never waits for the console
+			status = ConsoleStatus(status_rate).start()
+
+			while True:
+				try:
+
+					# enforce a maximum logging frequency given by 1/time_logging_period
+					if time.time() - previous_log < time_logging_period:
+
+						# the inner loop of the cascade runs between the ticks of the outer loop
+						if (cascade_control == "gauge") and (
+							time.time() - previous_inner_tick >= inner_loop_period):
+							previous_inner_tick = time.time()
+							ihf_measured = DataLogger.query_heat_flux_gauge(
+								logger) / hf_gauge_factor
+							aligner.record("heat_flux_gauge", [ihf_measured], previous_inner_tick,
+								time.time())
+							health.record("heat_flux_gauge", [ihf_measured],
+								previous_inner_tick - time_start_logging)
+
+							if PID_state == "active":
+								voltage_output = inner_loop.update(ihf_setpoint, ihf_measured,
+									previous_inner_tick)
+								t_request = time.time()
+								logger.write(':SOURce:VOLTage %G,(%s)' % (voltage_output, '@304'))
+								aligner.record("lamps", [voltage_output], t_request, time.time())
+					else:
+
+						# record time for this reading
+						tick_start = time.time()
+						watchdog.beat()
+
+						# the lamps were turned off by the watchdog during a stall of the
+						# loop, the PID restarts its time so that the stall is not integrated
+						bool_stall = watchdog.stall_count != stall_count
+						if bool_stall:
+							stall_count = watchdog.stall_count
+							status.log("\n-----\nLOOP STALLED, the lamps were turned off\n-----\n")
+							if PID_state == "active":
+								previous_pid_time = tick_start
+
+						t_array[time_step] = time.time() - time_start_logging
+
+						# query mass and update array
+						t_request = time.time()
+						mass[time_step] = load_cell.query_weight()
+						aligner.record("load_cell", [mass[time_step]], t_request, time.time())
+						health.record("load_cell", [mass[time_step]], t_array[time_step])
+				
+						# calculate mlr and force all negative readings to zero
+						mlr[time_step] = - np.round((mass[time_step] - mass[time_step-1]) / 
+							(t_array[time_step] - t_array[time_step-1])/surface_area,1)
+						mlr_moving_average = mlr[time_step - averaging_window:time_step].mean()
+						mlr_moving_average_array[time_step] = mlr_moving_average
+
+						mlr_feedback = mlr_moving_average
+						if smith_predictor:
+							mlr_feedback = smith.update(mlr_moving_average, IHF_volts[time_step])
+						input_mlr = mlr_feedback
+
+						# programmed setpoint
+						profile_event = ""
+						if (PID_state == "active") and (setpoint_schedule is not None):
+							time_profile = time.time() - time_PID_activation
+							previous_segment, profile_event = setpoint_schedule.event(
+								previous_segment, time_profile)
+							mlr_desired = setpoint_schedule.setpoint(time_profile)
+
+						# forcefully remove the error if we are epsilon percent from the desired value
+						current_error = mlr_desired - mlr_feedback
+						if np.abs(mlr_feedback - mlr_desired) < epsilon * mlr_desired:
+							input_mlr = mlr_desired
+
+						# relay auto-tuning during the ramp
+						if PID_state == "autotune":
+							voltage_output = tuner.update(time.time() - time_start_test, mlr_feedback)
+							IHF_volts[time_step+1] = voltage_output
+							IHF[time_step+1] = np.polyval(
+								coeff_voltstohf, IHF_volts[time_step+1])
+
+							if tuner.done:
+								autotune_result = tuner.result()
+								if autotune_result is None:
+									status.log("\n-----\nAUTO-TUNE FAILED, configured gains are used\n-----\n")
+								else:
+									PID_kp = autotune_result["kp"]
+									PID_ki = autotune_result["ki"]
+									PID_kd = autotune_result["kd"]
+									gains_source = "autotune"
+									schedule_reference_voltage = autotune_result["bias_voltage"]
+									save_cached_gains("N2", material, autotune_result)
+									status.log(f"\n-----\nAUTO-TUNE FINISHED: kp = {PID_kp:.4f}, "
+										f"ki = {PID_ki:.4f}, kd = {PID_kd:.4f}\n-----\n")
+								update_run_metadata(full_name_of_file, {"autotune": autotune_result,
+									"PID_gains": {"kp": PID_kp, "ki": PID_ki, "kd": PID_kd},
+									"gains_source": gains_source})
+
+								# the ramp continues from where the relay started and the
+								# duration of the test does not include the tuning
+								PID_state = "not_active"
+								bool_autotune = False
+								time_ramp_paused = t_array[time_step] - \
+									t_array[time_step_lastpretest] - time_ramp_autotune
+								time_start_test += time.time() - time_start_autotune
+
+						# start with a ramped IHF, and once mlr reaches 0.8*mlr_desired, activate PID
+						elif PID_state == "not_active":
+							time_ramp = t_array[time_step] - t_array[time_step_lastpretest] - \
+								time_ramp_paused
+							IHF[time_step+1] = ramp_schedule.setpoint(time_ramp)
+							if bool_programmed_IHF:
+								previous_segment, profile_event = ramp_schedule.event(
+									previous_segment, time_ramp)
+							IHF_volts[time_step+1] = np.polyval(
+								coeff_hftovolts,IHF[time_step+1])
+							voltage_output = IHF_volts[time_step+1]
+
+							if voltage_output > max_lamp_voltage:
+								voltage_output = max_lamp_voltage
+								IHF_volts[time_step+1] = max_lamp_voltage
+								IHF[time_step+1] = np.polyval(
+									coeff_voltstohf, IHF_volts[time_step+1])
+
+							# the relay starts from the voltage of the ramp once the sample
+							# pyrolyses close to the setpoint
+							if bool_autotune and (
+								mlr_moving_average > autotune_start_fraction*mlr_desired):
+								PID_state = "autotune"
+								time_ramp_autotune = time_ramp
+								time_start_autotune = time.time()
+								tuner = RelayAutoTuner(mlr_desired, voltage_output,
+									autotune_relay_amplitude, autotune_hysteresis, autotune_cycles,
+									autotune_max_duration, max_lamp_voltage = max_lamp_voltage,
+									min_lamp_voltage = min_lamp_voltage,
+									max_half_period = autotune_max_half_period)
+								status.log("\n-----\nAUTO-TUNING THE PID\n-----\n")
+
+							# the lamps follow programmed IHF until the end
+							elif (mlr_moving_average > 0.95*mlr_desired) and not bool_programmed_IHF:
+								PID_state = "active"
+								status.log("\n-----\nPID ACTIVE\n-----\n")
+
+								# set pid parameters
+								time_PID_activation = time.time()
+								previous_pid_time = time.time()
+								last_error = mlr_desired - mlr_moving_average
+								last_input = mlr_feedback
+								pid_integral_term = voltage_output
+								pid_proportional_term = 0
+								pid_derivative_term = 0
+
+								# the inner loop starts from the IHF of the ramp
+								ihf_setpoint = IHF[time_step+1]
+								inner_loop.reset(time.time(), ihf_measured)
+
+								# gains of every operating point from the final gains
+								if gain_scheduling != "off":
+									schedule = build_gain_schedule(PID_kp, PID_ki, PID_kd,
+										schedule_reference_voltage, coeff_voltstohf, lamp_models,
+										min_lamp_voltage, max_lamp_voltage, gain_scheduling)
+									update_run_metadata(full_name_of_file,
+										{"gain_schedule": schedule.as_dict()})
+
+
+						# call PID
+						elif PID_state == "active":
+
+							# gains at the current operating point
+							pid_kp, pid_ki, pid_kd = PID_kp, PID_ki, PID_kd
+							if gain_scheduling == "voltage":
+								pid_kp, pid_ki, pid_kd = schedule.gains(IHF_volts[time_step])
+							elif gain_scheduling == "IHF":
+								pid_kp, pid_ki, pid_kd = schedule.gains(IHF[time_step])
+
+							voltage_output, previous_pid_time, last_error, pid_proportional_term, \
+							pid_integral_term, pid_derivative_term = \
+													PID(
+													input_mlr, mlr_desired, previous_pid_time, 
+													last_error, last_input, pid_integral_term, pid_kp, pid_ki, pid_kd,
+													max_lamp_voltage, min_lamp_voltage)
+							IHF_volts[time_step+1] = voltage_output
+							IHF[time_step+1] = np.polyval(
+								coeff_voltstohf, IHF_volts[time_step+1])
+							last_input = mlr_feedback
+
+							# the IHF of the PID output in the calibration is the setpoint
+							# of the inner loop, which sets the lamp voltage
+							if cascade_control != "off":
+								ihf_setpoint = IHF[time_step+1]
+								voltage_output = inner_loop.update(ihf_setpoint, ihf_measured,
+									time.time())
+								IHF_volts[time_step+1] = voltage_output
+
+							PID_proportional_term_array[time_step] = pid_proportional_term
+							PID_integral_term_array[time_step] = pid_integral_term
+							PID_derivative_term_array[time_step] = pid_derivative_term
+
+						# write IHF to the lamps
+						t_request = time.time()
+						logger.write(':SOURce:VOLTage %G,(%s)' % (voltage_output, '@304'))
+						aligner.record("lamps", [voltage_output], t_request, time.time())
+
+						# write data to the csv file (with the segments of the setpoint profile
+						# and the stalls of the loop)
+						message = profile_event
+						if profile_event:
+							status.log(f"\n-----\n{profile_event}\n-----\n")
+						if bool_stall:
+							message = f"{message} watchdog_stall".strip()
+						if bool_start_test:
+							writer.writerows([[t_array[time_step], mass[time_step], 
+								voltage_output, IHF[time_step+1],
+								mlr[time_step], mlr_moving_average, 
+								f"{start_message} {message}".strip(), PID_state, ihf_measured]])
+							bool_start_test = False
+						else:
+							writer.writerows([[t_array[time_step], mass[time_step], 
+								voltage_output, IHF[time_step+1],
+								mlr[time_step], mlr_moving_average, 
+								message, PID_state, ihf_measured]])
+						aligned_time, aligned_values = aligner.sample_latest()
+						telemetry.publish(t_array[time_step], [t_array[time_step], mass[time_step],
+							voltage_output, IHF[time_step+1],
+							mlr[time_step], mlr_moving_average] + list(health.telemetry_values())
+							+ [aligned_time - time_start_logging] + list(aligned_values))
+
+						# save data as a a dict in a pickle to be read and plotted by another algorithm
+						data_for_pickle = {"time":t_array,
+											"IHF": IHF,
+											"IHF_volts": IHF,
+											"mlr": mlr,
+											"mlr_moving_average": mlr_moving_average_array,
+											"time_step": time_step,
+											"PID_proportional":PID_proportional_term_array,
+											"PID_integral": PID_integral_term_array,
+											"PID_derivative": PID_derivative_term_array,
+											}
+						with open(f"{full_name_of_file.split('.csv')[0]}.pkl", "wb") as pickle_handle:
+							pickle.dump(data_for_pickle, pickle_handle)
+
+						# state to resume the test from (the row of this tick is on the disk)
+						if journal.due(time.time()):
+							handle.flush()
+							active = PID_state == "active"
+							journal.record({"time_step": time_step + 1,
+								"csv_offset": handle.tell(),
+								"time_start_logging": time_start_logging,
+								"time_start_test": time_start_test,
+								"time_step_lastpretest": time_step_lastpretest,
+								"time_ramp_paused": time_ramp_paused,
+								"time_ramp_autotune": time_ramp_autotune,
+								"PID_state": PID_state,
+								"PID_gains": [PID_kp, PID_ki, PID_kd],
+								"gains_source": gains_source,
+								"schedule_reference_voltage": schedule_reference_voltage,
+								"mlr_desired": mlr_desired,
+								"previous_segment": previous_segment,
+								"voltage_output": voltage_output,
+								"time_PID_activation": time_PID_activation if active else None,
+								"last_error": last_error if active else None,
+								"last_input": last_input if active else None,
+								"pid_integral_term": pid_integral_term if active else None,
+								"ihf_setpoint": ihf_setpoint if active else None,
+								"inner_loop_integral": inner_loop.integral_term if active else None},
+								time.time())
+
+						# hand the latest values over to the status thread
+						status.update({"PID state": PID_state,
+							"time [s]": time.time() - time_start_test,
+							"MLR setpoint": mlr_desired,
+							"MLR moving average": mlr_moving_average,
+							"PID input": input_mlr,
+							"mass": mass[time_step],
+							"IHF": IHF[time_step+1],
+							"IHF measured": ihf_measured,
+							"lamp voltage": voltage_output,
+							"PID proportional": PID_proportional_term_array[time_step],
+							"PID integral": PID_integral_term_array[time_step],
+							"PID derivative": PID_derivative_term_array[time_step],
+							"loop period [ms]": 1000*(tick_start - previous_tick_start),
+							"tick duration [ms]": 1000*(time.time() - tick_start),
+							"watchdog stalls": stall_count,
+							"channel alarms": health.alarms()})
+						previous_tick_start = tick_start
+
+						previous_log = time.time()
+
+						time_step += 1
+
+					# end after the duration of the test (unattended tests)
+					if (test_duration is not None) and (time.time() - time_start_test > test_duration):
+						writer.writerows([["", "", "", "", "end_test"]])
+						break
  
-			# end if ESC is pressed
-			if msvcrt.kbhit():
-				if ord(msvcrt.getch()) == 27:
-					writer.writerows([["", "", "", "", "end_test"]])
-					break
-
-		## ---- handle an exception during testing and continue logging the data
-		except Exception as e:
-			print(f"\nInstantaneous error at {np.round(time.time() - time_start_logging, 2)} seconds")
-			print(f"Error:{e}")
-			print("\nLogging continues")
-
-
-			# end if ESC is pressed
-			if msvcrt.kbhit():
-				if ord(msvcrt.getch()) == 27:
-					writer.writerows([["", "", "", "", "","end_test"]])
-					break
-
-
-#####
-# CLOSE CONNECTION TO THE LOGGER, TURN OFF LAMPS AND FINISH THE EXPERIMENT
-#####
-
-# turn off the lamps and close the instrument
-logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
-logger.close()
-rm.close()
-
-# finish the experiment
-print("\n\nExperiment finished")
-print(f"Total duration = {np.round((time.time() - time_start_logging)/60,1)} minutes")
-
+					# end if ESC is pressed
+					if msvcrt.kbhit():
+						if ord(msvcrt.getch()) == 27:
+							writer.writerows([["", "", "", "", "end_test"]])
+							break
+
+				## ---- handle an exception during testing and continue logging the data
+				except Exception as e:
+					status.log(f"\nInstantaneous error at {np.round(time.time() - time_start_logging, 2)} seconds"
+						f"\nError:{e}\nLogging continues")
+
+
+					# end if ESC is pressed
+					if msvcrt.kbhit():
+						if ord(msvcrt.getch()) == 27:
+							writer.writerows([["", "", "", "", "","end_test"]])
+							break
+
+			bool_completed = True
+
+		finally:
+			# the lamps are turned off and the status thread, the telemetry port, the
+			# watchdog process and the journal are released even if the test failed
+			# (a failed test is marked as aborted and is not resumed)
+			try:
+				logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+			except Exception as e:
+				print(f"\nThe lamps could not be turned off: {e}")
+			if status is not None:
+				status.stop()
+			if telemetry is not None:
+				telemetry.close()
+			stalls = [] if watchdog is None else watchdog.stop()
+			if journal is not None:
+				if bool_completed:
+					journal.finish()
+				else:
+					journal.abort()
+
+
+	#####
+	# FINISH THE EXPERIMENT (the lamps are off)
+	#####
+
+	# start of the logging (to place the test in its campaign) and stalls of the loop
+	channel_health = health.summary()
+	update_run_metadata(full_name_of_file, {"time_start_logging": time_start_logging,
+		"watchdog_deadline": watchdog_deadline,
+		"stalls": [{"time": stall["start"] - time_start_logging,
+			"duration": stall["duration"]} for stall in stalls],
+		"channel_health": channel_health})
+	if stalls:
+		print(f"\nThe loop stalled {len(stalls)} times, longest "
+			f"{max(stall['duration'] for stall in stalls):.1f} s")
+	for name, statistics in channel_health.items():
+		if statistics["out_of_range"] or statistics["stuck_readings"]:
+			print(f"{name}: {statistics['out_of_range']} readings out of range, "
+				f"{statistics['stuck_readings']} stuck readings")
+
+	# resample all the channels onto a common time base
+	time_base, aligned_values = aligner.align(period=time_logging_period)
+	with open(f"{full_name_of_file.split('.csv')[0]}_aligned.csv", "w", newline = "") as handle:
+		writer = csv.writer(handle)
+		writer.writerow(["time_seconds"] + aligner.channel_names)
+		writer.writerows(np.column_stack([time_base - time_start_logging, aligned_values]))
+
+	# min/max levels of the recorded channels to view the test (and its campaign)
+	# at any zoom, see downsampling_pyramid.py
+	build_pyramid_for_test(full_name_of_file)
+
+	# finish the experiment
+	print("\n\nExperiment finished")
+	print(f"Total duration = {np.round((time.time() - time_start_logging)/60,1)} minutes")
+
+	return full_name_of_file
+
+
+if __name__ == "__main__":
+
+	# an unfinished test is only resumed if the operator confirms it and it was
+	# interrupted shortly before this restart, otherwise it is marked as aborted
+	# and a new test is requested
+	time_restart = time.time()
+	full_name_of_file, test = find_unfinished_test()
+	if full_name_of_file is not None and not confirm_resume(full_name_of_file, time_restart):
+		full_name_of_file, test = None, None
+	load_cell, rm, logger = connect_instruments()
+	if test is None:
+		test = request_test(setpoint_profile)
+	else:
+		print(f"\nResuming {full_name_of_file}")
+
+	if test is not None:
+		run_test(load_cell, logger, test, load_calibrations(),
+			resume = full_name_of_file is not None)
+
+	# turn off the lamps and close the instrument
+	logger.write(':SOURce:VOLTage %G,(%s)' % (0.0, '@304'))
+	logger.close()
+	rm.close()